@@ -0,0 +1,66 @@
+import queue
+import threading
+
+from run_control import RunCancelled
+
+# Kinds of events put on BackgroundWorker.events
+PROGRESS = 'progress'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class BackgroundWorker:
+    """Runs one pipeline job at a time on a background thread.
+
+    The worker never touches Tk; it puts (kind, payload) tuples on ``events``, which the
+    GUI drains from its own event loop. The pipeline modules, with langchain, FAISS, tiktoken
+    and PyPDF2 behind them, are only imported by the first run or by ``warm_up``, so they do
+    not delay the window from showing.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, tool_config):
+        if self.is_running():
+            raise RuntimeError("A run is already in progress.")
+        self._cancel_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(tool_config, self._cancel_event), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def warm_up(self):
+        """Imports the pipeline in a background thread, so that the first run starts without the delay."""
+        threading.Thread(target=warm_up_pipeline, daemon=True).start()
+
+    def _run(self, tool_config, cancel_event):
+        try:
+            # Waits for a warm-up still in progress instead of importing twice
+            from pipeline_runner import run_tool
+
+            summary = run_tool(tool_config, lambda event: self.events.put((PROGRESS, event)), cancel_event)
+            self.events.put((DONE, summary))
+        except RunCancelled:
+            self.events.put((CANCELLED, None))
+        except Exception as e:
+            self.events.put((FAILED, e))
+
+
+def warm_up_pipeline():
+    try:
+        import pipeline_runner  # noqa: F401
+        from token_chunker import CHUNK_ENCODING, get_encoding
+
+        # Loads the token encoding, which tiktoken reads from its cache or downloads once
+        get_encoding(CHUNK_ENCODING)
+    except Exception:
+        # Only an optimisation: a run imports the pipeline again and reports what fails
+        pass
@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from coding_pipeline import CodingPipeline
+from concept_coding import JSON_RESPONSE_FORMAT, InvalidCodingOutput, parse_codes
+from file_utils import FileUtils
+from results_saver import ResultsSaver
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class BatchRequestPipeline(CodingPipeline):
+    """Builds the same prompts as CodingPipeline but writes them to a chat-completions batch file.
+
+    Every request gets a ``custom_id`` made from the file's position and content hash, and
+    a manifest next to the requests file maps the ids back to the files so that
+    ``ingest_results`` can save the answers through ResultsSaver later. Multi-concept
+    requests ask for JSON mode, and their answers are validated and fanned out on ingest.
+    A file that cannot be read is listed under ``failed`` in the manifest and gets no request.
+    """
+
+    def __init__(self, tool_config, requests_path, run_control=None):
+        super().__init__(tool_config, run_control)
+        self.requests_path = requests_path
+        self._requests_file = None
+        self._manifest_entries = []
+        self._failed_entries = []
+
+    def run(self):
+        with open(self.requests_path, 'w', encoding='utf-8') as self._requests_file:
+            asyncio.run(self._run())
+        self.response_cache.close()
+        self.embeddings.cache.close()
+
+        manifest = {
+            'requests_path': self.requests_path,
+            'concept': self.tool_config.concept_input,
+            'concepts': self.concepts,
+            'save_path': self.tool_config.save_path,
+            'result_format': self.tool_config.coding_result_format,
+            'requests': self._manifest_entries,
+            'failed': self._failed_entries,
+        }
+        with open(manifest_path_for(self.requests_path), 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        summary = f"{len(self._manifest_entries)} batch requests written to {self.requests_path}"
+        if self._failed_entries:
+            summary += f", {len(self._failed_entries)} file(s) failed and are listed in the manifest"
+        print(summary)
+        return summary
+
+    def _create_llm(self):
+        # Nothing is sent, so no client (and no API key) is needed
+        return None
+
+    def _file_failed(self, single_file, error):
+        print(f"{single_file} failed: {error}", file=sys.stderr)
+        self._failed_entries.append({'file': single_file, 'error': f"{type(error).__name__}: {error}"})
+
+    async def _complete(self, prompt, parse=None):
+        # Nothing is sent; the prompt itself becomes the request body
+        return prompt, 0
+
+    async def _map_reduce(self, single_file, prompt, raw_text, page_starts):
+        # The reduce request needs the section answers, which a batch file cannot provide; use retrieval instead
+        return await self._answer(await self._retrieved_prompt(single_file, prompt, raw_text, page_starts))
+
+    def _save_result(self, index, prompt):
+        single_file = self.files[index]
+        custom_id = f"doc-{index:05d}-{FileUtils.hash_file(single_file)[:16]}"
+        request = {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': BATCH_ENDPOINT,
+            'body': {
+                'model': self.model_name,
+                'temperature': self.temperature,
+                'messages': prompt.as_dicts(),
+            },
+        }
+        if self.concepts:
+            request['body']['response_format'] = JSON_RESPONSE_FORMAT
+        self._requests_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+        self._manifest_entries.append({'custom_id': custom_id, 'file': single_file})
+
+
+def manifest_path_for(requests_path):
+    return f"{requests_path}.manifest.json"
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as jsonl_file:
+        for line in jsonl_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def response_content(result):
+    # Failed requests are saved as an error message so that every file still gets a row
+    if result.get('error'):
+        return f"ERROR: {result['error'].get('message', result['error'])}"
+    response = result.get('response') or {}
+    if response.get('status_code') != 200:
+        return f"ERROR: batch request failed with status {response.get('status_code')}"
+    return response['body']['choices'][0]['message']['content']
+
+
+def ingest_results(manifest_path, results_path, save_path=None):
+    """Saves the answers of a batch results file through ResultsSaver, in the order of the manifest."""
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    responses = {result['custom_id']: response_content(result) for result in read_jsonl(results_path)}
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    save_path = save_path or manifest['save_path']
+
+    concepts = manifest.get('concepts')
+    with ResultsSaver.fully_automated(save_path, timestamp, manifest.get('result_format', 'txt'),
+                                      manifest['concept']) as results_saver:
+        for entry in manifest['requests']:
+            response = responses.get(entry['custom_id'], "ERROR: no result in the batch output")
+            if concepts and not response.startswith("ERROR: "):
+                try:
+                    results_saver.save_codes(entry['file'], parse_codes(response, concepts))
+                    continue
+                except InvalidCodingOutput as error:
+                    response = f"ERROR: invalid multi-concept answer: {error}"
+            results_saver.save_response(entry['file'], response)
+    return len(manifest['requests'])
+
+
+def placeholder_response(body):
+    return "1; Response from the local batch stand-in."
+
+
+def run_local_batch(requests_path, results_path, respond=placeholder_response):
+    """Local stand-in for the batch API: answers every request with ``respond(body)`` and writes a results file."""
+    with open(results_path, 'w', encoding='utf-8') as results_file:
+        for number, request in enumerate(read_jsonl(requests_path)):
+            body = request['body']
+            result = {
+                'id': f"batch_req_{number}",
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'request_id': f"local_{number}",
+                    'body': {
+                        'object': 'chat.completion',
+                        'model': body['model'],
+                        'choices': [{
+                            'index': 0,
+                            'message': {'role': 'assistant', 'content': respond(body)},
+                            'finish_reason': 'stop',
+                        }],
+                    },
+                },
+                'error': None,
+            }
+            results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest or simulate chat-completions batch files.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help="save the answers of a batch results file")
+    ingest_parser.add_argument('manifest', help="manifest written next to the requests file")
+    ingest_parser.add_argument('results', help="results JSONL downloaded from the batch job")
+    ingest_parser.add_argument('--save-path', help="overrides the save path recorded in the manifest")
+
+    simulate_parser = subparsers.add_parser('simulate', help="answer a requests file locally without the API")
+    simulate_parser.add_argument('requests')
+    simulate_parser.add_argument('results')
+
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        count = ingest_results(args.manifest, args.results, args.save_path)
+        print(f"{count} batch results saved.")
+    else:
+        run_local_batch(args.requests, args.results)
+        print(f"Results written to {args.results}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,707 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+from coding_pipeline import CodingPipeline, construct_prompt, document_prompt
+from context_retrieval_config import ContextRetrievalConfig
+from document_index_store import DocumentIndexStore, chunk_metadata
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from fake_openai_server import FakeOpenAIServer
+from file_utils import FileUtils
+from near_duplicates import DEFAULT_NEAR_DUPLICATE_THRESHOLD
+from pipeline_runner import AUTOMATED_CODING, CONTEXT_RETRIEVAL
+from prompt_components import PromptComponents
+from rate_limiter import RateLimiter, chat_tokens
+from results_saver import ResultsSaver
+from retrieval_pipeline import RetrievalPipeline, score_concepts
+from token_chunker import CHUNK_ENCODING, get_encoding
+from tool_config import DEFAULT_MAX_IN_FLIGHT, ToolConfig
+
+# Pages per synthetic document of each size
+CORPUS_SIZES = {'small': 2, 'medium': 20, 'large': 100}
+WORDS_PER_PAGE = 400
+WORDS_PER_LINE = 12
+EMBEDDING_DIMENSIONS = 1536
+# Texts per simulated embedding request, as OpenAIEmbeddings sends them
+EMBEDDING_BATCH_SIZE = 1000
+BENCHMARK_CONCEPTS = {
+    'automation': "Use of automation, robotics and digital systems to replace manual work processes.",
+    'risk': "Statements about risk management, internal control, audit findings and compliance.",
+}
+# Options that do not change what is measured, left out of the report's config
+REPORTING_OPTIONS = ('output', 'baseline', 'tolerance', 'skip_end_to_end', 'skip_rate_limits', 'skip_ingestion',
+                     'skip_near_duplicates')
+# Concurrent chat requests the rate limit scenarios allow before any rate limit response
+RATE_LIMIT_CONCURRENCY = 16
+# Differences below this many seconds are timer noise rather than regressions
+MIN_REGRESSION_SECONDS = 0.01
+# Import times of a fresh interpreter vary by tens of milliseconds between runs
+MIN_STARTUP_REGRESSION_SECONDS = 0.05
+# What each startup measurement imports in a fresh interpreter: the GUI module up to its window,
+# and the pipeline that the first run loads
+STARTUP_IMPORTS = {
+    'gui': "import runpy; runpy.run_path('llm-coder.py', run_name='llm_coder_gui')",
+    'pipeline': "import pipeline_runner",
+}
+# Measurements per entry point; the fastest is kept, since slower ones only add disk and scheduler noise
+STARTUP_REPEATS = 5
+# Packages listed in the import-time breakdown of every entry point
+STARTUP_TOP_PACKAGES = 10
+# Distinct pages a large ingestion file repeats until it reaches its size
+INGESTION_PAGES = 64
+# Companies and years of the multi-year corpus of the near-duplicate scenarios
+NEAR_DUPLICATE_COMPANIES = 3
+NEAR_DUPLICATE_YEARS = 5
+# Pages of boilerplate every report of a company repeats, and pages written for each year
+BOILERPLATE_PAGES = 6
+YEAR_PAGES = 2
+# Below every relevance score, so that the near-duplicate scenarios save the best chunks of every report
+NEAR_DUPLICATE_MIN_SCORE = -1.0
+BENCHMARK_PROMPT = PromptComponents(
+    "You are a research assistant coding annual reports.",
+    "Rate how strongly the text discusses automation on a scale from 1 to 5.",
+    "<score>; <one sentence justification>")
+
+
+class SimulatedEmbeddings(Embeddings):
+    """Deterministic stand-in for OpenAIEmbeddings that sleeps ``latency`` seconds per request.
+
+    The vector of a text is seeded by its hash, so runs are reproducible and identical
+    texts get identical vectors.
+    """
+
+    def __init__(self, latency=0.0, dimensions=EMBEDDING_DIMENSIONS, batch_size=EMBEDDING_BATCH_SIZE):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.model = "simulated-embedding"
+        self.requests = 0
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        requests = -(-len(texts) // self.batch_size)
+        self.requests += requests
+        self.texts += len(texts)
+        time.sleep(self.latency * requests)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts):
+        requests = -(-len(texts) // self.batch_size)
+        self.requests += requests
+        self.texts += len(texts)
+        await asyncio.sleep(self.latency * requests)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class SimulatedChatModel:
+    """Deterministic stand-in for ChatOpenAI.ainvoke that answers after ``latency`` seconds.
+
+    Like the OpenAI prompt cache, it reports a system message it has seen before as cached
+    prompt tokens once it is at least 1024 tokens long, in steps of 128 tokens.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self._seen_prefixes = set()
+
+    async def ainvoke(self, messages, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        text = "\n".join(message.content for message in messages)
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        content = f"{digest[0] % 5 + 1}; Simulated response."
+        # Roughly four characters per token, as for English text
+        prompt_tokens = len(text) // 4
+        prefix = messages[0].content
+        prefix_tokens = len(prefix) // 4
+        cached_tokens = prefix_tokens // 128 * 128 if prefix in self._seen_prefixes and prefix_tokens >= 1024 else 0
+        self._seen_prefixes.add(prefix)
+        return AIMessage(content=content, response_metadata={'token_usage': {
+            'prompt_tokens': prompt_tokens, 'completion_tokens': 8, 'total_tokens': prompt_tokens + 8,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens}}})
+
+
+class StageTimer:
+    """Collects wall time, item counts and peak RSS per benchmark stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage, unit):
+        record = {'unit': unit, 'items': 0}
+        started = time.perf_counter()
+        yield record
+        seconds = time.perf_counter() - started
+        record['seconds'] = round(seconds, 6)
+        record['per_second'] = round(record['items'] / seconds, 3) if seconds > 0 else None
+        record['peak_rss_mb'] = peak_rss_mb()
+        self.stages[stage] = record
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process and of finished worker processes so far
+    return maxrss_mb(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                         resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss))
+
+
+def maxrss_mb(maxrss):
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    divisor = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return round(maxrss / divisor, 1)
+
+
+def generate_corpus(directory, sizes, docs_per_size, formats, seed=0):
+    """Writes reproducible synthetic reports and returns their paths.
+
+    Pages mix filler words with the vocabulary of the benchmark concepts, so retrieval
+    has something to find.
+    """
+    rng = random.Random(seed)
+    filler = [''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+              for _ in range(5000)]
+    topical = sorted({word.strip('.,').lower() for description in BENCHMARK_CONCEPTS.values()
+                      for word in description.split() if len(word) > 3})
+
+    files = []
+    for size in sizes:
+        for number in range(docs_per_size):
+            for file_format in formats:
+                pages = []
+                for _ in range(CORPUS_SIZES[size]):
+                    words = [rng.choice(topical) if rng.random() < 0.05 else rng.choice(filler)
+                             for _ in range(WORDS_PER_PAGE)]
+                    lines = [' '.join(words[start:start + WORDS_PER_LINE])
+                             for start in range(0, len(words), WORDS_PER_LINE)]
+                    pages.append(lines)
+                path = os.path.join(directory, f"{size}_{number:02d}.{file_format}")
+                if file_format == 'pdf':
+                    write_pdf(path, pages)
+                else:
+                    with open(path, 'w', encoding='utf-8') as text_file:
+                        text_file.write('\n\n'.join('\n'.join(lines) for lines in pages))
+                files.append(path)
+    return files
+
+
+def write_large_text(path, megabytes, seed=0):
+    # A .txt file of about ``megabytes`` MB made of INGESTION_PAGES synthetic pages repeated
+    rng = random.Random(seed)
+    filler = [''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+              for _ in range(5000)]
+    pages = ['\n'.join(' '.join(rng.choice(filler) for _ in range(WORDS_PER_LINE))
+                       for _ in range(WORDS_PER_PAGE // WORDS_PER_LINE)) + '\n\n'
+             for _ in range(INGESTION_PAGES)]
+    written = 0
+    with open(path, 'w', encoding='utf-8') as text_file:
+        while written < megabytes * 1024 * 1024:
+            page = pages[rng.randrange(INGESTION_PAGES)]
+            text_file.write(page)
+            written += len(page)
+
+
+def generate_multi_year_corpus(directory, seed=0):
+    """Writes a .txt report per company and year and returns their paths.
+
+    The reports of a company share BOILERPLATE_PAGES pages that differ only in the year
+    they mention, followed by YEAR_PAGES pages of their own.
+    """
+    rng = random.Random(seed)
+    filler = [''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+              for _ in range(5000)]
+    topical = sorted({word.strip('.,').lower() for description in BENCHMARK_CONCEPTS.values()
+                      for word in description.split() if len(word) > 3})
+
+    def page():
+        return [rng.choice(topical) if rng.random() < 0.05 else rng.choice(filler) for _ in range(WORDS_PER_PAGE)]
+
+    files = []
+    for company in range(NEAR_DUPLICATE_COMPANIES):
+        boilerplate = [page() for _ in range(BOILERPLATE_PAGES)]
+        for year in range(2020, 2020 + NEAR_DUPLICATE_YEARS):
+            pages = []
+            for words in boilerplate + [page() for _ in range(YEAR_PAGES)]:
+                # Every 100th word of a page is the year of the report
+                words = [str(year) if position % 100 == 0 else word for position, word in enumerate(words)]
+                pages.append('\n'.join(' '.join(words[start:start + WORDS_PER_LINE])
+                                       for start in range(0, len(words), WORDS_PER_LINE)))
+            path = os.path.join(directory, f"company_{company:02d}_{year}.txt")
+            with open(path, 'w', encoding='utf-8') as text_file:
+                text_file.write('\n\n'.join(pages))
+            files.append(path)
+    return files
+
+
+def write_pdf(path, pages):
+    # Minimal PDF with one Helvetica text object per page; the text must not contain parentheses or backslashes
+    page_count = len(pages)
+    font_id = 3 + 2 * page_count
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>",
+               f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(page_count))}] "
+               f"/Count {page_count} >>"]
+    for number, lines in enumerate(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * number} 0 R >>")
+        stream = "BT /F1 9 Tf 11 TL 40 760 Td " + " T* ".join(f"({line}) Tj" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    content = "%PDF-1.4\n"
+    offsets = []
+    for number, pdf_object in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{pdf_object}\nendobj\n"
+    xref_offset = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    content += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+    with open(path, 'w', encoding='latin-1') as pdf_file:
+        pdf_file.write(content)
+
+
+@contextlib.contextmanager
+def benchmark_workspace():
+    # Runs everything in a scratch directory with its own prompt_config.ini and caches
+    previous_directory = os.getcwd()
+    previous_key = os.environ.get('OPENAI_API_KEY')
+    with tempfile.TemporaryDirectory(prefix="llm_coder_benchmark_") as directory:
+        with open(os.path.join(directory, "prompt_config.ini"), 'w', encoding='utf-8') as config_file:
+            config_file.write("[Concepts]\n" + ''.join(f"{concept} = {description}\n"
+                                                       for concept, description in BENCHMARK_CONCEPTS.items()))
+        os.chdir(directory)
+        # The OpenAI clients are created but never called
+        os.environ.setdefault('OPENAI_API_KEY', "benchmark")
+        try:
+            yield directory
+        finally:
+            os.chdir(previous_directory)
+            if previous_key is None:
+                os.environ.pop('OPENAI_API_KEY', None)
+
+
+def run_stages(files, args, workspace):
+    """Times every stage of the pipelines on its own, in pipeline order."""
+    timer = StageTimer()
+    embeddings = CachedEmbeddings(SimulatedEmbeddings(args.embedding_latency),
+                                  EmbeddingCache(os.path.join(workspace, "stage_embeddings.sqlite")))
+    llm = SimulatedChatModel(args.llm_latency)
+
+    with timer.measure('extraction', 'docs') as record:
+        pages_by_file = {single_file: FileUtils.read_pages(single_file) for single_file in files}
+        record['items'] = len(files)
+    texts = {single_file: ''.join(pages) for single_file, pages in pages_by_file.items()}
+
+    with timer.measure('tokenization', 'tokens') as record:
+        encoding = get_encoding(CHUNK_ENCODING)
+        record['items'] = sum(len(encoding.encode(text, disallowed_special=())) for text in texts.values())
+
+    with timer.measure('splitting', 'chunks') as record:
+        chunks_by_file = {}
+        for single_file, pages in pages_by_file.items():
+            page_starts = FileUtils.page_starts(pages) if FileUtils.is_pdf_file(single_file) else None
+            records = FileUtils.split_text(texts[single_file], args.chunk_size, args.chunk_overlap, page_starts)
+            chunks_by_file[single_file] = (records, [chunk.text(texts[single_file]) for chunk in records])
+        record['items'] = sum(len(records) for records, _ in chunks_by_file.values())
+
+    with timer.measure('embedding', 'chunks') as record:
+        vectors_by_file = {single_file: embeddings.embed_documents(chunk_texts)
+                           for single_file, (_, chunk_texts) in chunks_by_file.items()}
+        record['items'] = sum(len(vectors) for vectors in vectors_by_file.values())
+
+    with timer.measure('indexing', 'chunks') as record:
+        stores = {single_file: FAISS.from_embeddings(list(zip(chunk_texts, vectors_by_file[single_file])),
+                                                     embeddings, chunk_metadata(records))
+                  for single_file, (records, chunk_texts) in chunks_by_file.items()}
+        record['items'] = sum(store.index.ntotal for store in stores.values())
+
+    concept_vectors = np.asarray(embeddings.embed_documents(list(BENCHMARK_CONCEPTS.values())), dtype=np.float32)
+    with timer.measure('search', 'queries') as record:
+        results = {single_file: score_concepts(store, concept_vectors, args.max_chunks)
+                   for single_file, store in stores.items()}
+        record['items'] = len(stores) * len(concept_vectors)
+
+    prompt = construct_prompt(BENCHMARK_PROMPT)
+    with timer.measure('llm', 'requests') as record:
+        responses = asyncio.run(simulate_llm_calls(llm, [document_prompt(prompt, texts[single_file][:4000]).messages()
+                                                         for single_file in files], args.max_in_flight))
+        record['items'] = len(responses)
+
+    with timer.measure('saving', 'rows') as record:
+        rows = 0
+        with ResultsSaver.fully_automated(workspace, "stages", args.result_format, 'automation') as results_saver:
+            for single_file, response in zip(files, responses):
+                results_saver.save_response(single_file, response.content)
+                rows += 1
+        with ResultsSaver.relevant_chunks(workspace, 'automation', "stages", args.result_format) as results_saver:
+            for single_file, results_per_concept in results.items():
+                results_saver.save_relevant_chunks(single_file, results_per_concept[0])
+                rows += max(1, len(results_per_concept[0]))
+        record['items'] = rows
+
+    embeddings.cache.close()
+    return timer.stages
+
+
+async def simulate_llm_calls(llm, prompts, max_in_flight):
+    slots = asyncio.Semaphore(max_in_flight)
+
+    async def call(prompt):
+        async with slots:
+            return await llm.ainvoke(prompt)
+
+    return await asyncio.gather(*(call(prompt) for prompt in prompts))
+
+
+def run_end_to_end(files, args, workspace):
+    """Runs both pipelines as a user would, with the simulated models plugged in."""
+    context_config = ContextRetrievalConfig(args.chunk_size, args.max_chunks, args.threshold, args.result_format,
+                                            args.chunk_overlap)
+    results = {}
+    for mode, pipeline_class in (('coding', CodingPipeline), ('retrieval', RetrievalPipeline)):
+        save_path = os.path.join(workspace, f"{mode}_results")
+        os.makedirs(save_path, exist_ok=True)
+        tool_config = ToolConfig(AUTOMATED_CODING if mode == 'coding' else CONTEXT_RETRIEVAL, BENCHMARK_PROMPT,
+                                 'automation' if mode == 'coding' else list(BENCHMARK_CONCEPTS), files, save_path,
+                                 context_config, args.max_in_flight, 'off', 'hashing',
+                                 coding_result_format=args.result_format)
+        models = {'llm': SimulatedChatModel(args.llm_latency)} if mode == 'coding' else {}
+        pipeline = pipeline_class(tool_config, embedding_model=SimulatedEmbeddings(args.embedding_latency),
+                                  embedding_cache=EmbeddingCache(os.path.join(workspace, f"{mode}_embeddings.sqlite")),
+                                  index_store=DocumentIndexStore(os.path.join(workspace, f"{mode}_indexes")), **models)
+
+        started = time.perf_counter()
+        # The pipelines print every prompt and summary
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.run()
+        seconds = time.perf_counter() - started
+        totals = pipeline.metrics.report()['totals']
+        results[mode] = {'seconds': round(seconds, 6), 'docs_per_second': round(len(files) / seconds, 3),
+                         'llm_requests': totals['llm_requests'], 'embedded_chunks': totals['embedded_chunks'],
+                         'peak_rss_mb': peak_rss_mb()}
+    return results
+
+
+def run_rate_limits(args):
+    """Sends the same burst of chat requests to a local server that enforces a requests-per-minute limit.
+
+    The requests go through ChatOpenAI and a RateLimiter, once knowing nothing about the limit,
+    so that only the adaptive concurrency and the Retry-After pauses avoid rate limit responses,
+    and once scheduled within the server's limit.
+    """
+    from langchain_openai import ChatOpenAI
+
+    encoding = get_encoding(CHUNK_ENCODING)
+    prompt = document_prompt(construct_prompt(BENCHMARK_PROMPT), " ".join(["automation"] * 200))
+    tokens = chat_tokens(lambda text: len(encoding.encode(text, disallowed_special=())), prompt)
+    results = {}
+    for scenario, requests_per_minute in (('adaptive', 0), ('scheduled', args.server_rpm)):
+        with FakeOpenAIServer(args.server_rpm, latency=args.llm_latency) as server:
+            llm = ChatOpenAI(base_url=server.base_url, api_key="benchmark", model_name="gpt-4o", max_retries=0)
+            limiter = RateLimiter(scenario, requests_per_minute, max_concurrency=RATE_LIMIT_CONCURRENCY)
+
+            async def send_all():
+                await asyncio.gather(*(limiter.call_async(lambda: llm.ainvoke(prompt.messages()), tokens)
+                                       for _ in range(args.rate_limit_requests)))
+
+            started = time.perf_counter()
+            asyncio.run(send_all())
+            seconds = time.perf_counter() - started
+        results[scenario] = {'seconds': round(seconds, 6), 'requests': args.rate_limit_requests,
+                             'rate_limited': limiter.rate_limited, 'retries': limiter.retried,
+                             'requests_per_minute': round(args.rate_limit_requests / seconds * 60, 1)}
+    return results
+
+
+def run_ingestion(args, workspace):
+    """Builds the index of one large .txt file per size in ``args.ingest_mb``, each in a fresh interpreter.
+
+    The file is streamed, chunked, embedded with the local hashing embeddings and indexed a
+    batch at a time, as the pipelines do. Only the batch in flight is held besides the index,
+    so the peak RSS grows with the index vectors and chunk texts, not with copies of the text
+    or lists of Python floats.
+    """
+    results = {}
+    for megabytes in args.ingest_mb:
+        path = os.path.join(workspace, f"ingest_{megabytes}mb.txt")
+        write_large_text(path, megabytes, args.seed)
+        results[f"{megabytes} MB"] = measure_ingestion(path, args.chunk_size, args.chunk_overlap)
+        os.remove(path)
+    return results
+
+
+def run_near_duplicates(args, workspace):
+    """Runs retrieval on a multi-year corpus, embedding every chunk and with near-duplicates detected.
+
+    With detection on, chunks repeated across a company's reports reuse the vector of their
+    first occurrence, and the result files hold every near-duplicate passage once.
+    """
+    corpus_directory = os.path.join(workspace, "multi_year")
+    os.makedirs(corpus_directory)
+    files = generate_multi_year_corpus(corpus_directory, args.seed)
+    results = {}
+    for scenario, threshold in (('off', 0.0), ('on', args.near_duplicate_threshold)):
+        save_path = os.path.join(workspace, f"near_duplicates_{scenario}")
+        os.makedirs(save_path)
+        context_config = ContextRetrievalConfig(args.chunk_size, args.max_chunks, NEAR_DUPLICATE_MIN_SCORE, 'jsonl',
+                                                args.chunk_overlap, near_duplicate_threshold=threshold,
+                                                collapse_duplicates=bool(threshold))
+        tool_config = ToolConfig(CONTEXT_RETRIEVAL, BENCHMARK_PROMPT, list(BENCHMARK_CONCEPTS), files, save_path,
+                                 context_config, args.max_in_flight, 'off', 'hashing')
+        embeddings = SimulatedEmbeddings(args.embedding_latency)
+        pipeline = RetrievalPipeline(tool_config, embedding_model=embeddings,
+                                     embedding_cache=EmbeddingCache(os.path.join(save_path, "embeddings.sqlite")),
+                                     index_store=DocumentIndexStore(os.path.join(save_path, "indexes")))
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.run()
+        seconds = time.perf_counter() - started
+        rows = 0
+        for name in os.listdir(save_path):
+            if name.endswith("_relevant_context_" + pipeline.timestamp + ".jsonl"):
+                with open(os.path.join(save_path, name), 'r', encoding='utf-8') as results_file:
+                    rows += sum(1 for _ in results_file)
+        results[scenario] = {'seconds': round(seconds, 6), 'documents': len(files),
+                             'embedded_chunks': embeddings.texts, 'result_rows': rows}
+    return results
+
+
+def measure_ingestion(path, chunk_size, chunk_overlap):
+    script = (
+        "import json, resource, time\n"
+        "import numpy as np\n"
+        "from document_index_store import add_chunks, chunk_batches\n"
+        "from file_utils import FileUtils\n"
+        "from local_embeddings import HashingEmbeddings\n"
+        "embeddings = HashingEmbeddings()\n"
+        "imported = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "start = time.perf_counter()\n"
+        f"chunks = FileUtils.split_pages(FileUtils.iter_text({path!r}), {chunk_size}, {chunk_overlap}, paged=False)\n"
+        "vector_store = None\n"
+        "for batch in chunk_batches(chunks):\n"
+        "    vectors = np.asarray(embeddings.embed_documents([text for _, text in batch]), dtype=np.float32)\n"
+        "    vector_store = add_chunks(vector_store, batch, vectors, embeddings)\n"
+        "print(json.dumps([time.perf_counter() - start, vector_store.index.ntotal, vector_store.index.d, imported, "
+        "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "ingestion failed")
+    seconds, chunks, dimensions, imported, peak = json.loads(result.stdout.strip().splitlines()[-1])
+    return {'seconds': round(seconds, 6), 'chunks': chunks, 'import_rss_mb': maxrss_mb(imported),
+            'peak_rss_mb': maxrss_mb(peak), 'vectors_mb': round(chunks * dimensions * 4 / 1024 ** 2, 1)}
+
+
+def measure_import(code):
+    """Runs ``code`` in a fresh interpreter and returns its import time with a per-package breakdown.
+
+    The breakdown sums the self time that ``python -X importtime`` reports for the modules
+    of every top-level package, for the imports done by ``code`` only.
+    """
+    marker = "-- measured imports --"
+    script = (f"import sys, time\nsys.stderr.write({marker!r} + '\\n'); sys.stderr.flush()\n"
+              f"start = time.perf_counter()\n{code}\nprint(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+
+    lines = result.stderr.splitlines()
+    modules = [line[len("import time:"):].split("|") for line in lines[lines.index(marker) + 1:]
+               if line.startswith("import time:")]
+    packages = {}
+    for self_time, _, name in modules:
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_time) / 1e6
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:STARTUP_TOP_PACKAGES]
+    return {'seconds': round(float(result.stdout.strip().splitlines()[-1]), 4),
+            'modules': len(modules),
+            'packages': {package: round(seconds, 4) for package, seconds in heaviest}}
+
+
+def measure_startup():
+    startup = {}
+    for name, code in STARTUP_IMPORTS.items():
+        try:
+            startup[name] = min((measure_import(code) for _ in range(STARTUP_REPEATS)),
+                                key=lambda measurement: measurement['seconds'])
+        except (OSError, RuntimeError) as error:
+            print(f"Startup of {name} not measured: {error}", file=sys.stderr)
+    return startup
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in REPORTING_OPTIONS},
+    }
+    with benchmark_workspace() as workspace:
+        corpus_directory = os.path.join(workspace, "corpus")
+        os.makedirs(corpus_directory)
+        files = generate_corpus(corpus_directory, args.sizes, args.docs_per_size, args.formats, args.seed)
+        report['corpus'] = {'documents': len(files), 'bytes': sum(os.path.getsize(path) for path in files)}
+        report['startup'] = measure_startup()
+        report['stages'] = run_stages(files, args, workspace)
+        if not args.skip_end_to_end:
+            report['end_to_end'] = run_end_to_end(files, args, workspace)
+        if not args.skip_ingestion:
+            report['ingestion'] = run_ingestion(args, workspace)
+        if not args.skip_near_duplicates:
+            report['near_duplicates'] = run_near_duplicates(args, workspace)
+    if not args.skip_rate_limits:
+        report['rate_limits'] = run_rate_limits(args)
+    return report
+
+
+def compare_reports(report, baseline, tolerance):
+    """Prints the time of every stage next to the baseline and returns the stages that got slower."""
+    if report['config'] != baseline.get('config'):
+        print("Warning: the baseline was run with different settings.")
+    regressions = []
+    timings = {name: stage['seconds'] for name, stage in report['stages'].items()}
+    baseline_timings = {name: stage['seconds'] for name, stage in baseline.get('stages', {}).items()}
+    for mode, result in report.get('end_to_end', {}).items():
+        timings[f"{mode} (end to end)"] = result['seconds']
+    for mode, result in baseline.get('end_to_end', {}).items():
+        baseline_timings[f"{mode} (end to end)"] = result['seconds']
+    for scenario, result in report.get('rate_limits', {}).items():
+        timings[f"{scenario} (rate limits)"] = result['seconds']
+    for scenario, result in baseline.get('rate_limits', {}).items():
+        baseline_timings[f"{scenario} (rate limits)"] = result['seconds']
+    for size, result in report.get('ingestion', {}).items():
+        timings[f"{size} ingestion"] = result['seconds']
+    for size, result in baseline.get('ingestion', {}).items():
+        baseline_timings[f"{size} ingestion"] = result['seconds']
+    for scenario, result in report.get('near_duplicates', {}).items():
+        timings[f"near-duplicates {scenario}"] = result['seconds']
+    for scenario, result in baseline.get('near_duplicates', {}).items():
+        baseline_timings[f"near-duplicates {scenario}"] = result['seconds']
+    for name, result in report.get('startup', {}).items():
+        timings[f"{name} imports"] = result['seconds']
+    for name, result in baseline.get('startup', {}).items():
+        baseline_timings[f"{name} imports"] = result['seconds']
+
+    for name, seconds in timings.items():
+        if name not in baseline_timings:
+            continue
+        ratio = seconds / baseline_timings[name] if baseline_timings[name] > 0 else float('inf')
+        noise = MIN_STARTUP_REGRESSION_SECONDS if name.endswith(" imports") else MIN_REGRESSION_SECONDS
+        slower = ratio > 1 + tolerance and seconds - baseline_timings[name] > noise
+        flag = "  SLOWER" if slower else ""
+        print(f"{name:<28} {baseline_timings[name]:>10.3f}s -> {seconds:>10.3f}s  x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the coding and retrieval pipelines on a synthetic corpus, "
+                    "with simulated OpenAI models.")
+    parser.add_argument('--output', default="benchmark.json", help="JSON report to write")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative slowdown against the baseline that counts as a regression")
+    parser.add_argument('--sizes', nargs='+', choices=CORPUS_SIZES.keys(), default=['small', 'medium'])
+    parser.add_argument('--formats', nargs='+', choices=['txt', 'pdf'], default=['txt', 'pdf'])
+    parser.add_argument('--docs-per-size', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="seconds per LLM request")
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--chunk-overlap', type=int, default=50)
+    parser.add_argument('--max-chunks', type=int, default=30)
+    parser.add_argument('--threshold', type=float, default=0.0)
+    parser.add_argument('--result-format', default='jsonl')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument('--skip-end-to-end', action='store_true', help="only time the stages on their own")
+    parser.add_argument('--server-rpm', type=int, default=600,
+                        help="requests per minute the local server of the rate limit scenarios allows")
+    parser.add_argument('--rate-limit-requests', type=int, default=60,
+                        help="chat requests sent in each rate limit scenario")
+    parser.add_argument('--skip-rate-limits', action='store_true', help="leave out the rate limit scenarios")
+    parser.add_argument('--ingest-mb', type=int, nargs='+', default=[8, 32],
+                        help="sizes in MB of the large .txt files whose ingestion is measured")
+    parser.add_argument('--skip-ingestion', action='store_true', help="leave out the large file ingestion")
+    parser.add_argument('--near-duplicate-threshold', type=float, default=DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+                        help="threshold of the near-duplicate scenario of the multi-year corpus")
+    parser.add_argument('--skip-near-duplicates', action='store_true', help="leave out the multi-year corpus")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    with open(args.output, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    for name, stage in report['stages'].items():
+        print(f"{name:<14} {stage['seconds']:>9.3f}s {stage['items']:>9} {stage['unit']:<8} "
+              f"{stage['per_second'] or 0:>12.1f}/s  peak RSS {stage['peak_rss_mb']} MB")
+    for mode, result in report.get('end_to_end', {}).items():
+        print(f"{mode:<14} {result['seconds']:>9.3f}s {result['docs_per_second']:>9.2f} docs/s")
+    for scenario, result in report.get('rate_limits', {}).items():
+        print(f"{scenario:<14} {result['seconds']:>9.3f}s {result['requests_per_minute']:>9.1f} requests/min, "
+              f"{result['rate_limited']} rate limited")
+    for size, result in report.get('ingestion', {}).items():
+        print(f"{size + ' file':<14} {result['seconds']:>9.3f}s {result['chunks']:>9} chunks    "
+              f"peak RSS {result['peak_rss_mb']} MB, {result['import_rss_mb']} MB after imports, "
+              f"{result['vectors_mb']} MB of vectors")
+    for scenario, result in report.get('near_duplicates', {}).items():
+        print(f"{'dedup ' + scenario:<14} {result['seconds']:>9.3f}s {result['embedded_chunks']:>9} chunks    "
+              f"embedded, {result['result_rows']} result rows")
+    for name, result in report.get('startup', {}).items():
+        heaviest = ", ".join(f"{package} {seconds * 1000:.0f} ms" for package, seconds in
+                             list(result['packages'].items())[:5])
+        print(f"{name:<14} {result['seconds']:>9.3f}s {result['modules']:>9} modules imported ({heaviest})")
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            regressions = compare_reports(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"Slower than the baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Usual Okapi BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Share of the lexical score in the fused score of a prefiltered chunk
+BM25_WEIGHT = 0.3
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over the chunks of one document, backed by an inverted index.
+
+    Only the postings of the query terms are visited, so scoring a concept description
+    costs time in proportion to how often its words occur, not to the document length.
+    """
+
+    def __init__(self, texts, k1=BM25_K1, b=BM25_B):
+        self.size = len(texts)
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for position, text in enumerate(texts):
+            term_counts = Counter(tokenize(text))
+            lengths[position] = sum(term_counts.values())
+            for term, count in term_counts.items():
+                chunk_ids, frequencies = postings[term]
+                chunk_ids.append(position)
+                frequencies.append(count)
+
+        average_length = float(lengths.mean()) if self.size and lengths.any() else 1.0
+        # Per-chunk part of the BM25 denominator, computed once for all queries
+        self._length_norms = k1 * (1 - b + b * lengths / average_length)
+        self._postings = {term: (np.asarray(chunk_ids, dtype=np.int64), np.asarray(frequencies, dtype=np.float32))
+                          for term, (chunk_ids, frequencies) in postings.items()}
+
+    def scores(self, query):
+        """Returns the BM25 score of every chunk for ``query``."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self._postings:
+                continue
+            chunk_ids, frequencies = self._postings[term]
+            idf = math.log(1 + (self.size - len(chunk_ids) + 0.5) / (len(chunk_ids) + 0.5))
+            scores[chunk_ids] += idf * frequencies * (self.k1 + 1) / (frequencies + self._length_norms[chunk_ids])
+        return scores
+
+    def top(self, query, n):
+        """Returns the positions of the best ``n`` chunks for ``query``, best first, and the scores of all chunks.
+
+        Chunks that share no term with the query are never candidates.
+        """
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > n:
+            candidates = candidates[np.argpartition(scores[candidates], -n)[-n:]]
+        return candidates[np.argsort(-scores[candidates])], scores
+
+
+def fuse_scores(dense_scores, lexical_scores, best_lexical_score, weight=BM25_WEIGHT):
+    # The lexical scores are scaled to [0, 1] by the best chunk of the document before mixing
+    lexical_scores = np.asarray(lexical_scores, dtype=np.float64)
+    if best_lexical_score > 0:
+        lexical_scores = lexical_scores / best_lexical_score
+    return (1 - weight) * np.asarray(dense_scores, dtype=np.float64) + weight * lexical_scores
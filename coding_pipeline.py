@@ -0,0 +1,382 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from langchain_openai import ChatOpenAI
+
+from concept_coding import (JSON_RESPONSE_FORMAT, InvalidCodingOutput, construct_multi_concept_prompt,
+                            is_multi_concept, parse_codes, resolve_concepts, retry_prompt)
+from configuration import Configuration
+from context_packer import ContextPacker
+from document_index_store import DocumentIndexStore, add_chunks, chunk_batches
+from embedding_providers import create_embeddings
+from file_utils import FileUtils
+from llm_response_cache import LLMResponseCache
+from map_reduce_coding import (LONG_DOCUMENTS_MAP_REDUCE, SECTION_OVERLAP_TOKENS, group_partials, reduce_prompt,
+                               section_prompt)
+from prompt_components import ChatPrompt
+from rate_limiter import RateLimiter, chat_tokens
+from results_saver import ResultsSaver, get_file_name
+from run_control import RunCancelled, RunControl
+from run_manifest import RunManifest
+from run_metrics import RunMetrics, write_run_reports
+
+
+class CodingPipeline:
+    """Fully automated coding of many files as overlapping stages.
+
+    Text extraction runs in a process pool while the embedding and LLM requests of
+    other files are awaited concurrently. At most ``max_in_flight`` documents are in
+    the pipeline at once, and results are saved in the order of ``files_array``.
+    Every stage is timed per file in ``metrics``, which is saved as a run report next to
+    the results. A file that fails is recorded in the run manifest and the others go on;
+    with ``tool_config.resume`` the files completed by an earlier run are skipped.
+
+    When several concepts or ALL_CONCEPTS are selected, even if they come down to one
+    concept, each document is coded for all of them in one request: the model answers
+    in JSON mode with a score and an explanation per concept, the answer is validated
+    (and asked for once more if invalid), and every concept gets its own result row.
+
+    Documents over the token budget are coded from their most relevant chunks, or, with
+    ``long_documents`` set to map-reduce, split into budget-sized sections that are coded
+    concurrently (at most ``map_parallelism`` requests at a time) and combined by a final
+    reduce request.
+
+    ``llm``, ``embedding_model``, ``embedding_cache`` and ``index_store`` replace the OpenAI
+    models and the default caches, e.g. with the simulated ones of the benchmark.
+    """
+
+    def __init__(self, tool_config, run_control=None, llm=None, embedding_model=None, embedding_cache=None,
+                 index_store=None):
+        self.tool_config = tool_config
+        self.run_control = run_control or RunControl(len(tool_config.files_array))
+        self.max_in_flight = max(1, int(tool_config.max_in_flight))
+        self.map_parallelism = max(1, int(tool_config.map_parallelism))
+        self.model_name = "gpt-4o"
+        self.temperature = 0.0
+        self.llm = llm if llm is not None else self._create_llm()
+        self.llm_limiter = RateLimiter(self.model_name, tool_config.llm_requests_per_minute,
+                                       tool_config.llm_tokens_per_minute, self.max_in_flight * self.map_parallelism)
+        self.embedding_limiter = RateLimiter('Embedding', tool_config.embedding_requests_per_minute,
+                                             tool_config.embedding_tokens_per_minute, self.max_in_flight)
+        self.response_cache = LLMResponseCache(mode=tool_config.llm_cache)
+        self.embeddings = create_embeddings(tool_config.embedding_provider, self.embedding_limiter, embedding_model,
+                                            embedding_cache)
+        self.metrics = RunMetrics('coding', self.model_name, self.embeddings.model)
+        self.embeddings.on_embed = self.metrics.embedding_requested
+        for limiter in (self.llm_limiter, self.embedding_limiter):
+            limiter.on_rate_limited = lambda: self.metrics.count(rate_limited_requests=1)
+        self.packer = ContextPacker(self.model_name, max(1, int(tool_config.context_token_budget)))
+        self.index_store = index_store if index_store is not None else DocumentIndexStore()
+        # A single concept only labels the results; its coding is described by the prompt itself.
+        # Multi-concept coding is validated JSON with one row per concept, even for a single concept.
+        self.concepts = []
+        if is_multi_concept(tool_config.concept_input):
+            self.concepts = resolve_concepts(tool_config.concept_input)
+            if not self.concepts:
+                raise ValueError("None of the selected concepts has a description in prompt_config.ini.")
+        self.descriptions = [Configuration.get_concept_description(concept) for concept in self.concepts]
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.files = list(tool_config.files_array)
+        self.manifest = None
+        self.results_saver = None
+        self._section_slots = None
+        self._responses = {}
+        self._next_to_save = 0
+
+    def run(self):
+        self.manifest = RunManifest(self.tool_config.save_path, 'coding', self.run_settings(),
+                                    self.tool_config.resume)
+        self.timestamp = self.manifest.timestamp
+        self.files = self.manifest.start(self.tool_config.files_array)
+        self.run_control.skip_files(self.manifest.skipped)
+        with ResultsSaver.fully_automated(self.tool_config.save_path, self.timestamp,
+                                          self.tool_config.coding_result_format,
+                                          self.tool_config.concept_input) as self.results_saver:
+            # Files are marked completed once their rows are on disk
+            self.results_saver.on_flush = self.manifest.saved
+            asyncio.run(self._run())
+        self.response_cache.close()
+        self.metrics.finish()
+        report_path = write_run_reports(self.metrics, self.tool_config)
+        summary = (f"{self.manifest.summary()}\n{self.response_cache.stats()}\n{self.embeddings.cache.stats()}\n"
+                   f"{self.llm_limiter.stats()}\n{self.embedding_limiter.stats()}\nRun report saved to {report_path}")
+        print(summary)
+        return summary
+
+    def run_settings(self):
+        # Everything that changes the responses; a manifest is only resumed with the same settings
+        messages = self.tool_config.messages
+        context_config = self.tool_config.context_retrieval_config
+        return {
+            'model': self.model_name,
+            'temperature': self.temperature,
+            'prompt': [messages.system_message, messages.user_message, messages.output_format],
+            'concept': self.tool_config.concept_input,
+            'descriptions': self.descriptions,
+            'embedding_model': self.embeddings.model,
+            'chunking': [context_config.chunk_size, context_config.chunk_overlap, context_config.max_chunks,
+                         context_config.threshold],
+            'long_documents': self.tool_config.long_documents,
+            'context_token_budget': self.packer.token_budget,
+            'result_format': self.tool_config.coding_result_format,
+        }
+
+    async def _run(self):
+        files = self.files
+        slots = asyncio.Semaphore(self.max_in_flight)
+        # Shared by the section and reduce requests of all documents
+        self._section_slots = asyncio.Semaphore(self.map_parallelism)
+        workers = min(self.max_in_flight, os.cpu_count() or 1)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            await asyncio.gather(*(self._process_file(index, single_file, pool, slots)
+                                   for index, single_file in enumerate(files)))
+
+    async def _process_file(self, index, single_file, pool, slots):
+        try:
+            async with slots:
+                with self.metrics.file(single_file):
+                    self.run_control.check_cancelled()
+                    if FileUtils.is_pdf_file(single_file):
+                        loop = asyncio.get_running_loop()
+                        with self.metrics.stage('extraction'):
+                            pages = await loop.run_in_executor(pool, FileUtils.read_pages, single_file)
+                        raw_text = ''.join(pages)
+                        page_starts = FileUtils.page_starts(pages)
+                        del pages
+                    else:
+                        with self.metrics.stage('extraction'):
+                            raw_text = await asyncio.to_thread(self._read_if_fits, single_file)
+                        page_starts = None
+                    response, tokens = await self._code_document(single_file, raw_text, page_starts)
+        except RunCancelled:
+            raise
+        except Exception as error:
+            # One unreadable PDF or failed request must not stop the other files
+            self._file_failed(single_file, error)
+            response, tokens = None, 0
+
+        self._responses[index] = response
+        self._save_completed()
+        self.run_control.file_done(single_file, tokens=tokens)
+
+    def _create_llm(self):
+        # Retries are left to the rate limiters, which slow down on rate limit responses
+        return ChatOpenAI(temperature=self.temperature, model_name=self.model_name, max_retries=0)
+
+    def _file_failed(self, single_file, error):
+        self.manifest.failed(single_file, error)
+
+    def _instructions(self):
+        # The system message: identical for every document, so it forms the shared prompt prefix
+        if self.concepts:
+            return construct_multi_concept_prompt(self.tool_config.messages, self.concepts, self.descriptions)
+        return construct_prompt(self.tool_config.messages)
+
+    def _read_if_fits(self, single_file):
+        # Returns the text of a .txt file, or None as soon as the text read so far exceeds the token budget;
+        # such a file is never read whole but streamed from disk by _document_chunks.
+        text = ''
+        for block in FileUtils.iter_text_blocks(single_file):
+            text += block
+            if not self.packer.fits(text):
+                return None
+        return text
+
+    async def _code_document(self, single_file, raw_text, page_starts=None):
+        # Returns the response, or the codes of every concept, and the tokens billed for the document.
+        # raw_text is None for a .txt file that is known not to fit the token budget.
+        instructions = self._instructions()
+        # The whole document is sent when it fits the model's token budget
+        with self.metrics.stage('tokenization'):
+            fits = raw_text is not None and await asyncio.to_thread(self.packer.fits, raw_text)
+        if fits:
+            return await self._answer(document_prompt(instructions, raw_text))
+        if self.tool_config.long_documents == LONG_DOCUMENTS_MAP_REDUCE:
+            return await self._map_reduce(single_file, instructions, raw_text, page_starts)
+        return await self._answer(await self._retrieved_prompt(single_file, instructions, raw_text, page_starts))
+
+    async def _answer(self, prompt):
+        if self.tool_config.debug:
+            print(prompt)
+        if self.concepts:
+            return await self._code_concepts(prompt)
+        return await self._complete(prompt)
+
+    async def _retrieved_prompt(self, single_file, instructions, raw_text, page_starts):
+        context_config = self.tool_config.context_retrieval_config
+        vector_store = await self._load_or_build_index(single_file, raw_text, page_starts)
+        threshold_value = float(context_config.threshold)
+        with self.metrics.stage('search'):
+            if self.concepts:
+                results_with_scores = await self._search_concepts(vector_store, context_config.max_chunks)
+            else:
+                results_with_scores = await vector_store.asimilarity_search_with_relevance_scores(
+                    instructions,
+                    k=context_config.max_chunks)
+        filtered_results = [(doc, score) for doc, score in results_with_scores if score >= threshold_value]
+
+        with self.metrics.stage('packing'):
+            packed = await asyncio.to_thread(self.packer.pack, filtered_results)
+        self.metrics.count(chunks_retrieved=len(results_with_scores), chunks_kept=len(filtered_results),
+                           chunks_packed=packed.chunks_used)
+        if self.tool_config.debug:
+            print(f"{get_file_name(single_file)}: {packed.chunks_used} chunks, "
+                  f"{packed.tokens_used} of {self.packer.token_budget} context tokens")
+        return document_prompt(instructions, packed.text)
+
+    async def _map_reduce(self, single_file, instructions, raw_text, page_starts):
+        with self.metrics.stage('splitting'):
+            sections = await asyncio.to_thread(list, self._document_chunks(
+                single_file, raw_text, page_starts, self.packer.token_budget, SECTION_OVERLAP_TOKENS))
+        self.metrics.count(sections=len(sections))
+        if self.tool_config.debug:
+            print(f"{get_file_name(single_file)}: coding {len(sections)} sections")
+        answers = await asyncio.gather(*(
+            self._section_answer(section_prompt(instructions, number, len(sections), record.page, text))
+            for number, (record, text) in enumerate(sections, 1)))
+        partials = [((number, number), result) for number, (result, _) in enumerate(answers, 1)]
+        result, tokens = await self._reduce(instructions, partials)
+        return result, tokens + sum(section_tokens for _, section_tokens in answers)
+
+    async def _reduce(self, instructions, partials):
+        if len(partials) == 1:
+            return partials[0][1], 0
+        groups = group_partials(partials, self.packer.count_tokens, self.packer.token_budget)
+        if 1 < len(groups) < len(partials):
+            # Too many section results for one request: neighbouring sections are combined first
+            answers = await asyncio.gather(*(self._section_answer(reduce_prompt(instructions, group))
+                                             for group in groups))
+            combined = [((group[0][0][0], group[-1][0][1]), result) for group, (result, _) in zip(groups, answers)]
+            result, tokens = await self._reduce(instructions, combined)
+            return result, tokens + sum(group_tokens for _, group_tokens in answers)
+        return await self._section_answer(reduce_prompt(instructions, partials))
+
+    async def _section_answer(self, prompt):
+        async with self._section_slots:
+            return await self._answer(prompt)
+
+    async def _search_concepts(self, vector_store, k):
+        # Every concept brings its own best chunks; a chunk found for several concepts keeps its best score
+        searches = await asyncio.gather(*(
+            vector_store.asimilarity_search_with_relevance_scores(f"{concept}: {description}", k=k)
+            for concept, description in zip(self.concepts, self.descriptions)))
+        best = {}
+        for doc, score in (pair for results in searches for pair in results):
+            chunk_number = doc.metadata.get('chunk')
+            if chunk_number not in best or score > best[chunk_number][1]:
+                best[chunk_number] = (doc, score)
+        return sorted(best.values(), key=lambda pair: pair[1], reverse=True)
+
+    async def _load_or_build_index(self, single_file, raw_text, page_starts):
+        context_config = self.tool_config.context_retrieval_config
+        splitter_settings = FileUtils.splitter_settings(context_config.chunk_size, context_config.chunk_overlap)
+        with self.metrics.stage('index_loading'):
+            key = await asyncio.to_thread(self.index_store.key_for, single_file, splitter_settings, self.embeddings)
+            vector_store = await asyncio.to_thread(self.index_store.load, key, self.embeddings)
+        if vector_store is not None:
+            self.metrics.count(chunks=vector_store.index.ntotal)
+            return vector_store
+
+        # Chunks are embedded and indexed a batch at a time, so only one batch of vectors is held
+        batches = chunk_batches(self._document_chunks(single_file, raw_text, page_starts,
+                                                      context_config.chunk_size, context_config.chunk_overlap))
+        while True:
+            with self.metrics.stage('splitting'):
+                batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            with self.metrics.stage('embedding'):
+                # As float32 right away: a list of Python floats takes eight times the memory
+                vectors = np.asarray(await self.embeddings.aembed_documents([text for _, text in batch]),
+                                     dtype=np.float32)
+            with self.metrics.stage('indexing'):
+                vector_store = await asyncio.to_thread(add_chunks, vector_store, batch, vectors, self.embeddings)
+        self.metrics.count(chunks=vector_store.index.ntotal)
+        with self.metrics.stage('indexing'):
+            await asyncio.to_thread(self.index_store.save, key, vector_store, single_file)
+        return vector_store
+
+    @staticmethod
+    def _document_chunks(single_file, raw_text, page_starts, chunk_size, chunk_overlap):
+        # Yields (ChunkRecord, text) pairs of the text in memory, or streamed from the .txt file when raw_text is None
+        if raw_text is None:
+            yield from FileUtils.split_pages(FileUtils.iter_text_blocks(single_file), chunk_size, chunk_overlap,
+                                             paged=False)
+            return
+        for record in FileUtils.split_text(raw_text, chunk_size, chunk_overlap, page_starts):
+            yield record, record.text(raw_text)
+
+    async def _complete(self, prompt, parse=None):
+        # Returns the response to a ChatPrompt and the tokens billed for it, which is 0 for cached responses.
+        # With ``parse`` the model answers in JSON mode, and only answers that parse are cached.
+        response = self.response_cache.get(self.model_name, self.temperature, prompt.key())
+        if response is not None:
+            self.metrics.count(cached_responses=1)
+            return (parse(response) if parse else response), 0
+
+        started = time.perf_counter()
+        options = {'response_format': JSON_RESPONSE_FORMAT} if parse else {}
+        with self.metrics.stage('llm'):
+            message = await self.llm_limiter.call_async(lambda: self.llm.ainvoke(prompt.messages(), **options),
+                                                        chat_tokens(self.packer.count_tokens, prompt),
+                                                        used_tokens=used_tokens)
+        token_usage = message.response_metadata.get('token_usage') or {}
+        # Prompt tokens the provider served from its prompt cache, billed at a discount
+        cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        self.metrics.llm_call(token_usage.get('prompt_tokens', 0), cached_tokens,
+                              token_usage.get('completion_tokens', 0), time.perf_counter() - started)
+        if self.tool_config.debug:
+            print(f"LLM call: {token_usage.get('prompt_tokens', 0)} prompt tokens, {cached_tokens} of them cached")
+        result = parse(message.content) if parse else message.content
+        self.response_cache.put(self.model_name, self.temperature, prompt.key(), message.content)
+        return result, token_usage.get('total_tokens', 0)
+
+    async def _code_concepts(self, prompt):
+        # Returns the validated codes of every concept; an invalid answer is asked for once more
+        def parse(content):
+            return parse_codes(content, self.concepts)
+
+        try:
+            return await self._complete(prompt, parse)
+        except InvalidCodingOutput as error:
+            if self.tool_config.debug:
+                print(f"Invalid answer, asking again: {error}")
+            return await self._complete(retry_prompt(prompt, error), parse)
+
+    def _save_completed(self):
+        # Files finish out of order; only write once every earlier file has been written
+        while self._next_to_save in self._responses:
+            response = self._responses.pop(self._next_to_save)
+            # Failed files have no response and no result row
+            if response is not None:
+                self._save_result(self._next_to_save, response)
+            self._next_to_save += 1
+
+    def _save_result(self, index, response):
+        single_file = self.files[index]
+        self.manifest.expect(single_file)
+        with self.metrics.file(single_file), self.metrics.stage('saving'):
+            if self.concepts:
+                self.results_saver.save_codes(single_file, response)
+            else:
+                self.results_saver.save_response(single_file, response)
+
+
+def used_tokens(message):
+    return (message.response_metadata.get('token_usage') or {}).get('total_tokens')
+
+
+def construct_prompt(messages):
+    # The role, codebook and output format, sent as the system message of every request
+    prompt = (f"{messages.system_message}\n{messages.user_message}\n "
+              f"Please provide the output in the following format: \n{messages.output_format}")
+    return prompt
+
+
+def document_prompt(instructions, text):
+    return ChatPrompt(instructions, f"Here is the text for your analysis:\n\n{text}")
@@ -0,0 +1,93 @@
+import json
+
+from configuration import Configuration
+from prompt_components import ChatPrompt
+
+ALL_CONCEPTS = "<All concepts>"
+# OpenAI JSON mode: the model always answers with one JSON object
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+
+class InvalidCodingOutput(ValueError):
+    pass
+
+
+def resolve_concepts(concept_input):
+    # Accepts a single concept name, a list of names or ALL_CONCEPTS, and keeps only concepts with a description
+    concepts = Configuration.read_concepts()
+    if concept_input == ALL_CONCEPTS:
+        return list(concepts)
+    names = [concept_input] if isinstance(concept_input, str) else list(concept_input)
+    return [name for name in dict.fromkeys(names) if name in concepts]
+
+
+def is_multi_concept(concept_input):
+    # A list of names or ALL_CONCEPTS asks for multi-concept coding, however many concepts it resolves to.
+    # No concept at all, '' or an empty list, is single-prompt coding.
+    return concept_input == ALL_CONCEPTS or (not isinstance(concept_input, str) and len(concept_input) > 0)
+
+
+def construct_multi_concept_prompt(messages, concepts, descriptions):
+    """Instructions that code every concept in one request and ask for one JSON entry per concept."""
+    concept_list = "\n".join(f"- {concept}: {description}" for concept, description in zip(concepts, descriptions))
+    return (f"{messages.system_message}\n{messages.user_message}\n"
+            f"Code the text for each of these concepts:\n{concept_list}\n"
+            f"For every concept, give the score and the explanation described by this output format: \n"
+            f"{messages.output_format}\n"
+            'Answer with a JSON object of the form {"codes": [{"concept": "<concept name>", "score": <score>, '
+            '"explanation": "<explanation>"}]} that has exactly one entry for every concept above.')
+
+
+def parse_codes(content, concepts):
+    """Validates a multi-concept JSON answer and returns its codes in the order of ``concepts``.
+
+    Raises InvalidCodingOutput naming every problem, so that the model can be asked again.
+    """
+    try:
+        answer = json.loads(content)
+    except (TypeError, json.JSONDecodeError) as error:
+        raise InvalidCodingOutput(f"The answer is not valid JSON: {error}")
+    entries = answer.get('codes') if isinstance(answer, dict) else None
+    if not isinstance(entries, list):
+        raise InvalidCodingOutput('The answer has no "codes" list.')
+
+    # Concept names are matched without regard to case or surrounding spaces
+    names = {concept.strip().casefold(): concept for concept in concepts}
+    codes = {}
+    problems = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('concept'), str):
+            problems.append(f"An entry has no concept name: {entry!r}")
+            continue
+        concept = names.get(entry['concept'].strip().casefold())
+        score = entry.get('score')
+        if concept is None:
+            problems.append(f"Unknown concept {entry['concept']!r}.")
+        elif concept in codes:
+            problems.append(f"Concept {concept!r} is coded more than once.")
+        elif isinstance(score, bool) or not isinstance(score, (int, float, str)) or str(score).strip() == "":
+            problems.append(f"Concept {concept!r} has no score.")
+        elif not isinstance(entry.get('explanation'), str):
+            problems.append(f"Concept {concept!r} has no explanation.")
+        else:
+            codes[concept] = {'concept': concept, 'score': score, 'explanation': entry['explanation'].strip()}
+
+    missing = [concept for concept in concepts if concept not in codes]
+    if missing:
+        problems.append(f"Missing concepts: {', '.join(missing)}.")
+    if problems:
+        raise InvalidCodingOutput(" ".join(problems))
+    return [codes[concept] for concept in concepts]
+
+
+def retry_prompt(prompt, error):
+    # The rejected answer is not repeated; naming the problems is enough for the model to correct them
+    return ChatPrompt(prompt.instructions, f"{prompt.content}\n\nA previous answer to this request was rejected: "
+                                           f"{error} Answer again with the JSON object.")
+
+
+def numeric_score(score):
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return None
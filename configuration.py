@@ -1,85 +1,136 @@
 import configparser
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
 from configuration_section import ConfigurationSection
 from configuration_option import ConfigurationOption
 
+CONFIG_FILE = "prompt_config.ini"
+
 
 class Configuration:
+    # prompt_config.ini is parsed once and parsed again only when its modification time changes.
+    # Changes are written to a temporary file that atomically replaces the original.
+    _config = None
+    _signature = None
+    _batch_depth = 0
+    _lock = threading.RLock()
 
     @staticmethod
-    def update_configuration(config_section: ConfigurationSection, config_option: ConfigurationOption, new_value):
-        config = configparser.ConfigParser()
-        config.read("prompt_config.ini")
+    def _file_signature():
+        try:
+            stat = os.stat(CONFIG_FILE)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
-        section = config_section.value
-        option = config_option.value
+    @staticmethod
+    def _load():
+        with Configuration._lock:
+            signature = Configuration._file_signature()
+            if Configuration._config is None or signature != Configuration._signature:
+                config = configparser.ConfigParser()
+                config.read(CONFIG_FILE)
+                Configuration._config = config
+                Configuration._signature = signature
+            return Configuration._config
 
-        if not config.has_section(section):
-            config.add_section(section)
+    @staticmethod
+    def _commit():
+        # Inside batch_updates() the file is only written once the outermost block ends
+        with Configuration._lock:
+            if Configuration._batch_depth > 0:
+                return
+            directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+            file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".prompt_config.", suffix=".tmp")
+            try:
+                with os.fdopen(file_descriptor, 'w') as configfile:
+                    Configuration._config.write(configfile)
+                os.replace(temp_path, CONFIG_FILE)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            Configuration._signature = Configuration._file_signature()
 
-        config.set(section, option, new_value)
+    @staticmethod
+    @contextmanager
+    def batch_updates():
+        with Configuration._lock:
+            Configuration._load()
+            Configuration._batch_depth += 1
+            try:
+                yield
+            finally:
+                Configuration._batch_depth -= 1
+            Configuration._commit()
 
-        with open('prompt_config.ini', 'w') as configfile:
-            config.write(configfile)
+    @staticmethod
+    def update_configuration(config_section: ConfigurationSection, config_option: ConfigurationOption, new_value):
+        with Configuration._lock:
+            config = Configuration._load()
+
+            section = config_section.value
+            option = config_option.value
+
+            if not config.has_section(section):
+                config.add_section(section)
+
+            config.set(section, option, new_value)
+            Configuration._commit()
 
         print("Configuration updated successfully.")
 
     @staticmethod
     def save_concepts(concepts_dict):
-        config = configparser.ConfigParser()
-        config.read("prompt_config.ini")
+        with Configuration._lock:
+            config = Configuration._load()
 
-        concept_section = ConfigurationSection.CONCEPTS.value
+            concept_section = ConfigurationSection.CONCEPTS.value
 
-        if "Concepts" in config:
-            config.remove_section(concept_section)
-        config.add_section(concept_section)
+            if config.has_section(concept_section):
+                config.remove_section(concept_section)
+            config.add_section(concept_section)
 
-        # Add each concept to the Concepts section from the provided dictionary
-        for concept, description in concepts_dict.items():
-            config.set(concept_section, concept, description)
+            # Add each concept to the Concepts section from the provided dictionary
+            for concept, description in concepts_dict.items():
+                config.set(concept_section, concept, description)
 
-        # Write the updated configuration back to the file
-        with open("prompt_config.ini", "w") as configfile:
-            config.write(configfile)
+            Configuration._commit()
 
         print("Concepts saved to prompt_config.ini successfully.")
 
     @staticmethod
     def update_whole_prompt(system_message, user_message, output_format):
-        # Load the .ini file
-        config = configparser.ConfigParser()
-
-        config.read("prompt_config.ini")
+        with Configuration._lock:
+            config = Configuration._load()
 
-        if not config.has_section('Prompt'):  # Replace 'SectionName' with your actual section name
-            config.add_section('Prompt')  # Create the section if it doesn't exist
+            if not config.has_section('Prompt'):
+                config.add_section('Prompt')  # Create the section if it doesn't exist
 
             # Replace the old message with the new one
-        config.set('Prompt', 'system_message', system_message)
-        config.set('Prompt', 'user_message', user_message)
-        config.set('Prompt', 'output_format', output_format)
+            config.set('Prompt', 'system_message', system_message)
+            config.set('Prompt', 'user_message', user_message)
+            config.set('Prompt', 'output_format', output_format)
 
-        # Write changes to the .ini file
-        with open('prompt_config.ini', 'w') as configfile:  # Replace with your actual .ini file name
-            config.write(configfile)
+            Configuration._commit()
 
         print("Prompt updated successfully.")
 
     @staticmethod
     def read_concepts():
-        config_file = 'prompt_config.ini'
-        config = configparser.ConfigParser()
-        config.read(config_file)
+        config = Configuration._load()
 
         concept_section = ConfigurationSection.CONCEPTS.value
 
+        # A copy, so callers can edit it before passing it to save_concepts
         return {key: config.get(concept_section, key) for key in config.options(concept_section)}
 
     @staticmethod
     def get_prompt_part(prompt_part: ConfigurationOption):
-        config = configparser.ConfigParser()
-
-        config.read("prompt_config.ini")
+        config = Configuration._load()
 
         try:
             option = config.get(ConfigurationSection.PROMPT.value, prompt_part.value)
@@ -89,9 +140,7 @@ class Configuration:
 
     @staticmethod
     def get_context_retrieval_option(prompt_part: ConfigurationOption):
-        config = configparser.ConfigParser()
-
-        config.read("prompt_config.ini")
+        config = Configuration._load()
 
         try:
             option = config.get(ConfigurationSection.OTHER.value, prompt_part.value)
@@ -99,11 +148,43 @@ class Configuration:
         except (configparser.NoSectionError, configparser.NoOptionError) as e:
             return "Error: Unable to retrieve context retrieval option."
 
+    @staticmethod
+    def get_int_option(option: ConfigurationOption, fallback):
+        try:
+            return Configuration._load().getint(ConfigurationSection.OTHER.value, option.value)
+        except (configparser.Error, ValueError):
+            return fallback
+
+    @staticmethod
+    def get_float_option(option: ConfigurationOption, fallback):
+        try:
+            return Configuration._load().getfloat(ConfigurationSection.OTHER.value, option.value)
+        except (configparser.Error, ValueError):
+            return fallback
+
+    @staticmethod
+    def get_str_option(option: ConfigurationOption, fallback):
+        return Configuration._load().get(ConfigurationSection.OTHER.value, option.value, fallback=fallback)
+
+    @staticmethod
+    def get_chunk_size():
+        return Configuration.get_int_option(ConfigurationOption.CHUNK_SIZE, 200)
+
+    @staticmethod
+    def get_chunk_overlap():
+        return Configuration.get_int_option(ConfigurationOption.CHUNK_OVERLAP, 50)
+
+    @staticmethod
+    def get_max_chunks():
+        return Configuration.get_int_option(ConfigurationOption.MAX_CHUNKS, 30)
+
+    @staticmethod
+    def get_threshold():
+        return Configuration.get_float_option(ConfigurationOption.THRESHOLD, 0.6)
+
     @staticmethod
     def get_concept_description(concept):
-        config_file = 'prompt_config.ini'
-        config = configparser.ConfigParser()
-        config.read(config_file)
+        config = Configuration._load()
 
         section = 'Concepts'
         if config.has_section(section) and config.has_option(section, concept):
@@ -8,4 +8,23 @@ class ConfigurationOption(Enum):
     THRESHOLD = 'threshold'
     MAX_CHUNKS = 'max_chunks'
     CHUNK_SIZE = 'chunk_size'
+    CHUNK_OVERLAP = 'chunk_overlap'
+    CORPUS_INDEX = 'corpus_index'
+    CORPUS_PQ = 'corpus_pq'
+    EMBEDDING_PROVIDER = 'embedding_provider'
+    BM25_CANDIDATES = 'bm25_candidates'
+    NEAR_DUPLICATE_THRESHOLD = 'near_duplicate_threshold'
+    COLLAPSE_DUPLICATES = 'collapse_duplicates'
+    METRICS_TEXTFILE = 'metrics_textfile'
     RESULT_FORMAT = 'result_format'
+    CODING_RESULT_FORMAT = 'coding_result_format'
+    MAX_IN_FLIGHT = 'max_in_flight'
+    LLM_CACHE = 'llm_cache'
+    LONG_DOCUMENTS = 'long_documents'
+    MAP_PARALLELISM = 'map_parallelism'
+    CONTEXT_TOKEN_BUDGET = 'context_token_budget'
+    WARM_UP = 'warm_up'
+    LLM_REQUESTS_PER_MINUTE = 'llm_requests_per_minute'
+    LLM_TOKENS_PER_MINUTE = 'llm_tokens_per_minute'
+    EMBEDDING_REQUESTS_PER_MINUTE = 'embedding_requests_per_minute'
+    EMBEDDING_TOKENS_PER_MINUTE = 'embedding_tokens_per_minute'
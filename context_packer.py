@@ -0,0 +1,91 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model):
+    return tiktoken.encoding_for_model(model)
+
+
+class PackedContext:
+
+    def __init__(self, text, tokens_used, chunks_used):
+        self.text = text
+        self.tokens_used = tokens_used
+        self.chunks_used = chunks_used
+
+
+class ContextPacker:
+    """Fills the context token budget with the most relevant chunks of a document.
+
+    Chunks are taken greedily by relevance score, each chunk is tokenized once per document,
+    and the overlap the chunker leaves between neighbouring chunks (known from their start
+    and end offsets) is only sent once.
+    """
+
+    def __init__(self, model, token_budget):
+        self.encoder = get_encoder(model)
+        self.token_budget = token_budget
+
+    def count_tokens(self, text):
+        return len(self.encoder.encode(text, disallowed_special=()))
+
+    def fits(self, text, reserved_tokens=0):
+        return self.count_tokens(text) <= self.token_budget - reserved_tokens
+
+    def pack(self, results_with_scores, reserved_tokens=0):
+        """Packs (document, score) pairs into at most ``token_budget - reserved_tokens`` tokens."""
+        budget = self.token_budget - reserved_tokens
+        # Counts of this document's chunks only, so they are dropped with the document
+        token_counts = {}
+        selected = {}
+        used = 0
+        ranked = sorted(results_with_scores, key=lambda pair: pair[1], reverse=True)
+        for position, (doc, score) in enumerate(ranked):
+            chunk_number = doc.metadata.get('chunk', ('unordered', position))
+            cost = self._chunk_tokens(token_counts, doc.page_content)
+            # Text shared with an already selected neighbour is not sent twice
+            if isinstance(chunk_number, int):
+                if chunk_number - 1 in selected:
+                    shared = overlap(selected[chunk_number - 1], doc)
+                    cost -= self._chunk_tokens(token_counts, doc.page_content[:shared])
+                if chunk_number + 1 in selected:
+                    following = selected[chunk_number + 1]
+                    cost -= self._chunk_tokens(token_counts, following.page_content[:overlap(doc, following)])
+            if used + cost > budget:
+                continue
+            selected[chunk_number] = doc
+            used += cost
+
+        text = join_chunks(selected)
+        return PackedContext(text, self.count_tokens(text), len(selected))
+
+    def _chunk_tokens(self, token_counts, text):
+        if text not in token_counts:
+            token_counts[text] = self.count_tokens(text)
+        return token_counts[text]
+
+
+def overlap(earlier, later):
+    # Number of characters at the start of the later chunk that the earlier chunk also covers
+    earlier_end = earlier.metadata.get('end')
+    later_start = later.metadata.get('start')
+    if earlier_end is None or later_start is None:
+        return 0
+    return min(max(earlier_end - later_start, 0), len(later.page_content))
+
+
+def join_chunks(selected):
+    # Chunks are put back in document order and neighbours are merged without their shared text
+    parts = []
+    previous = None
+    for chunk_number in sorted(key for key in selected if isinstance(key, int)):
+        doc = selected[chunk_number]
+        if previous is not None and chunk_number == previous + 1:
+            parts[-1] += doc.page_content[overlap(selected[previous], doc):]
+        else:
+            parts.append(doc.page_content)
+        previous = chunk_number
+    parts.extend(doc.page_content for key, doc in selected.items() if not isinstance(key, int))
+    return '\n\n'.join(parts)
@@ -1,7 +1,24 @@
 class ContextRetrievalConfig:
 
-    def __init__(self, chunk_size, max_chunks, threshold, result_format):
+    def __init__(self, chunk_size, max_chunks, threshold, result_format, chunk_overlap=50, corpus_index='off',
+                 corpus_pq=0, bm25_candidates=0, measure_recall=False, near_duplicate_threshold=0.0,
+                 collapse_duplicates=False):
+        # chunk_size and chunk_overlap are counted in tokens
         self.chunk_size = chunk_size
         self.max_chunks = max_chunks
         self.threshold = threshold
-        self.result_format = result_format
\ No newline at end of file
+        self.result_format = result_format
+        self.chunk_overlap = chunk_overlap
+        # Kind of the corpus-wide index the documents are added to ('off' to skip it), see corpus_index
+        self.corpus_index = corpus_index
+        # Product quantization subquantizers for IVF/HNSW corpus indexes, 0 for none
+        self.corpus_pq = corpus_pq
+        # Chunks per concept the BM25 prefilter lets through to embedding, 0 to embed every chunk
+        self.bm25_candidates = bm25_candidates
+        # Also run the full dense search to report the recall of the BM25 prefilter
+        self.measure_recall = measure_recall
+        # Chunks this similar to an earlier chunk of the run reuse its vector, 0 to embed every chunk;
+        # see near_duplicates
+        self.near_duplicate_threshold = near_duplicate_threshold
+        # Write near-duplicate results as one row with their number of occurrences
+        self.collapse_duplicates = collapse_duplicates
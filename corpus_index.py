@@ -0,0 +1,228 @@
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+
+DEFAULT_CORPUS_DIR = os.path.join(".llm_coder_cache", "corpus")
+
+# faiss, numpy and langchain_core are imported where they are used, so that the GUI and the CLI can
+# load the option values below without them
+# Values of the corpus_index option
+CORPUS_OFF = 'off'
+CORPUS_AUTO = 'auto'
+CORPUS_FLAT = 'flat'
+CORPUS_IVF = 'ivf'
+CORPUS_HNSW = 'hnsw'
+CORPUS_INDEX_KINDS = [CORPUS_OFF, CORPUS_AUTO, CORPUS_FLAT, CORPUS_IVF, CORPUS_HNSW]
+
+# Up to this many vectors exact brute-force search takes only milliseconds
+FLAT_MAX_VECTORS = 100000
+# Vectors needed before an IVF or a PQ index can be trained
+IVF_MIN_VECTORS = 25000
+PQ_MIN_VECTORS = 10000
+HNSW_NEIGHBOURS = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+
+
+class CorpusIndex:
+    """One vector index over the chunks of every document processed so far.
+
+    The index starts as an exact flat index. Once it holds enough vectors it is
+    converted once to the target kind: IVF for CORPUS_AUTO and CORPUS_IVF, HNSW for
+    CORPUS_HNSW, each with product quantization when ``pq_subquantizers`` is set.
+    After that, new documents are added to the trained index without a rebuild.
+
+    The chunk texts and their (file, chunk, start, end, page) metadata live in a SQLite
+    table whose row ids are the vector ids. A document that changed gets its old rows
+    deleted and its new chunks appended; the orphaned vectors are skipped when searching.
+    """
+
+    def __init__(self, embedding_model, kind=CORPUS_AUTO, pq_subquantizers=0, root=DEFAULT_CORPUS_DIR):
+        if kind not in CORPUS_INDEX_KINDS or kind == CORPUS_OFF:
+            raise ValueError(f"Unknown corpus index kind: {kind}")
+        import faiss
+
+        # Vectors of different embedding models cannot share an index
+        self.directory = os.path.join(root, hashlib.sha256(embedding_model.encode('utf-8')).hexdigest()[:16])
+        os.makedirs(self.directory, exist_ok=True)
+        self.kind = kind
+        self.pq_subquantizers = int(pq_subquantizers)
+        self.index_path = os.path.join(self.directory, "index.faiss")
+        self.index = None
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
+            self._set_search_parameters()
+
+        self._connection = sqlite3.connect(os.path.join(self.directory, "chunks.sqlite"))
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, file TEXT NOT NULL, chunk INTEGER, start INTEGER, end INTEGER, page INTEGER, "
+            "text TEXT NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, source_key TEXT NOT NULL)")
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        return self.index.ntotal if self.index is not None else 0
+
+    def add_document(self, file, source_key, vector_store):
+        """Adds the chunks of a per-document FAISS store, unless ``source_key`` is already indexed for ``file``.
+
+        ``source_key`` identifies the file content and chunking, for example the DocumentIndexStore key.
+        """
+        row = self._connection.execute("SELECT source_key FROM files WHERE file = ?", (file,)).fetchone()
+        if row is not None and row[0] == source_key:
+            return False
+
+        chunk_count = vector_store.index.ntotal
+        first_id = self.size
+        if chunk_count:
+            self._add_vectors(vector_store.index.reconstruct_n(0, chunk_count))
+        documents = [vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+                     for position in range(chunk_count)]
+
+        self._connection.execute("DELETE FROM chunks WHERE file = ?", (file,))
+        self._connection.executemany(
+            "INSERT INTO chunks (id, file, chunk, start, end, page, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(first_id + position, file, doc.metadata.get('chunk'), doc.metadata.get('start'),
+              doc.metadata.get('end'), doc.metadata.get('page'), doc.page_content)
+             for position, doc in enumerate(documents)])
+        self._connection.execute("INSERT OR REPLACE INTO files (file, source_key) VALUES (?, ?)", (file, source_key))
+        return True
+
+    def search(self, query_vectors, k, threshold=None):
+        """Returns the top ``k`` (document, relevance score) pairs of the whole corpus for every query vector.
+
+        Scores use the same scale as FAISS.similarity_search_with_relevance_scores, so the
+        retrieval threshold means the same thing here.
+        """
+        import numpy as np
+        from langchain_core.vectorstores import VectorStore
+
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        if self.size == 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        active = self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        # Ask for enough extra neighbours to make up for vectors of replaced documents
+        fetch = min(self.size, k + self.size - active)
+        distances, ids = self.index.search(query_vectors, fetch)
+
+        results_per_query = []
+        for row_distances, row_ids in zip(distances, ids):
+            rows = self._rows([int(vector_id) for vector_id in row_ids if vector_id >= 0])
+            results = []
+            for distance, vector_id in zip(row_distances, row_ids):
+                if vector_id not in rows:
+                    continue
+                score = VectorStore._euclidean_relevance_score_fn(float(distance))
+                if threshold is not None and score < threshold:
+                    break
+                results.append((rows[vector_id], score))
+                if len(results) == k:
+                    break
+            results_per_query.append(results)
+        return results_per_query
+
+    def save(self):
+        if self.index is not None:
+            import faiss
+
+            # The vectors are written before the rows that point at them are committed
+            file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(file_descriptor)
+            try:
+                faiss.write_index(self.index, temp_path)
+                os.replace(temp_path, self.index_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self.save()
+            self._connection.close()
+            self._connection = None
+
+    def _rows(self, vector_ids):
+        from langchain_core.documents import Document
+
+        rows = []
+        # Stay well below SQLite's limit on the number of bound parameters
+        for first in range(0, len(vector_ids), 500):
+            batch = vector_ids[first:first + 500]
+            placeholders = ", ".join("?" * len(batch))
+            rows.extend(self._connection.execute(
+                f"SELECT id, file, chunk, start, end, page, text FROM chunks WHERE id IN ({placeholders})",
+                batch).fetchall())
+        return {vector_id: Document(page_content=text, metadata={
+            'file': file, 'chunk': chunk, 'start': start, 'end': end, 'page': page})
+            for vector_id, file, chunk, start, end, page, text in rows}
+
+    def _add_vectors(self, vectors):
+        import faiss
+        import numpy as np
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = faiss.IndexFlatL2(vectors.shape[1])
+        self.index.add(vectors)
+        if isinstance(self.index, faiss.IndexFlat) and self.size >= self._conversion_size():
+            self._convert()
+
+    def _conversion_size(self):
+        if self.kind == CORPUS_FLAT:
+            return math.inf
+        if self.kind == CORPUS_HNSW:
+            return PQ_MIN_VECTORS if self.pq_subquantizers else 0
+        if self.kind == CORPUS_IVF:
+            return IVF_MIN_VECTORS
+        return FLAT_MAX_VECTORS
+
+    def _convert(self):
+        # One-time move of all flat vectors into a trained index of the target kind
+        import faiss
+
+        vectors = self.index.reconstruct_n(0, self.size)
+        dimension = vectors.shape[1]
+        if self.pq_subquantizers and dimension % self.pq_subquantizers:
+            raise ValueError(f"The vector size {dimension} is not divisible by {self.pq_subquantizers} "
+                             f"product quantization subquantizers.")
+
+        if self.kind == CORPUS_HNSW:
+            if self.pq_subquantizers:
+                description = f"HNSW{HNSW_NEIGHBOURS}_PQ{self.pq_subquantizers}"
+            else:
+                description = f"HNSW{HNSW_NEIGHBOURS}"
+        else:
+            # About 4 * sqrt(n) lists, trained on at least 39 vectors per list
+            nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+            encoding = f"PQ{self.pq_subquantizers}" if self.pq_subquantizers else "Flat"
+            description = f"IVF{nlist},{encoding}"
+
+        index = faiss.index_factory(dimension, description, faiss.METRIC_L2)
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        self.index = index
+        self._set_search_parameters()
+        print(f"Corpus index converted to {description} with {self.size} vectors.")
+
+    def _set_search_parameters(self):
+        if hasattr(self.index, 'nprobe'):
+            self.index.nprobe = IVF_NPROBE
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from itertools import islice
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from file_utils import FileUtils
+
+DEFAULT_INDEX_DIR = os.path.join(".llm_coder_cache", "indexes")
+# Chunks embedded and added to an index at a time, one request to the OpenAI embeddings endpoint
+INDEX_BATCH_CHUNKS = 1000
+
+
+class DocumentIndexStore:
+    """Per-document FAISS indexes saved between runs.
+
+    An index is stored under a key built from the file content hash, the splitter
+    settings and the embedding model, so editing the file or changing the chunking
+    produces a new key and the old index is simply never loaded again.
+    """
+
+    def __init__(self, root=DEFAULT_INDEX_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key_for(file, splitter_settings, embeddings):
+        key_parts = {
+            'file_hash': FileUtils.hash_file(file),
+            'splitter': splitter_settings,
+            'embedding_model': getattr(embeddings, 'model', type(embeddings).__name__),
+        }
+        return hashlib.sha256(json.dumps(key_parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self, key, embeddings):
+        index_dir = os.path.join(self.root, key)
+        if not os.path.exists(os.path.join(index_dir, "index.pkl")):
+            return None
+
+        index_path = os.path.join(index_dir, "index.faiss")
+        try:
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            index = faiss.read_index(index_path)
+
+        # The pickle was written by save() on this machine
+        with open(os.path.join(index_dir, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    def save(self, key, vector_store, file):
+        index_dir = os.path.join(self.root, key)
+        if os.path.exists(index_dir):
+            return
+
+        # Write into a temporary directory first so a crash never leaves half an index behind
+        temp_dir = tempfile.mkdtemp(dir=self.root)
+        try:
+            vector_store.save_local(temp_dir)
+            with open(os.path.join(temp_dir, "meta.json"), "w") as meta_file:
+                json.dump({'file': os.path.basename(file), 'chunks': vector_store.index.ntotal}, meta_file)
+            os.replace(temp_dir, index_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.exists(index_dir):
+                raise
+
+
+def chunk_metadata(chunk_records, first=0):
+    # Position of each chunk plus where it came from in the source document
+    return [{'chunk': position, 'start': record.start, 'end': record.end, 'page': record.page}
+            for position, record in enumerate(chunk_records, first)]
+
+
+def chunk_batches(chunks, batch_size=INDEX_BATCH_CHUNKS):
+    """Groups an iterable of (ChunkRecord, text) pairs into lists of up to ``batch_size``.
+
+    A document without chunks still gives one empty batch.
+    """
+    chunks = iter(chunks)
+    batch = list(islice(chunks, batch_size))
+    while True:
+        yield batch
+        batch = list(islice(chunks, batch_size))
+        if not batch:
+            return
+
+
+def add_chunks(vector_store, chunks, vectors, embeddings):
+    """Adds a batch of (ChunkRecord, text) pairs and their vectors to ``vector_store`` and returns it.
+
+    The store is created from the first batch, when ``vector_store`` is None. Building an index
+    batch by batch holds the vectors of one batch rather than those of the whole document.
+    """
+    texts = [text for _, text in chunks]
+    first = vector_store.index.ntotal if vector_store is not None else 0
+    metadata = chunk_metadata([record for record, _ in chunks], first)
+    if vector_store is None:
+        return FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadata)
+    vector_store.add_embeddings(list(zip(texts, vectors)), metadata)
+    return vector_store
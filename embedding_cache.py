@@ -0,0 +1,161 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = os.path.join(".llm_coder_cache", "embeddings.sqlite")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk store of embedding vectors keyed by (embedding model, chunk hash).
+
+    Vectors are kept as float32 blobs, or float16 when ``use_float16`` is set, and the
+    least recently used rows are evicted once the stored vectors exceed ``max_bytes``.
+    Their total size is counted once when the cache is opened and kept up to date on
+    every write, so writes cost the same however large the cache grows.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, use_float16=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dtype = np.float16 if use_float16 else np.float32
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, chunk_hash TEXT NOT NULL, dtype TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, chunk_hash))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, chunk_hashes):
+        found = {}
+        unique_hashes = list(dict.fromkeys(chunk_hashes))
+        now = time.time()
+        with self._lock:
+            # Stay well below SQLite's limit on the number of bound parameters
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT chunk_hash, dtype, vector FROM embeddings "
+                    f"WHERE model = ? AND chunk_hash IN ({placeholders})", [model, *batch]).fetchall()
+                for chunk_hash, dtype, vector in rows:
+                    found[chunk_hash] = np.frombuffer(vector, dtype=dtype).astype(np.float32).tolist()
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND chunk_hash = ?",
+                    [(now, model, row[0]) for row in rows])
+            self._connection.commit()
+            self.hits += sum(1 for chunk_hash in chunk_hashes if chunk_hash in found)
+            self.misses += sum(1 for chunk_hash in chunk_hashes if chunk_hash not in found)
+        return found
+
+    def put_many(self, model, vectors_by_hash):
+        now = time.time()
+        rows = []
+        for chunk_hash, vector in vectors_by_hash.items():
+            blob = np.asarray(vector, dtype=self.dtype).tobytes()
+            rows.append((model, chunk_hash, np.dtype(self.dtype).name, blob, len(blob), now))
+        with self._lock:
+            # Rows that are replaced no longer count towards the total
+            chunk_hashes = list(vectors_by_hash)
+            for start in range(0, len(chunk_hashes), 500):
+                batch = chunk_hashes[start:start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                self._total_size -= self._connection.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE model = ? AND chunk_hash IN ({placeholders})",
+                    [model, *batch]).fetchone()[0]
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, chunk_hash, dtype, vector, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._total_size += sum(row[4] for row in rows)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if self._total_size <= self.max_bytes:
+            return
+        excess = self._total_size - self.max_bytes
+        cursor = self._connection.execute("SELECT rowid, size FROM embeddings ORDER BY last_used")
+        stale_rows = []
+        for rowid, size in cursor:
+            stale_rows.append((rowid,))
+            excess -= size
+            self._total_size -= size
+            if excess <= 0:
+                break
+        self._connection.executemany("DELETE FROM embeddings WHERE rowid = ?", stale_rows)
+
+    def stats(self):
+        return f"embedding cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks missing from an EmbeddingCache to the API."""
+
+    def __init__(self, embeddings, cache=None):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model = getattr(embeddings, 'model', type(embeddings).__name__)
+        # Called with the texts that are sent to the embedding model, e.g. RunMetrics.embedding_requested
+        self.on_embed = None
+
+    def embed_documents(self, texts):
+        chunk_hashes, cached, missing = self._lookup(texts)
+        if missing:
+            self._notify(missing)
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(cached, missing, vectors)
+        return [cached[chunk_hash] for chunk_hash in chunk_hashes]
+
+    async def aembed_documents(self, texts):
+        chunk_hashes, cached, missing = self._lookup(texts)
+        if missing:
+            self._notify(missing)
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            self._store(cached, missing, vectors)
+        return [cached[chunk_hash] for chunk_hash in chunk_hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def _lookup(self, texts):
+        chunk_hashes = [hash_text(text) for text in texts]
+        cached = self.cache.get_many(self.model, chunk_hashes)
+        # Identical chunks inside one request are only embedded once
+        missing = {}
+        for chunk_hash, text in zip(chunk_hashes, texts):
+            if chunk_hash not in cached:
+                missing.setdefault(chunk_hash, text)
+        return chunk_hashes, cached, missing
+
+    def _notify(self, missing):
+        if self.on_embed is not None:
+            self.on_embed(list(missing.values()))
+
+    def _store(self, cached, missing, vectors):
+        new_vectors = dict(zip(missing.keys(), vectors))
+        self.cache.put_many(self.model, new_vectors)
+        cached.update(new_vectors)
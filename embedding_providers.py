@@ -0,0 +1,42 @@
+# Values of the embedding_provider option
+EMBEDDINGS_OPENAI = 'openai'
+EMBEDDINGS_HASHING = 'hashing'
+EMBEDDINGS_LOCAL_MODEL = 'local-model'
+EMBEDDING_PROVIDERS = [EMBEDDINGS_OPENAI, EMBEDDINGS_HASHING, EMBEDDINGS_LOCAL_MODEL]
+
+
+def create_embeddings(provider=EMBEDDINGS_OPENAI, rate_limiter=None, model=None, cache=None):
+    """Returns the embeddings of ``provider`` behind the on-disk embedding cache.
+
+    Requests to the OpenAI API go through ``rate_limiter``, which then also does the retrying;
+    cached chunks do not count against the rate limits. A ``model`` given in place of the
+    provider's, such as the simulated one of the benchmark, is rate limited the same way.
+    ``cache`` replaces the EmbeddingCache at its default path.
+
+    The embedding classes are imported here rather than with this module, which the GUI and
+    the CLI load for the provider names: langchain_openai alone takes about a second to import.
+    """
+    from embedding_cache import CachedEmbeddings
+
+    if model is not None:
+        if rate_limiter is None:
+            embeddings = model
+        else:
+            from rate_limiter import RateLimitedEmbeddings
+            embeddings = RateLimitedEmbeddings(model, rate_limiter)
+    elif provider == EMBEDDINGS_OPENAI:
+        from langchain_openai import OpenAIEmbeddings
+        if rate_limiter is None:
+            embeddings = OpenAIEmbeddings()
+        else:
+            from rate_limiter import RateLimitedEmbeddings
+            embeddings = RateLimitedEmbeddings(OpenAIEmbeddings(max_retries=0), rate_limiter)
+    elif provider == EMBEDDINGS_HASHING:
+        from local_embeddings import HashingEmbeddings
+        embeddings = HashingEmbeddings()
+    elif provider == EMBEDDINGS_LOCAL_MODEL:
+        from local_embeddings import LocalModelEmbeddings
+        embeddings = LocalModelEmbeddings()
+    else:
+        raise ValueError(f"Unknown embedding provider: {provider}")
+    return CachedEmbeddings(embeddings, cache)
@@ -0,0 +1,177 @@
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from rate_limiter import TokenBucket
+from token_chunker import CHUNK_ENCODING, get_encoding
+
+EMBEDDING_DIMENSIONS = 256
+COMPLETION = "3; Simulated answer from the local test server."
+# Concept lines of a multi-concept prompt, see concept_coding.construct_multi_concept_prompt
+CONCEPT_LINE = re.compile(r"^- ([^:\n]+):", re.MULTILINE)
+
+
+class FakeOpenAIServer:
+    """Local stand-in for the OpenAI chat completions and embeddings endpoints that enforces rate limits.
+
+    Requests over ``requests_per_minute`` or ``tokens_per_minute`` are answered with 429 and
+    Retry-After headers, as the API does, so the rate limiter can be tried without an account.
+    Like the API's per-model limits, each endpoint has limits of its own.
+    Other requests are answered after ``latency`` seconds with a fixed completion, or with
+    vectors seeded by the text. Use it as a context manager and point the client at ``base_url``.
+    """
+
+    def __init__(self, requests_per_minute=600, tokens_per_minute=0, latency=0.0, port=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # Endpoint -> (requests bucket, tokens bucket)
+        self.buckets = {}
+        self.latency = latency
+        self.served = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def admit(self, endpoint, tokens):
+        # Returns 0 when the request is within the limits, otherwise the seconds until it would be
+        with self._lock:
+            if endpoint not in self.buckets:
+                self.buckets[endpoint] = (
+                    TokenBucket(self.requests_per_minute) if self.requests_per_minute > 0 else None,
+                    TokenBucket(self.tokens_per_minute) if self.tokens_per_minute > 0 else None)
+            requests, tokens_bucket = self.buckets[endpoint]
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in ((requests, 1), (tokens_bucket, tokens)):
+                if bucket is not None:
+                    wait = max(wait, bucket.wait_time(amount, now))
+            if wait > 0:
+                self.rejected += 1
+                return wait
+            for bucket, amount in ((requests, 1), (tokens_bucket, tokens)):
+                if bucket is not None:
+                    bucket.take(amount, now)
+            self.served += 1
+            return 0
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    prompt_tokens = sum(count_tokens(message.get('content') or "") for message in body['messages'])
+                    response = chat_response(body, prompt_tokens)
+                    tokens = prompt_tokens + response['usage']['completion_tokens']
+                elif self.path.endswith("/embeddings"):
+                    inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+                    response = embedding_response(body, inputs)
+                    tokens = response['usage']['total_tokens']
+                else:
+                    self._send(404, {'error': {'message': f"Unknown path {self.path}",
+                                               'type': 'invalid_request_error'}})
+                    return
+
+                wait = server.admit(self.path, tokens)
+                if wait:
+                    self._send(429, {'error': {'message': "Rate limit reached, please try again later.",
+                                               'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                               {'retry-after-ms': str(int(wait * 1000) + 1), 'retry-after': str(int(wait) + 1)})
+                    return
+                time.sleep(server.latency)
+                self._send(200, response)
+
+            def _send(self, status, payload, headers=None):
+                content = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def count_tokens(text):
+    return len(get_encoding(CHUNK_ENCODING).encode(text, disallowed_special=()))
+
+
+def chat_response(body, prompt_tokens):
+    completion = COMPLETION
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        # JSON mode answers code every concept listed in the prompt
+        prompt = "\n".join(message.get('content') or "" for message in body['messages'])
+        completion = json.dumps({'codes': [{'concept': concept, 'score': 3, 'explanation': "Simulated answer."}
+                                           for concept in CONCEPT_LINE.findall(prompt)]})
+    completion_tokens = count_tokens(completion)
+    return {
+        'id': "chatcmpl-local", 'object': "chat.completion", 'created': int(time.time()), 'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': completion}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+def embedding_response(body, inputs):
+    # Inputs are texts or, as OpenAIEmbeddings sends them, lists of token ids
+    tokens = sum(len(item) if isinstance(item, list) else count_tokens(item) for item in inputs)
+    data = []
+    for index, item in enumerate(inputs):
+        seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode('utf-8')).digest()[:4], 'little')
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        embedding = (base64.b64encode(vector.tobytes()).decode('ascii') if body.get('encoding_format') == 'base64'
+                     else vector.tolist())
+        data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+    return {'object': 'list', 'data': data, 'model': body.get('model'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI stand-in that answers requests over its rate limits with 429. "
+                    "Point the tool at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--rpm', type=int, default=60, help="requests per minute, 0 for no limit")
+    parser.add_argument('--tpm', type=int, default=0, help="tokens per minute, 0 for no limit")
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds per answered request")
+    args = parser.parse_args(argv)
+    with FakeOpenAIServer(args.rpm, args.tpm, args.latency, args.port) as server:
+        print(f"Serving on {server.base_url}, press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"{server.served} requests answered, {server.rejected} rejected with 429.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+import codecs
+import hashlib
+import io
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from PyPDF2 import PdfReader
 
+from token_chunker import CHUNK_ENCODING, DEFAULT_CHUNK_OVERLAP, TokenChunker
+
+# PDFs with fewer pages are extracted in the calling process
+PARALLEL_PDF_MIN_PAGES = 64
+PAGES_PER_TASK = 16
+TEXT_BLOCK_SIZE = 1024 * 1024
+
 
 class FileUtils:
 
@@ -9,26 +23,142 @@ class FileUtils:
         return file.lower().endswith('.pdf')
 
     @staticmethod
-    def split_text(text, chunk_size):
-        # chunk_size is the maximum chunk size that will be split if splitting is possible.
-        # If not possible the chunk will end at the next possible place.
-        # If a chunk is bigger than the size defined here, a message will be shown in the console.
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=200,
-            length_function=len,
-            is_separator_regex=False
-        )
-        return text_splitter.split_text(text)
+    def split_text(text, chunk_size, chunk_overlap=DEFAULT_CHUNK_OVERLAP, page_starts=None):
+        # chunk_size and chunk_overlap are counted in tokens of the embedding model.
+        # Returns ChunkRecords (offsets into text); use record.text(text) for the chunk itself.
+        return TokenChunker(chunk_size, chunk_overlap).chunk(text, page_starts)
+
+    @staticmethod
+    def split_pages(pages, chunk_size, chunk_overlap=DEFAULT_CHUNK_OVERLAP, paged=True):
+        """Chunks an iterable of page texts without joining the whole document first.
+
+        Yields (ChunkRecord, chunk text) pairs; only a window of a few dozen chunks is held in memory.
+        """
+        return TokenChunker(chunk_size, chunk_overlap).chunk_pages(pages, paged)
+
+    # Everything besides the input text that determines how split_text cuts a document
+    @staticmethod
+    def splitter_settings(chunk_size, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+        return {
+            'splitter': TokenChunker.__name__,
+            'encoding': CHUNK_ENCODING,
+            'chunk_size': int(chunk_size),
+            'chunk_overlap': int(chunk_overlap),
+        }
+
+    # Offsets at which each page starts in the joined document text
+    @staticmethod
+    def page_starts(pages):
+        starts = []
+        offset = 0
+        for page in pages:
+            starts.append(offset)
+            offset += len(page)
+        return starts
+
+    @staticmethod
+    def hash_file(file):
+        digest = hashlib.sha256()
+        with open(file, 'rb') as binary_file:
+            for block in iter(lambda: binary_file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # Reads a .txt or .pdf file into a single string
+    @staticmethod
+    def read_text(file):
+        if file.endswith('.txt'):
+            with open(file, "r", encoding='utf-8', errors='replace') as text_file:
+                return text_file.read()
+        elif file.endswith('.pdf'):
+            return FileUtils.extract_text_from_pdf_file(file)
+        return ''
+
+    # Reads a .txt file as a single page or a .pdf file as a list of page texts
+    @staticmethod
+    def read_pages(file):
+        if FileUtils.is_pdf_file(file):
+            return list(FileUtils.iter_pdf_pages(file))
+        return [FileUtils.read_text(file)]
+
+    # Yields the text of a .txt file in blocks or of a .pdf file page by page
+    @staticmethod
+    def iter_text(file, workers=1):
+        if file.endswith('.txt'):
+            yield from FileUtils.iter_text_blocks(file)
+        elif file.endswith('.pdf'):
+            yield from FileUtils.iter_pdf_pages(file, workers)
+
+    @staticmethod
+    def iter_text_blocks(file):
+        """Yields the text of a .txt file in blocks of about TEXT_BLOCK_SIZE bytes.
+
+        The file is memory-mapped and decoded incrementally, with the same newline and
+        error handling as read_text, so a character or a line break cut at a block
+        boundary comes out whole and only one block is decoded at a time. Pages of the
+        mapping that were decoded are released again, so they do not add up in the
+        resident memory of the process as the file is read.
+        """
+        with open(file, 'rb') as binary_file:
+            size = os.fstat(binary_file.fileno()).st_size
+            if size == 0:
+                # An empty file cannot be mapped
+                return
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(errors='replace'),
+                                                   translate=True)
+            with mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for start in range(0, size, TEXT_BLOCK_SIZE):
+                    block = mapped[start:start + TEXT_BLOCK_SIZE]
+                    if hasattr(mmap, 'MADV_DONTNEED'):
+                        # TEXT_BLOCK_SIZE is a multiple of the page size, as madvise requires
+                        mapped.madvise(mmap.MADV_DONTNEED, start, len(block))
+                    text = decoder.decode(block)
+                    del block
+                    if text:
+                        yield text
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
 
     # Gets the text from each page and combines them together
     @staticmethod
-    def extract_text_from_pdf_file(file):
+    def extract_text_from_pdf_file(file, workers=1):
+        return ''.join(FileUtils.iter_pdf_pages(file, workers))
+
+    @staticmethod
+    def iter_pdf_pages(file, workers=1):
+        """Yields the text of every page in page order; pages without text yield an empty string.
+
+        Large PDFs are extracted across ``workers`` processes (None means one per CPU).
+        Only a window of two tasks per worker is in flight, so memory stays bounded by
+        that window rather than by the size of the report.
+        """
         pdfreader = PdfReader(file)
+        page_count = len(pdfreader.pages)
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or page_count < PARALLEL_PDF_MIN_PAGES:
+            for page in pdfreader.pages:
+                yield page.extract_text() or ''
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            ranges = iter(range(0, page_count, PAGES_PER_TASK))
+            for start in ranges:
+                pending.append(pool.submit(extract_page_range, file, start, min(start + PAGES_PER_TASK, page_count)))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                yield from pending.popleft().result()
+                start = next(ranges, None)
+                if start is not None:
+                    pending.append(pool.submit(extract_page_range, file, start,
+                                               min(start + PAGES_PER_TASK, page_count)))
+
 
-        raw_text = ''
-        for i, page in enumerate(pdfreader.pages):
-            content = page.extract_text()
-            if content:
-                raw_text += content
-        return raw_text
+def extract_page_range(file, start, stop):
+    # Runs in a worker process, so it opens its own reader
+    pages = PdfReader(file).pages
+    return [pages[number].extract_text() or '' for number in range(start, stop)]
@@ -1,151 +1,71 @@
-import os
+import queue
 import tkinter as tk
-import tiktoken
-from datetime import datetime
 from tkinter import filedialog, messagebox
 from tkinter import ttk
 
-from langchain_community.vectorstores import FAISS
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
-
+from background_worker import BackgroundWorker, CANCELLED, DONE, FAILED, PROGRESS
 from configuration_option import ConfigurationOption
 from configuration_section import ConfigurationSection
-from file_utils import FileUtils
+from corpus_index import CORPUS_INDEX_KINDS, CORPUS_OFF
+from embedding_providers import EMBEDDING_PROVIDERS, EMBEDDINGS_OPENAI
+from llm_response_cache import CACHE_OFF, CACHE_REFRESH, CACHE_USE
+from map_reduce_coding import DEFAULT_MAP_PARALLELISM, LONG_DOCUMENT_MODES, LONG_DOCUMENTS_RETRIEVE
 from prompt_components import PromptComponents
+from results_saver import RESULT_FORMATS
+from concept_coding import ALL_CONCEPTS
 from context_retrieval_config import ContextRetrievalConfig
-from tool_config import ToolConfig
-from results_saver import ResultsSaver
+from tool_config import DEFAULT_CONTEXT_TOKEN_BUDGET, DEFAULT_MAX_IN_FLIGHT, ToolConfig
 from configuration import Configuration
 
-# The API key is read from the environment variable OPENAI_API_KEY
-api_key = os.getenv('OPENAI_API_KEY')
 background_color = "#dff5e0"
+# How often the GUI checks the background worker for progress, in milliseconds
+worker_poll_interval = 200
+# Delay after start-up before the pipeline is imported in the background, so the window is drawn first
+warm_up_delay = 500
+WARM_UP_CHOICES = ["on", "off"]
+COLLAPSE_DUPLICATES_CHOICES = ["on", "off"]
 
 
-def main(tool_config):
-    if not api_key:
-        print("OPENAI_API_KEY environment variable is not set.")
-        return
-
-    if tool_config.tool_mode == '1':
-        fully_automated_coding(tool_config)
-    else:
-        relevant_context_retrieval(tool_config)
-
-
-def fully_automated_coding(tool_config):
-    # Prepare the LLM and the Q&A chain
-    llm = ChatOpenAI(temperature=0.0, model_name="gpt-4o")
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    for single_file in tool_config.files_array:
-        prompt = construct_prompt(tool_config.messages)
-        context_config = tool_config.context_retrieval_config
-        raw_text = ''
-        if single_file.endswith('.txt'):
-            with open(single_file, "r", encoding='utf-8', errors='replace') as file:
-                raw_text = file.read()
-        elif single_file.endswith('.pdf'):
-            raw_text = FileUtils.extract_text_from_pdf_file(single_file)
-
-        tokenizer = tiktoken.encoding_for_model("gpt-4o")
-
-        # Tokenize the text
-        tokens = tokenizer.encode(raw_text)
-
-        # Count the number of tokens
-        token_count = len(tokens)
-
-        if token_count > 10000:
-            embeddings = OpenAIEmbeddings()
-            text_chunks = FileUtils.split_text(raw_text, context_config.chunk_size)
-            vector_store = FAISS.from_texts(text_chunks, embeddings)
-            threshold_value = float(context_config.threshold)
-            results_with_scores = vector_store.similarity_search_with_relevance_scores(
-                prompt,
-                k=context_config.max_chunks,
-                threshold=threshold_value)
-            filtered_results = [doc for doc, score in results_with_scores if score >= threshold_value]
-
-            combined_chunks = refactor_documents(filtered_results)
-            prompt = f"{prompt}\n\nHere is the text for your analysis:\n\n{combined_chunks}"
-            print(prompt)
-            response = llm.invoke(prompt)
-
-        else:
-            prompt = f"{prompt}\n\nHere is the text for your analysis:\n\n{raw_text}"
-            print(prompt)
-
-            response = llm.invoke(prompt)
-
-        result_saver = ResultsSaver(single_file, tool_config.save_path, response.content,
-                                    tool_config.concept_input)
-        result_saver.save_results_fully_automated(timestamp)
-
-
-def relevant_context_retrieval(tool_config):
-    context_config = tool_config.context_retrieval_config
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    embeddings = OpenAIEmbeddings()
-    threshold_value = float(context_config.threshold)
-    messages = tool_config.messages
-    result_format = context_config.result_format
-    concept = tool_config.concept_input
-
-    for single_file in tool_config.files_array:
-        raw_text = ''
-        if single_file.endswith('.txt'):
-            with open(single_file, "r", encoding='utf-8', errors='replace') as file:
-                raw_text = file.read()
-        elif single_file.endswith('.pdf'):
-            raw_text = FileUtils.extract_text_from_pdf_file(single_file)
-        text_chunks = FileUtils.split_text(raw_text, context_config.chunk_size)
-        print(text_chunks.__sizeof__())
-        vector_store = FAISS.from_texts(text_chunks, embeddings)
-        results_with_scores = vector_store.similarity_search_with_relevance_scores(
-            Configuration.get_concept_description(tool_config.concept_input),
-            k=context_config.max_chunks,
-            threshold=threshold_value)
-        filtered_results = [(doc, score) for doc, score in results_with_scores if score >= threshold_value]
-
-        if result_format == "txt":
-            ResultsSaver.save_results_relevant_chunks_in_txt_file(concept, single_file, filtered_results,
-                                                                  tool_config.save_path,
-                                                                  timestamp)
-        elif result_format == "csv":
-            ResultsSaver.save_results_relevant_chunks_in_csv_file(concept, single_file, filtered_results,
-                                                                  tool_config.save_path,
-                                                                  timestamp)
-
-
-def construct_prompt(messages):
-    prompt = (f"{messages.system_message}\n{messages.user_message}\n "
-              f"Please provide the output in the following format: \n{messages.output_format}")
-    return prompt
-
-
-def refactor_documents(documents):
-    page_contents = []
-
-    for doc in documents:
-        if hasattr(doc, 'page_content'):
-            page_contents.append(doc.page_content)
-
-    return '\n\n'.join(page_contents)
+def concept_choices(concepts):
+    # Every concept at once: retrieval chunks and embeds the corpus once, coding sends each document once
+    return [ALL_CONCEPTS] + list(concepts.keys())
 
 
 class App:
     def __init__(self, root_1):
         self.config_window = None
         self.format_var = (
-            tk.StringVar(value=Configuration.get_context_retrieval_option(ConfigurationOption.RESULT_FORMAT)))
-        self.chunk_size_var = (
-            tk.IntVar(value=Configuration.get_context_retrieval_option(ConfigurationOption.CHUNK_SIZE)))
-        self.threshold_var = (
-            tk.DoubleVar(value=Configuration.get_context_retrieval_option(ConfigurationOption.THRESHOLD)))
-        self.max_chunks_var = (
-            tk.IntVar(value=Configuration.get_context_retrieval_option(ConfigurationOption.MAX_CHUNKS)))
+            tk.StringVar(value=Configuration.get_str_option(ConfigurationOption.RESULT_FORMAT, "txt")))
+        self.coding_format_var = (
+            tk.StringVar(value=Configuration.get_str_option(ConfigurationOption.CODING_RESULT_FORMAT, "txt")))
+        self.chunk_size_var = tk.IntVar(value=Configuration.get_chunk_size())
+        self.chunk_overlap_var = tk.IntVar(value=Configuration.get_chunk_overlap())
+        self.threshold_var = tk.DoubleVar(value=Configuration.get_threshold())
+        self.max_chunks_var = tk.IntVar(value=Configuration.get_max_chunks())
+        self.llm_cache_var = tk.StringVar(value=Configuration.get_str_option(ConfigurationOption.LLM_CACHE, CACHE_USE))
+        self.max_in_flight_var = (
+            tk.IntVar(value=Configuration.get_int_option(ConfigurationOption.MAX_IN_FLIGHT, DEFAULT_MAX_IN_FLIGHT)))
+        self.corpus_index_var = (
+            tk.StringVar(value=Configuration.get_str_option(ConfigurationOption.CORPUS_INDEX, CORPUS_OFF)))
+        self.embedding_provider_var = tk.StringVar(
+            value=Configuration.get_str_option(ConfigurationOption.EMBEDDING_PROVIDER, EMBEDDINGS_OPENAI))
+        self.bm25_candidates_var = (
+            tk.IntVar(value=Configuration.get_int_option(ConfigurationOption.BM25_CANDIDATES, 0)))
+        self.near_duplicate_threshold_var = tk.DoubleVar(
+            value=Configuration.get_float_option(ConfigurationOption.NEAR_DUPLICATE_THRESHOLD, 0.0))
+        self.collapse_duplicates_var = tk.StringVar(
+            value=Configuration.get_str_option(ConfigurationOption.COLLAPSE_DUPLICATES, "off"))
+        self.long_documents_var = tk.StringVar(
+            value=Configuration.get_str_option(ConfigurationOption.LONG_DOCUMENTS, LONG_DOCUMENTS_RETRIEVE))
+        self.map_parallelism_var = (
+            tk.IntVar(value=Configuration.get_int_option(ConfigurationOption.MAP_PARALLELISM, DEFAULT_MAP_PARALLELISM)))
+        self.context_token_budget_var = tk.IntVar(
+            value=Configuration.get_int_option(ConfigurationOption.CONTEXT_TOKEN_BUDGET, DEFAULT_CONTEXT_TOKEN_BUDGET))
+        self.warm_up_var = tk.StringVar(value=Configuration.get_str_option(ConfigurationOption.WARM_UP, "on"))
+        # Account rate limits of the chat and the embedding model
+        self.rate_limit_vars = {option: tk.IntVar(value=Configuration.get_int_option(option, 0)) for option in (
+            ConfigurationOption.LLM_REQUESTS_PER_MINUTE, ConfigurationOption.LLM_TOKENS_PER_MINUTE,
+            ConfigurationOption.EMBEDDING_REQUESTS_PER_MINUTE, ConfigurationOption.EMBEDDING_TOKENS_PER_MINUTE)}
         self.add_concept_window = None
         self.concept_description_entry = None
         self.concept_name_entry = None
@@ -153,6 +73,8 @@ class App:
         self.concept_listbox = None
         self.concept_window = None
         self.root = root_1
+        self.worker = BackgroundWorker()
+        self.submitted_prompt = None
         self.root.title("LLM-Coder")
 
         # Menu
@@ -165,7 +87,7 @@ class App:
         config_menu.add_command(label="Configuration", command=self.open_configuration)
 
         # Set the size of the window
-        self.root.geometry("650x530")  # Width x Height
+        self.root.geometry("650x600")  # Width x Height
 
         # Make the window non-resizable
         self.root.resizable(False, False)
@@ -183,8 +105,8 @@ class App:
 
         # Concept input dropdown
         tk.Label(root, text="Concept:", bg=background_color).grid(row=2, column=0, padx=5, pady=(20, 5))
-        self.concept_combobox = ttk.Combobox(root, values=list(Configuration.read_concepts().keys()), state="readonly",
-                                             width=47)  # Create a readonly combobox
+        self.concept_combobox = ttk.Combobox(root, values=concept_choices(Configuration.read_concepts()),
+                                             state="readonly", width=47)  # Create a readonly combobox
         self.concept_combobox.grid(row=2, column=1, columnspan=1, padx=5, pady=(20, 5))
 
         # Button to view concepts
@@ -227,17 +149,34 @@ class App:
         self.save_path_entry.grid(row=7, column=1, padx=5, pady=5)
         tk.Button(root, text="Browse", command=self.browse_save_path).grid(row=7, column=2, padx=5, pady=5)
 
-        # Run button
-        tk.Button(root, text="Run", command=self.run_main).grid(row=9, column=0, columnspan=4, pady=10)
+        # Run and Cancel buttons
+        button_frame = tk.Frame(root, bg=background_color)
+        button_frame.grid(row=9, column=0, columnspan=4, pady=10)
+        self.run_button = tk.Button(button_frame, text="Run", command=self.run_main)
+        self.run_button.pack(side="left", padx=5)
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel_run, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+        self.resume_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(button_frame, text="Resume the last run", variable=self.resume_var,
+                       bg=background_color).pack(side="left", padx=5)
+
+        # Progress of the running job
+        self.progress_bar = ttk.Progressbar(root, length=400, mode="determinate")
+        self.progress_bar.grid(row=10, column=0, columnspan=4, pady=(0, 5))
+        self.status_label = tk.Label(root, text="", bg=background_color)
+        self.status_label.grid(row=11, column=0, columnspan=4)
 
         for i in range(4):
             root.grid_columnconfigure(i, weight=1)
         self.toggle_fields()
 
+        if self.warm_up_var.get() == "on":
+            self.root.after(warm_up_delay, self.worker.warm_up)
+
     def open_configuration(self):
         self.config_window = tk.Toplevel(self.root)
         self.config_window.title("Configuration")
-        self.config_window.geometry("570x230")
+        self.config_window.geometry("570x965")
 
         # Maximum number of chunks entry
         (tk.Label(self.config_window, text="Maximum number of text chunks that can be retrieved:")
@@ -245,46 +184,184 @@ class App:
         max_chunks_entry = tk.Entry(self.config_window, textvariable=self.max_chunks_var, width=10)
         max_chunks_entry.grid(row=0, column=1, padx=10, pady=10)
 
-        (tk.Label(self.config_window, text="Maximum number of characters for a single chunk:")
+        (tk.Label(self.config_window, text="Maximum number of tokens for a single chunk:")
          .grid(row=1, column=0, padx=10, pady=10, sticky="w"))
         chunk_size_entry = tk.Entry(self.config_window, textvariable=self.chunk_size_var, width=10)
         chunk_size_entry.grid(row=1, column=1, padx=10, pady=10)
 
+        (tk.Label(self.config_window, text="Number of tokens shared by neighbouring chunks:")
+         .grid(row=2, column=0, padx=10, pady=10, sticky="w"))
+        chunk_overlap_entry = tk.Entry(self.config_window, textvariable=self.chunk_overlap_var, width=10)
+        chunk_overlap_entry.grid(row=2, column=1, padx=10, pady=10)
+
         # Threshold entry
         (tk.Label(self.config_window, text="Minimal threshold for the similarity search algorithm [0,1]:")
-         .grid(row=2, column=0, padx=10, pady=10, sticky="w"))
+         .grid(row=3, column=0, padx=10, pady=10, sticky="w"))
         threshold_entry = tk.Entry(self.config_window, textvariable=self.threshold_var, width=10)
-        threshold_entry.grid(row=2, column=1, padx=10, pady=10)
+        threshold_entry.grid(row=3, column=1, padx=10, pady=10)
 
         # Result format dropdown
-        (tk.Label(self.config_window, text="Result format (applicable only to the relevant context retrieval feature):")
-         .grid(row=3, column=0, padx=10, pady=10, sticky="w"))
-        format_dropdown = ttk.Combobox(self.config_window, textvariable=self.format_var, values=["txt", "csv"],
+        (tk.Label(self.config_window, text="Retrieval result format (jsonl and parquet keep typed columns):")
+         .grid(row=4, column=0, padx=10, pady=10, sticky="w"))
+        format_dropdown = ttk.Combobox(self.config_window, textvariable=self.format_var, values=RESULT_FORMATS,
                                        state="readonly")
-        format_dropdown.grid(row=3, column=1, padx=10, pady=10)
+        format_dropdown.grid(row=4, column=1, padx=10, pady=10)
+
+        # Concurrency entry
+        (tk.Label(self.config_window, text="Maximum number of documents processed concurrently:")
+         .grid(row=5, column=0, padx=10, pady=10, sticky="w"))
+        max_in_flight_entry = tk.Entry(self.config_window, textvariable=self.max_in_flight_var, width=10)
+        max_in_flight_entry.grid(row=5, column=1, padx=10, pady=10)
+
+        # LLM response cache dropdown
+        (tk.Label(self.config_window, text="Reuse cached LLM responses (use, refresh or off):")
+         .grid(row=6, column=0, padx=10, pady=10, sticky="w"))
+        llm_cache_dropdown = ttk.Combobox(self.config_window, textvariable=self.llm_cache_var,
+                                          values=[CACHE_USE, CACHE_REFRESH, CACHE_OFF], state="readonly")
+        llm_cache_dropdown.grid(row=6, column=1, padx=10, pady=10)
+
+        # Corpus index dropdown
+        (tk.Label(self.config_window, text="Add retrieved documents to the corpus-wide index:")
+         .grid(row=7, column=0, padx=10, pady=10, sticky="w"))
+        corpus_index_dropdown = ttk.Combobox(self.config_window, textvariable=self.corpus_index_var,
+                                             values=CORPUS_INDEX_KINDS, state="readonly")
+        corpus_index_dropdown.grid(row=7, column=1, padx=10, pady=10)
+
+        # Embedding provider dropdown
+        (tk.Label(self.config_window, text="Embeddings (hashing and local-model run on the CPU without the API):")
+         .grid(row=8, column=0, padx=10, pady=10, sticky="w"))
+        embedding_provider_dropdown = ttk.Combobox(self.config_window, textvariable=self.embedding_provider_var,
+                                                   values=EMBEDDING_PROVIDERS, state="readonly")
+        embedding_provider_dropdown.grid(row=8, column=1, padx=10, pady=10)
+
+        # BM25 prefilter entry
+        (tk.Label(self.config_window, text="Chunks per concept the BM25 prefilter embeds (0 embeds all):")
+         .grid(row=9, column=0, padx=10, pady=10, sticky="w"))
+        bm25_candidates_entry = tk.Entry(self.config_window, textvariable=self.bm25_candidates_var, width=10)
+        bm25_candidates_entry.grid(row=9, column=1, padx=10, pady=10)
+
+        # Long document dropdown
+        (tk.Label(self.config_window, text="Documents over the token budget (retrieve or map-reduce):")
+         .grid(row=10, column=0, padx=10, pady=10, sticky="w"))
+        long_documents_dropdown = ttk.Combobox(self.config_window, textvariable=self.long_documents_var,
+                                               values=LONG_DOCUMENT_MODES, state="readonly")
+        long_documents_dropdown.grid(row=10, column=1, padx=10, pady=10)
+
+        # Map-reduce parallelism entry
+        (tk.Label(self.config_window, text="Section requests sent at the same time in map-reduce:")
+         .grid(row=11, column=0, padx=10, pady=10, sticky="w"))
+        map_parallelism_entry = tk.Entry(self.config_window, textvariable=self.map_parallelism_var, width=10)
+        map_parallelism_entry.grid(row=11, column=1, padx=10, pady=10)
+
+        # Warm-up dropdown
+        (tk.Label(self.config_window, text="Load the pipeline in the background at start-up:")
+         .grid(row=12, column=0, padx=10, pady=10, sticky="w"))
+        warm_up_dropdown = ttk.Combobox(self.config_window, textvariable=self.warm_up_var, values=WARM_UP_CHOICES,
+                                        state="readonly")
+        warm_up_dropdown.grid(row=12, column=1, padx=10, pady=10)
+
+        # Rate limit entries
+        rate_limit_labels = ["Chat model requests per minute (0 for no limit):",
+                             "Chat model tokens per minute (0 for no limit):",
+                             "Embedding requests per minute (0 for no limit):",
+                             "Embedding tokens per minute (0 for no limit):"]
+        for row, (label, variable) in enumerate(zip(rate_limit_labels, self.rate_limit_vars.values()), start=13):
+            tk.Label(self.config_window, text=label).grid(row=row, column=0, padx=10, pady=10, sticky="w")
+            tk.Entry(self.config_window, textvariable=variable, width=10).grid(row=row, column=1, padx=10, pady=10)
+
+        # Near-duplicate threshold entry
+        (tk.Label(self.config_window, text="Similarity at which chunks reuse a vector (0 embeds all):")
+         .grid(row=17, column=0, padx=10, pady=10, sticky="w"))
+        near_duplicate_threshold_entry = tk.Entry(self.config_window, textvariable=self.near_duplicate_threshold_var,
+                                                  width=10)
+        near_duplicate_threshold_entry.grid(row=17, column=1, padx=10, pady=10)
+
+        # Collapse duplicates dropdown
+        (tk.Label(self.config_window, text="Save near-duplicate results once with their occurrences:")
+         .grid(row=18, column=0, padx=10, pady=10, sticky="w"))
+        collapse_duplicates_dropdown = ttk.Combobox(self.config_window, textvariable=self.collapse_duplicates_var,
+                                                    values=COLLAPSE_DUPLICATES_CHOICES, state="readonly")
+        collapse_duplicates_dropdown.grid(row=18, column=1, padx=10, pady=10)
+
+        # Coding result format dropdown
+        (tk.Label(self.config_window, text="Coding result format:")
+         .grid(row=19, column=0, padx=10, pady=10, sticky="w"))
+        coding_format_dropdown = ttk.Combobox(self.config_window, textvariable=self.coding_format_var,
+                                              values=RESULT_FORMATS, state="readonly")
+        coding_format_dropdown.grid(row=19, column=1, padx=10, pady=10)
+
+        # Context token budget entry
+        (tk.Label(self.config_window, text="Tokens of document text sent with a coding prompt:")
+         .grid(row=20, column=0, padx=10, pady=10, sticky="w"))
+        context_token_budget_entry = tk.Entry(self.config_window, textvariable=self.context_token_budget_var,
+                                              width=10)
+        context_token_budget_entry.grid(row=20, column=1, padx=10, pady=10)
 
         # Save button
         save_button = tk.Button(self.config_window, text="Save", command=self.save_configuration)
-        save_button.grid(row=6, column=0, columnspan=2, pady=20)
+        save_button.grid(row=21, column=0, columnspan=2, pady=20)
 
     def save_configuration(self):
         max_chunks = str(self.max_chunks_var.get())
         chunk_size = str(self.chunk_size_var.get())
+        chunk_overlap = str(self.chunk_overlap_var.get())
         threshold = str(self.threshold_var.get())
         result_format = self.format_var.get()
-
-        Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.MAX_CHUNKS, max_chunks)
-        Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CHUNK_SIZE, chunk_size)
-        Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.THRESHOLD, threshold)
-        Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.RESULT_FORMAT, result_format)
+        coding_result_format = self.coding_format_var.get()
+        max_in_flight = str(self.max_in_flight_var.get())
+        llm_cache = self.llm_cache_var.get()
+        corpus_index = self.corpus_index_var.get()
+        embedding_provider = self.embedding_provider_var.get()
+        bm25_candidates = str(self.bm25_candidates_var.get())
+        near_duplicate_threshold = str(self.near_duplicate_threshold_var.get())
+        collapse_duplicates = self.collapse_duplicates_var.get()
+        long_documents = self.long_documents_var.get()
+        map_parallelism = str(self.map_parallelism_var.get())
+        context_token_budget = str(self.context_token_budget_var.get())
+        warm_up = self.warm_up_var.get()
+
+        # All options are written to prompt_config.ini in a single write
+        with Configuration.batch_updates():
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.MAX_CHUNKS, max_chunks)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CHUNK_SIZE, chunk_size)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CHUNK_OVERLAP,
+                                               chunk_overlap)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.THRESHOLD, threshold)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.RESULT_FORMAT,
+                                               result_format)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CODING_RESULT_FORMAT,
+                                               coding_result_format)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.MAX_IN_FLIGHT,
+                                               max_in_flight)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.LLM_CACHE, llm_cache)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CORPUS_INDEX,
+                                               corpus_index)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.EMBEDDING_PROVIDER,
+                                               embedding_provider)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.BM25_CANDIDATES,
+                                               bm25_candidates)
+            Configuration.update_configuration(ConfigurationSection.OTHER,
+                                               ConfigurationOption.NEAR_DUPLICATE_THRESHOLD, near_duplicate_threshold)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.COLLAPSE_DUPLICATES,
+                                               collapse_duplicates)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.LONG_DOCUMENTS,
+                                               long_documents)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.MAP_PARALLELISM,
+                                               map_parallelism)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.CONTEXT_TOKEN_BUDGET,
+                                               context_token_budget)
+            Configuration.update_configuration(ConfigurationSection.OTHER, ConfigurationOption.WARM_UP, warm_up)
+            for option, variable in self.rate_limit_vars.items():
+                Configuration.update_configuration(ConfigurationSection.OTHER, option, str(variable.get()))
 
         self.config_window.destroy()
 
     def toggle_fields(self):
         is_mode_2 = self.mode.get() == "2"
 
-        self.concept_combobox.config(state="readonly" if is_mode_2 else "disabled")
-        self.edit_button.config(state="normal" if is_mode_2 else "disabled")
+        # Coding also uses the concepts: choosing several codes each document for all of them in one request
+        self.concept_combobox.config(state="readonly")
+        self.edit_button.config(state="normal")
 
         text_fields = [self.system_message, self.user_message, self.output_format]
         for field in text_fields:
@@ -331,21 +408,89 @@ class App:
         threshold = self.threshold_var.get()
         max_chunks = self.max_chunks_var.get()
         result_format = self.format_var.get()
+        coding_result_format = self.coding_format_var.get()
         chunk_size = self.chunk_size_var.get()
+        chunk_overlap = self.chunk_overlap_var.get()
+        max_in_flight = self.max_in_flight_var.get()
+        llm_cache = self.llm_cache_var.get()
+        corpus_index = self.corpus_index_var.get()
+        corpus_pq = Configuration.get_int_option(ConfigurationOption.CORPUS_PQ, 0)
+        embedding_provider = self.embedding_provider_var.get()
+        bm25_candidates = self.bm25_candidates_var.get()
+        near_duplicate_threshold = self.near_duplicate_threshold_var.get()
+        collapse_duplicates = self.collapse_duplicates_var.get() == "on"
+        long_documents = self.long_documents_var.get()
+        map_parallelism = self.map_parallelism_var.get()
+        context_token_budget = self.context_token_budget_var.get()
+        (llm_requests_per_minute, llm_tokens_per_minute, embedding_requests_per_minute,
+         embedding_tokens_per_minute) = (variable.get() for variable in self.rate_limit_vars.values())
+        metrics_textfile = Configuration.get_str_option(ConfigurationOption.METRICS_TEXTFILE, '') or None
+        resume = self.resume_var.get()
 
         self.reset_fields()
 
         try:
             files_array = file_path.split(", ")
             prompt_components = PromptComponents(system_message, user_message, output_format)
-            context_retrieval_config = ContextRetrievalConfig(chunk_size, max_chunks, threshold, result_format)
+            context_retrieval_config = ContextRetrievalConfig(chunk_size, max_chunks, threshold, result_format,
+                                                              chunk_overlap, corpus_index, corpus_pq, bm25_candidates,
+                                                              near_duplicate_threshold=near_duplicate_threshold,
+                                                              collapse_duplicates=collapse_duplicates)
             tool_config = ToolConfig(tool_mode, prompt_components, concept_input, files_array,
-                                     save_path, context_retrieval_config)
-            main(tool_config)
-            Configuration.update_whole_prompt(system_message, user_message, output_format)
-            messagebox.showinfo("Success", "Process completed successfully!")
+                                     save_path, context_retrieval_config, max_in_flight, llm_cache,
+                                     embedding_provider, metrics_textfile=metrics_textfile, resume=resume,
+                                     long_documents=long_documents, map_parallelism=map_parallelism,
+                                     llm_requests_per_minute=llm_requests_per_minute,
+                                     llm_tokens_per_minute=llm_tokens_per_minute,
+                                     embedding_requests_per_minute=embedding_requests_per_minute,
+                                     embedding_tokens_per_minute=embedding_tokens_per_minute,
+                                     coding_result_format=coding_result_format,
+                                     context_token_budget=context_token_budget)
+            self.worker.submit(tool_config)
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {e}")
+            return
+
+        self.submitted_prompt = (system_message, user_message, output_format)
+        self.run_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_bar.config(maximum=len(files_array), value=0)
+        self.status_label.config(text=f"Started {len(files_array)} file(s)...")
+        self.root.after(worker_poll_interval, self.poll_worker)
+
+    def cancel_run(self):
+        self.worker.cancel()
+        self.cancel_button.config(state="disabled")
+        self.status_label.config(text="Cancelling after the files in progress...")
+
+    def poll_worker(self):
+        # Runs on the Tk thread; the worker only communicates through its event queue
+        while True:
+            try:
+                kind, payload = self.worker.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == PROGRESS:
+                self.progress_bar.config(value=payload.files_done)
+                self.status_label.config(text=str(payload))
+                continue
+
+            self.run_button.config(state="normal")
+            self.cancel_button.config(state="disabled")
+            if kind == DONE:
+                Configuration.update_whole_prompt(*self.submitted_prompt)
+                self.status_label.config(text="Finished.")
+                messagebox.showinfo("Success", f"Process completed successfully!\n\n{payload}")
+            elif kind == CANCELLED:
+                self.status_label.config(text="Cancelled.")
+                messagebox.showinfo("Cancelled", "The run was cancelled.")
+            elif kind == FAILED:
+                self.status_label.config(text="Failed.")
+                messagebox.showerror("Error", f"An error occurred: {payload}")
+            return
+
+        self.root.after(worker_poll_interval, self.poll_worker)
 
     def view_concepts(self):
         self.concept_window = tk.Toplevel(self.root)
@@ -428,14 +573,15 @@ class App:
             self.add_concept_window.destroy()
 
     def save_new_concept(self, new_concept, description):
-        if new_concept and new_concept not in Configuration.read_concepts():
+        concepts = Configuration.read_concepts()
+        if new_concept and new_concept not in concepts:
             self.concept_listbox.insert(tk.END, new_concept)
-            self.concepts = Configuration.read_concepts()
+            self.concepts = concepts
             self.concepts.update({new_concept: description})
             Configuration.save_concepts(self.concepts)
-            self.concept_combobox['values'] = list(self.concepts.keys())
+            self.concept_combobox['values'] = concept_choices(self.concepts)
             self.concept_combobox.set('')  # Clear current selection
-        elif new_concept in Configuration.read_concepts():
+        elif new_concept in concepts:
             messagebox.showwarning("Warning", "Concept already exists!")
 
     def delete_concept(self):
@@ -448,7 +594,7 @@ class App:
                 self.concept_listbox.delete(index)
 
             Configuration.save_concepts(self.concepts)
-            self.concept_combobox['values'] = list(self.concepts.keys())
+            self.concept_combobox['values'] = concept_choices(self.concepts)
             self.concept_combobox.set('')
             messagebox.showinfo("Success", "Selected concept(s) deleted successfully.")
         else:
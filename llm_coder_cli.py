@@ -0,0 +1,182 @@
+import argparse
+import glob
+import os
+import sys
+
+from batch_job import BatchRequestPipeline
+from concept_coding import ALL_CONCEPTS
+from configuration import Configuration
+from configuration_option import ConfigurationOption
+from context_retrieval_config import ContextRetrievalConfig
+from corpus_index import CORPUS_INDEX_KINDS, CORPUS_OFF
+from embedding_providers import EMBEDDING_PROVIDERS, EMBEDDINGS_OPENAI
+from llm_response_cache import CACHE_OFF, CACHE_REFRESH, CACHE_USE
+from map_reduce_coding import DEFAULT_MAP_PARALLELISM, LONG_DOCUMENT_MODES, LONG_DOCUMENTS_RETRIEVE
+from pipeline_runner import AUTOMATED_CODING, CONTEXT_RETRIEVAL, CORPUS_RETRIEVAL, run_tool
+from prompt_components import PromptComponents
+from results_saver import RESULT_FORMATS
+from run_control import RunControl
+from tool_config import DEFAULT_CONTEXT_TOKEN_BUDGET, DEFAULT_MAX_IN_FLIGHT, ToolConfig
+
+MODES = {'coding': AUTOMATED_CODING, 'retrieval': CONTEXT_RETRIEVAL, 'corpus': CORPUS_RETRIEVAL}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run LLM-Coder without the GUI. Options that are not given are read from prompt_config.ini.")
+    parser.add_argument('mode', choices=MODES.keys(),
+                        help="'coding' for automated deductive coding, 'retrieval' for relevant context retrieval, "
+                             "'corpus' to retrieve context from the corpus index built by earlier retrieval runs")
+    parser.add_argument('files', nargs='*',
+                        help=".txt/.pdf files, directories or glob patterns to analyse (not used by 'corpus')")
+    parser.add_argument('--save-path', required=True, help="directory the result files are written to")
+    parser.add_argument('--concept', action='append', default=[],
+                        help="concept from [Concepts] to retrieve context for; repeat it or pass 'all'. "
+                             "Coding with several concepts codes each document for all of them in one request")
+    parser.add_argument('--system-message', default=Configuration.get_prompt_part(ConfigurationOption.SYSTEM_MESSAGE))
+    parser.add_argument('--user-message', default=Configuration.get_prompt_part(ConfigurationOption.USER_MESSAGE))
+    parser.add_argument('--output-format', default=Configuration.get_prompt_part(ConfigurationOption.OUTPUT_FORMAT))
+    parser.add_argument('--chunk-size', type=int, default=Configuration.get_chunk_size(), help="in tokens")
+    parser.add_argument('--chunk-overlap', type=int, default=Configuration.get_chunk_overlap(), help="in tokens")
+    parser.add_argument('--max-chunks', type=int, default=Configuration.get_max_chunks())
+    parser.add_argument('--threshold', type=float, default=Configuration.get_threshold())
+    parser.add_argument('--result-format', choices=RESULT_FORMATS,
+                        default=Configuration.get_str_option(ConfigurationOption.RESULT_FORMAT, 'txt'),
+                        help="format of the retrieval results")
+    parser.add_argument('--coding-result-format', choices=RESULT_FORMATS,
+                        default=Configuration.get_str_option(ConfigurationOption.CODING_RESULT_FORMAT, 'txt'),
+                        help="format of the coding results")
+    parser.add_argument('--embeddings', choices=EMBEDDING_PROVIDERS,
+                        default=Configuration.get_str_option(ConfigurationOption.EMBEDDING_PROVIDER, EMBEDDINGS_OPENAI),
+                        help="'hashing' and 'local-model' embed on the CPU without the API")
+    parser.add_argument('--corpus-index', choices=CORPUS_INDEX_KINDS,
+                        default=Configuration.get_str_option(ConfigurationOption.CORPUS_INDEX, CORPUS_OFF),
+                        help="retrieval: also add the documents to a corpus-wide index of this kind")
+    parser.add_argument('--corpus-pq', type=int, default=Configuration.get_int_option(ConfigurationOption.CORPUS_PQ, 0),
+                        help="product quantization subquantizers for ivf/hnsw corpus indexes, 0 for none")
+    parser.add_argument('--bm25-candidates', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.BM25_CANDIDATES, 0),
+                        help="retrieval: embed only this many BM25 candidates per concept and document, 0 for all")
+    parser.add_argument('--measure-recall', action='store_true',
+                        help="retrieval: also run the full search and report the recall of the BM25 prefilter")
+    parser.add_argument('--near-duplicates', type=float, metavar='THRESHOLD',
+                        default=Configuration.get_float_option(ConfigurationOption.NEAR_DUPLICATE_THRESHOLD, 0.0),
+                        help="retrieval: chunks with at least this word-shingle similarity to an earlier chunk "
+                             "reuse its vector instead of being embedded, e.g. 0.9; 0 embeds every chunk")
+    parser.add_argument('--collapse-duplicates', choices=['on', 'off'],
+                        default=Configuration.get_str_option(ConfigurationOption.COLLAPSE_DUPLICATES, 'off'),
+                        help="retrieval: save near-duplicate results as one row with their number of occurrences")
+    parser.add_argument('--max-in-flight', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.MAX_IN_FLIGHT, DEFAULT_MAX_IN_FLIGHT))
+    parser.add_argument('--llm-cache', choices=[CACHE_USE, CACHE_REFRESH, CACHE_OFF],
+                        default=Configuration.get_str_option(ConfigurationOption.LLM_CACHE, CACHE_USE))
+    parser.add_argument('--long-documents', choices=LONG_DOCUMENT_MODES,
+                        default=Configuration.get_str_option(ConfigurationOption.LONG_DOCUMENTS,
+                                                             LONG_DOCUMENTS_RETRIEVE),
+                        help="coding: for documents over the token budget, send the most relevant chunks "
+                             "('retrieve') or code every section and combine the results ('map-reduce')")
+    parser.add_argument('--map-parallelism', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.MAP_PARALLELISM,
+                                                             DEFAULT_MAP_PARALLELISM),
+                        help="section requests sent at the same time by map-reduce coding")
+    parser.add_argument('--token-budget', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.CONTEXT_TOKEN_BUDGET,
+                                                             DEFAULT_CONTEXT_TOKEN_BUDGET),
+                        help="coding: tokens of document text sent with the prompt; keep it below the "
+                             "context window of the model")
+    parser.add_argument('--llm-rpm', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.LLM_REQUESTS_PER_MINUTE, 0),
+                        help="requests per minute allowed for the chat model, 0 for no limit")
+    parser.add_argument('--llm-tpm', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.LLM_TOKENS_PER_MINUTE, 0),
+                        help="tokens per minute allowed for the chat model, 0 for no limit")
+    parser.add_argument('--embedding-rpm', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.EMBEDDING_REQUESTS_PER_MINUTE, 0),
+                        help="requests per minute allowed for the embedding model, 0 for no limit")
+    parser.add_argument('--embedding-tpm', type=int,
+                        default=Configuration.get_int_option(ConfigurationOption.EMBEDDING_TOKENS_PER_MINUTE, 0),
+                        help="tokens per minute allowed for the embedding model, 0 for no limit")
+    parser.add_argument('--metrics-textfile', metavar='PATH',
+                        default=Configuration.get_str_option(ConfigurationOption.METRICS_TEXTFILE, '') or None,
+                        help="also write the run totals to this Prometheus textfile (*.prom)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the last run with the same settings: skip the files it completed "
+                             "and retry the ones that failed")
+    parser.add_argument('--debug', action='store_true', help="print every prompt sent to the LLM")
+    parser.add_argument('--batch-requests', metavar='PATH',
+                        help="coding only: write the prompts to a batch JSONL file instead of calling the API; "
+                             "load the answers later with 'python batch_job.py ingest'")
+    args = parser.parse_args(argv)
+    if args.batch_requests and args.mode != 'coding':
+        parser.error("--batch-requests can only be used in coding mode")
+    return args
+
+
+def expand_files(patterns):
+    # Directories are searched for .txt and .pdf files; the resulting order is stable across runs
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            matches = glob.glob(pattern) or [pattern]
+        files.extend(sorted(path for path in matches if path.lower().endswith(('.txt', '.pdf'))))
+    return files
+
+
+def build_tool_config(args):
+    concepts = args.concept
+    if 'all' in concepts:
+        concept_input = ALL_CONCEPTS
+    elif len(concepts) == 1:
+        concept_input = concepts[0]
+    else:
+        concept_input = concepts
+
+    prompt_components = PromptComponents(args.system_message, args.user_message, args.output_format)
+    context_retrieval_config = ContextRetrievalConfig(args.chunk_size, args.max_chunks, args.threshold,
+                                                      args.result_format, args.chunk_overlap, args.corpus_index,
+                                                      args.corpus_pq, args.bm25_candidates, args.measure_recall,
+                                                      args.near_duplicates, args.collapse_duplicates == 'on')
+    return ToolConfig(MODES[args.mode], prompt_components, concept_input, expand_files(args.files),
+                      args.save_path, context_retrieval_config, args.max_in_flight, args.llm_cache,
+                      args.embeddings, args.debug, args.metrics_textfile, args.resume, args.long_documents,
+                      args.map_parallelism, args.llm_rpm, args.llm_tpm, args.embedding_rpm, args.embedding_tpm,
+                      args.coding_result_format, args.token_budget)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tool_config = build_tool_config(args)
+    if not tool_config.files_array and args.mode != 'corpus':
+        print("No .txt or .pdf files found.", file=sys.stderr)
+        return 2
+    if args.bm25_candidates and args.corpus_index != CORPUS_OFF:
+        print("The BM25 prefilter only embeds candidate chunks, so it cannot fill a corpus index.", file=sys.stderr)
+        return 2
+    if args.token_budget < 1:
+        print("The context token budget must be at least 1 token.", file=sys.stderr)
+        return 2
+    if not 0 <= args.near_duplicates <= 1:
+        print("The near-duplicate threshold must be between 0 and 1.", file=sys.stderr)
+        return 2
+    if args.mode in ('retrieval', 'corpus') and not args.concept:
+        print("Retrieval needs at least one --concept.", file=sys.stderr)
+        return 2
+
+    def on_progress(event):
+        print(event, file=sys.stderr)
+
+    try:
+        if args.batch_requests:
+            run_control = RunControl(len(tool_config.files_array), on_progress)
+            BatchRequestPipeline(tool_config, args.batch_requests, run_control).run()
+        else:
+            run_tool(tool_config, on_progress=on_progress)
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(".llm_coder_cache", "llm_responses.sqlite")
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 100000
+
+# Values of the llm_cache option
+CACHE_USE = 'use'
+CACHE_REFRESH = 'refresh'
+CACHE_OFF = 'off'
+
+
+class LLMResponseCache:
+    """Persistent cache of LLM completions keyed by model, temperature and a hash of the full prompt.
+
+    Only meaningful for deterministic (temperature 0) runs. With ``mode`` set to
+    CACHE_REFRESH every call goes to the API and overwrites the stored answer, with
+    CACHE_OFF the cache is neither read nor written.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES,
+                 mode=CACHE_USE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.mode = mode
+        self.cached_calls = 0
+        self.live_calls = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if mode == CACHE_OFF:
+            return
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self._connection.commit()
+
+    @staticmethod
+    def key_for(model, temperature, prompt):
+        digest = hashlib.sha256()
+        digest.update(f"{model}\0{float(temperature)!r}\0".encode('utf-8'))
+        digest.update(prompt.encode('utf-8', errors='replace'))
+        return digest.hexdigest()
+
+    def get(self, model, temperature, prompt):
+        if self.mode != CACHE_USE:
+            return None
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                (self.key_for(model, temperature, prompt), time.time() - self.ttl_seconds)).fetchone()
+        if row is None:
+            return None
+        self.cached_calls += 1
+        return row[0]
+
+    def put(self, model, temperature, prompt, response):
+        self.live_calls += 1
+        if self.mode == CACHE_OFF:
+            return
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created) VALUES (?, ?, ?, ?)",
+                (self.key_for(model, temperature, prompt), model, response, time.time()))
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        # Drop the oldest entries once the cache holds more than max_entries responses
+        count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created LIMIT ?)",
+                (count - self.max_entries,))
+
+    def stats(self):
+        return f"LLM calls: {self.cached_calls} cached, {self.live_calls} live"
+
+    def close(self):
+        if self._connection is not None:
+            with self._lock:
+                self._connection.close()
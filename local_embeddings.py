@@ -0,0 +1,89 @@
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_HASHING_DIMENSIONS = 1024
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 256
+# Fewer texts than this are hashed in the calling process, since starting workers costs more than it saves
+PARALLEL_MIN_TEXTS = 4096
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """Local CPU embeddings built from hashed word unigrams and bigrams.
+
+    Every feature is hashed with CRC32 into one of ``dimensions`` signed buckets, the
+    counts are log-scaled and each vector is L2-normalised, so relevance scores stay on
+    the same scale as for API embeddings. Nothing is downloaded and no network is used.
+    The vectors only capture shared wording, which makes them suited to fast
+    pre-screening and to offline runs rather than to final retrieval.
+    """
+
+    def __init__(self, dimensions=DEFAULT_HASHING_DIMENSIONS, batch_size=EMBEDDING_BATCH_SIZE, workers=None):
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.model = f"hashing-{dimensions}"
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        # Tokenizing holds the GIL, so large inputs are spread over processes rather than threads
+        if len(texts) < PARALLEL_MIN_TEXTS or self.workers == 1:
+            matrices = [hash_batch(batch, self.dimensions) for batch in batches]
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+                matrices = list(pool.map(hash_batch, batches, repeat(self.dimensions)))
+        return np.vstack(matrices).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class LocalModelEmbeddings(Embeddings):
+    """Sentence-embedding model run on the CPU with sentence-transformers, in batches of ``batch_size``."""
+
+    def __init__(self, model_name=DEFAULT_LOCAL_MODEL, batch_size=EMBEDDING_BATCH_SIZE):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("Local model embeddings need the sentence-transformers package "
+                               "(pip install sentence-transformers).")
+        self._encoder = SentenceTransformer(model_name, device='cpu')
+        self.batch_size = batch_size
+        self.model = model_name
+
+    def embed_documents(self, texts):
+        vectors = self._encoder.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True,
+                                       convert_to_numpy=True)
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def hash_batch(texts, dimensions):
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = TOKEN_PATTERN.findall(text.lower())
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        if not features:
+            continue
+        hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.uint32,
+                             count=len(features))
+        # The top bit gives the sign, so colliding features partly cancel out instead of piling up
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        counts = np.bincount(hashes % dimensions, weights=signs, minlength=dimensions)
+        matrix[row] = np.sign(counts) * np.log1p(np.abs(counts))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
@@ -0,0 +1,59 @@
+import json
+
+from prompt_components import ChatPrompt
+
+# Values of the long_documents option: how documents over the token budget are coded
+LONG_DOCUMENTS_RETRIEVE = 'retrieve'
+LONG_DOCUMENTS_MAP_REDUCE = 'map-reduce'
+LONG_DOCUMENT_MODES = [LONG_DOCUMENTS_RETRIEVE, LONG_DOCUMENTS_MAP_REDUCE]
+
+DEFAULT_MAP_PARALLELISM = 4
+# Tokens shared by neighbouring sections, so that a passage cut at a section border is seen whole once
+SECTION_OVERLAP_TOKENS = 200
+
+
+def section_prompt(instructions, number, total, page, text):
+    location = f" (starting on page {page})" if page is not None else ""
+    return ChatPrompt(instructions,
+                      f"The document is too long to analyse at once. This is section {number} of {total}{location}; "
+                      f"code it on its own, its result is combined with those of the other sections afterwards."
+                      f"\n\nHere is the text for your analysis:\n\n{text}")
+
+
+def reduce_prompt(instructions, partials):
+    """Request that combines the results of document sections into one result for the whole document.
+
+    ``partials`` are ((first section, last section), result) pairs, where a result is a response
+    text or a list of codes.
+    """
+    results = "\n\n".join(f"Result of {section_label(first, last)}:\n{partial_text(result)}"
+                          for (first, last), result in partials)
+    return ChatPrompt(instructions,
+                      f"The document was too long to analyse at once, so its sections were coded one by one. "
+                      f"Combine the results of all sections below into a single result for the whole document, in "
+                      f"the requested output format. Weigh the evidence of every section; do not just repeat one of "
+                      f"them.\n\n{results}")
+
+
+def section_label(first, last):
+    return f"section {first}" if first == last else f"sections {first} to {last}"
+
+
+def partial_text(result):
+    if isinstance(result, list):
+        return json.dumps({'codes': result}, ensure_ascii=False)
+    return result
+
+
+def group_partials(partials, count_tokens, budget):
+    """Splits partial results into consecutive groups whose results fit ``budget`` tokens together."""
+    groups = [[]]
+    used = 0
+    for sections, result in partials:
+        tokens = count_tokens(partial_text(result))
+        if groups[-1] and used + tokens > budget:
+            groups.append([])
+            used = 0
+        groups[-1].append((sections, result))
+        used += tokens
+    return groups
@@ -0,0 +1,143 @@
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from bm25 import tokenize
+
+# Jaccard similarity of the word shingles at which two chunks count as near-duplicates
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 0.9
+# Words per shingle
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 64
+# Signatures are compared when any of their bands are equal. 8 bands of 8 rows make a pair with a
+# Jaccard similarity of 0.9 a candidate with a probability of 99%, and one of 0.5 with 3%.
+LSH_BANDS = 8
+# Largest prime below 2 ** 32, so that hash * a + b cannot overflow 64 bits
+MINHASH_PRIME = 4294967291
+MINHASH_SEED = 1
+# Combines the word hashes of a shingle; below 2 ** 32 like them, so their products fit in 64 bits
+SHINGLE_MULTIPLIER = 1000003
+
+_permutations = np.random.default_rng(MINHASH_SEED)
+PERMUTATION_A = _permutations.integers(1, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _permutations.integers(0, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash(text):
+    """MinHash signature of the word shingles of ``text``, or None for a text without words."""
+    words = tokenize(text)
+    if not words:
+        return None
+    word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64,
+                              count=len(words))
+    # Each shingle hash combines the hashes of its words, so no shingle strings are built
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    shingles = word_hashes[:count].copy()
+    for offset in range(1, min(SHINGLE_WORDS, len(words))):
+        shingles = (shingles * SHINGLE_MULTIPLIER + word_hashes[offset:offset + count]) % MINHASH_PRIME
+    shingles = np.unique(shingles)
+    return ((np.outer(shingles, PERMUTATION_A) + PERMUTATION_B) % MINHASH_PRIME).min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature):
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with locality-sensitive hashing, to find near-duplicates without comparing every pair.
+
+    ``find`` returns the earlier signature most similar to a new one, if their estimated
+    Jaccard similarity reaches ``threshold``. Only signatures that share a band with the new
+    one are compared, so a lookup costs time in proportion to its candidates, not to the corpus.
+    """
+
+    def __init__(self, threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.signatures = []
+        # (band, band values) -> ids of the signatures with those values
+        self._buckets = {}
+
+    def find(self, signature):
+        candidates = {signature_id for key in band_keys(signature) for signature_id in self._buckets.get(key, ())}
+        best, best_similarity = None, self.threshold
+        for candidate in sorted(candidates):
+            similarity = np.count_nonzero(self.signatures[candidate] == signature) / MINHASH_PERMUTATIONS
+            if similarity >= best_similarity and (best is None or similarity > best_similarity):
+                best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, signature):
+        signature_id = len(self.signatures)
+        self.signatures.append(signature)
+        for key in band_keys(signature):
+            self._buckets.setdefault(key, []).append(signature_id)
+        return signature_id
+
+    def truncate(self, size):
+        # Forgets the signatures added after the first ``size``
+        for signature_id in range(size, len(self.signatures)):
+            for key in band_keys(self.signatures[signature_id]):
+                self._buckets[key].remove(signature_id)
+        del self.signatures[size:]
+
+
+class NearDuplicateEmbeddings(Embeddings):
+    """Embeddings wrapper that embeds one representative of every cluster of near-duplicate texts.
+
+    A text whose estimated Jaccard similarity with a text embedded earlier in the run reaches
+    ``threshold`` gets the vector of that text instead of being embedded; boilerplate shared
+    by the reports of several years is then embedded once. The vectors of the representatives
+    are kept as float32 for the whole run. Queries are passed on unchanged.
+    """
+
+    def __init__(self, embeddings, threshold=DEFAULT_NEAR_DUPLICATE_THRESHOLD):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, 'model', type(embeddings).__name__)
+        self.index = NearDuplicateIndex(threshold)
+        # Vector of every representative, by its id in the index
+        self.vectors = []
+        self.texts = 0
+        self.reused = 0
+        # Called with the number of texts of a request that reused a vector, e.g. to count them in RunMetrics
+        self.on_reuse = None
+
+    def embed_documents(self, texts):
+        first_new = len(self.index.signatures)
+        # Per text: the id of its representative, or None for a text without words
+        representatives = []
+        embed_positions = []
+        for position, text in enumerate(texts):
+            signature = minhash(text)
+            representative = None if signature is None else self.index.find(signature)
+            if representative is None:
+                embed_positions.append(position)
+                if signature is not None:
+                    # Later texts of the same request can already reuse it
+                    representative = self.index.add(signature)
+            representatives.append(representative)
+
+        try:
+            new_vectors = self.embeddings.embed_documents([texts[position] for position in embed_positions])
+        except Exception:
+            self.index.truncate(first_new)
+            raise
+        embedded = dict(zip(embed_positions, new_vectors))
+        for position in embed_positions:
+            if representatives[position] is not None:
+                self.vectors.append(np.asarray(embedded[position], dtype=np.float32))
+
+        reused = len(texts) - len(embed_positions)
+        self.texts += len(texts)
+        self.reused += reused
+        if reused and self.on_reuse is not None:
+            self.on_reuse(reused)
+        return [embedded[position] if position in embedded else self.vectors[representatives[position]].tolist()
+                for position in range(len(texts))]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        return f"near-duplicates: {self.reused} of {self.texts} chunks reused the vector of an earlier chunk"
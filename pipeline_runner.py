@@ -0,0 +1,30 @@
+import os
+
+from coding_pipeline import CodingPipeline
+from embedding_providers import EMBEDDINGS_OPENAI
+from retrieval_pipeline import RetrievalPipeline
+from run_control import RunControl
+
+# Values of ToolConfig.tool_mode
+AUTOMATED_CODING = '1'
+CONTEXT_RETRIEVAL = '2'
+CORPUS_RETRIEVAL = '3'
+
+
+def run_tool(tool_config, on_progress=None, cancel_event=None):
+    """Runs the pipeline selected by ``tool_config.tool_mode`` and returns its run summary.
+
+    Used by the GUI worker thread and by the command line entry point alike.
+    """
+    # Retrieval with a local embedding provider runs without the API
+    needs_api = tool_config.tool_mode == AUTOMATED_CODING or tool_config.embedding_provider == EMBEDDINGS_OPENAI
+    if needs_api and not os.getenv('OPENAI_API_KEY'):
+        raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
+
+    run_control = RunControl(len(tool_config.files_array), on_progress, cancel_event)
+    if tool_config.tool_mode == AUTOMATED_CODING:
+        return CodingPipeline(tool_config, run_control).run()
+    elif tool_config.tool_mode == CORPUS_RETRIEVAL:
+        return RetrievalPipeline(tool_config, run_control).run_corpus()
+    else:
+        return RetrievalPipeline(tool_config, run_control).run()
@@ -1,6 +1,39 @@
+import json
+
+
 class PromptComponents:
 
     def __init__(self, system_message, user_message, output_format):
         self.system_message = system_message
         self.user_message = user_message
         self.output_format = output_format
+
+
+class ChatPrompt:
+    """One LLM request as a system message followed by a user message.
+
+    ``instructions`` (role, codebook and output format) are the same for every document
+    of a run and go first, so the provider's prompt cache can reuse them across requests;
+    ``content`` holds the document text and anything else that changes per request.
+    """
+
+    def __init__(self, instructions, content):
+        self.instructions = instructions
+        self.content = content
+
+    def messages(self):
+        # Imported here: the GUI loads this module at startup, long before a request is sent
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=self.instructions), HumanMessage(content=self.content)]
+
+    def as_dicts(self):
+        # Chat-completions request body format
+        return [{'role': 'system', 'content': self.instructions}, {'role': 'user', 'content': self.content}]
+
+    def key(self):
+        # Text the response cache is keyed by; unlike plain concatenation it keeps the two messages apart
+        return json.dumps([self.instructions, self.content], ensure_ascii=False)
+
+    def __str__(self):
+        return f"[system]\n{self.instructions}\n\n[user]\n{self.content}"
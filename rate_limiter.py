@@ -0,0 +1,302 @@
+import asyncio
+import math
+import random
+import threading
+import time
+
+import openai
+from langchain_core.embeddings import Embeddings
+
+from token_chunker import CHUNK_ENCODING, get_encoding
+
+# Texts per request that OpenAIEmbeddings sends to the embeddings endpoint
+EMBEDDING_TEXTS_PER_REQUEST = 1000
+# Completion tokens counted against the tokens-per-minute limit before a response says how many were used
+COMPLETION_TOKEN_ESTIMATE = 500
+# Tokens the chat format adds to every message
+MESSAGE_TOKEN_OVERHEAD = 4
+MAX_RETRIES = 6
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# Seconds of quota a bucket holds. OpenAI enforces per-minute limits over periods of about a second,
+# so a full minute's quota sent at once is rejected even though it is within the limit.
+BURST_SECONDS = 1
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units a minute continuously and holds up to ``burst_seconds`` of them.
+
+    The level may go below zero when a request turns out to use more than was estimated;
+    later requests then wait until the debt is refilled.
+    """
+
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = self.rate * burst_seconds
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A request larger than the whole bucket is let through once the bucket is full
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class RateLimiter:
+    """Admits OpenAI requests within a requests-per-minute and a tokens-per-minute limit.
+
+    Every request states its estimated tokens up front and waits until both token buckets
+    can pay for it and one of the concurrency slots is free; a limit of 0 is not enforced.
+    Once the response reports the tokens actually used, the difference is settled.
+
+    The number of slots adapts to rate limit responses (429): each one halves the slots,
+    at most once per round of requests in flight, and pauses all requests for the
+    Retry-After time the server sent, or an exponential backoff if it sent none. Every
+    successful request adds 1 / slots, so the slots grow back by one per round. Rate
+    limited, timed out and server error responses are retried up to ``max_retries`` times.
+
+    One limiter is shared by all requests of a run to the same model, from threads and
+    asyncio tasks alike. Requests waiting for a concurrency slot are woken when one is
+    released: threads through a threading.Condition, tasks through an asyncio.Condition
+    of their event loop. A request that is cancelled gives its slot back as well.
+    """
+
+    def __init__(self, name, requests_per_minute=0, tokens_per_minute=0, max_concurrency=16,
+                 max_retries=MAX_RETRIES):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.concurrency = float(self.max_concurrency)
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.retried = 0
+        self.waited = 0.0
+        # Called once for every rate limit response, e.g. to count it in RunMetrics
+        self.on_rate_limited = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._slot_released = threading.Condition(self._lock)
+        # Event loop -> [asyncio.Condition, number of its tasks waiting], for the loops with waiting tasks
+        self._async_waiters = {}
+
+    def call(self, request, tokens, used_tokens=None):
+        """Sends ``request()`` once admitted and returns its result, retrying rate limits and server errors.
+
+        ``used_tokens(result)`` returns the tokens a response actually used, or None when unknown.
+        """
+        for attempt in range(self.max_retries + 1):
+            started = self._wait(tokens)
+            try:
+                result = request()
+            except BaseException as error:
+                delay = self._failed(error, started, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._succeeded(tokens, used_tokens(result) if used_tokens else None)
+            return result
+
+    async def call_async(self, request, tokens, used_tokens=None):
+        # Same as call for a coroutine function ``request``
+        for attempt in range(self.max_retries + 1):
+            started = await self._wait_async(tokens)
+            try:
+                result = await request()
+            except BaseException as error:
+                # Also a cancelled request, whose slot must be given back
+                delay = self._failed(error, started, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded(tokens, used_tokens(result) if used_tokens else None)
+            return result
+
+    def stats(self):
+        return (f"{self.name} rate limiter: {self.rate_limited} rate limited response(s), {self.retried} retries, "
+                f"requests waited {self.waited:.1f} s in total, {int(self.concurrency)} of {self.max_concurrency} "
+                f"concurrent requests allowed at the end")
+
+    def _wait(self, tokens):
+        waiting_since = time.monotonic()
+        with self._lock:
+            while True:
+                delay = self._admit(tokens, waiting_since)
+                if delay == 0:
+                    return time.monotonic()
+                self._slot_released.wait(delay)
+
+    async def _wait_async(self, tokens):
+        waiting_since = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiters = self._async_waiters.setdefault(loop, [asyncio.Condition(), 0])
+            waiters[1] += 1
+        slot_released = waiters[0]
+        try:
+            async with slot_released:
+                while True:
+                    with self._lock:
+                        delay = self._admit(tokens, waiting_since)
+                    if delay == 0:
+                        return time.monotonic()
+                    try:
+                        await asyncio.wait_for(slot_released.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self._lock:
+                waiters[1] -= 1
+                if waiters[1] == 0:
+                    del self._async_waiters[loop]
+
+    def _admit(self, tokens, waiting_since):
+        # Called with the lock held. Takes a slot and the request's quota and returns 0, or returns how long
+        # to wait before asking again: None when only a released slot can admit the request.
+        now = time.monotonic()
+        delay = self._paused_until - now
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                delay = max(delay, bucket.wait_time(amount, now))
+        if self.in_flight >= int(self.concurrency):
+            return delay if delay > 0 else None
+        if delay > 0:
+            return delay
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.take(amount, now)
+        self.in_flight += 1
+        self.waited += now - waiting_since
+        return 0
+
+    def _release(self):
+        # Called with the lock held when a request finishes, to wake the requests waiting for its slot
+        self.in_flight -= 1
+        self._slot_released.notify_all()
+        for loop, (slot_released, _) in self._async_waiters.items():
+            notification = notify_all(slot_released)
+            try:
+                asyncio.run_coroutine_threadsafe(notification, loop)
+            except RuntimeError:
+                # The loop was closed; its tasks no longer wait
+                notification.close()
+
+    def _succeeded(self, tokens, used_tokens):
+        with self._lock:
+            self._release()
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.take(used_tokens - tokens, time.monotonic())
+
+    def _failed(self, error, started, attempt):
+        # Returns the seconds to wait before retrying the request, or None when the error is final
+        rate_limited = isinstance(error, openai.RateLimitError) and not is_quota_exhausted(error)
+        retryable = rate_limited or isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+        delay = None
+        if retryable and attempt < self.max_retries:
+            delay = retry_after(error)
+            if delay is None:
+                # Jitter keeps the requests that failed together from coming back together
+                delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+        with self._lock:
+            self._release()
+            if rate_limited:
+                self.rate_limited += 1
+                now = time.monotonic()
+                # Requests sent before the last decrease saw the old limit, so they do not halve it again
+                if started >= self._last_decrease:
+                    self.concurrency = max(1.0, math.floor(self.concurrency / 2))
+                    self._last_decrease = now
+                if delay is not None:
+                    self._paused_until = max(self._paused_until, now + delay)
+            if delay is not None:
+                self.retried += 1
+        if rate_limited and self.on_rate_limited is not None:
+            self.on_rate_limited()
+        return delay
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings wrapper that sends every request to the wrapped embeddings through a RateLimiter.
+
+    Texts are passed on in batches of one API request each, so a rate limited batch is retried
+    on its own rather than along with batches that were already embedded.
+    """
+
+    def __init__(self, embeddings, limiter):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.model = getattr(embeddings, 'model', type(embeddings).__name__)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for batch in request_batches(texts):
+            vectors.extend(self.limiter.call(lambda: self.embeddings.embed_documents(batch), embedding_tokens(batch)))
+        return vectors
+
+    async def aembed_documents(self, texts):
+        results = await asyncio.gather(*(
+            self.limiter.call_async(lambda batch=batch: self.embeddings.aembed_documents(batch),
+                                    embedding_tokens(batch))
+            for batch in request_batches(texts)))
+        return [vector for vectors in results for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+async def notify_all(condition):
+    async with condition:
+        condition.notify_all()
+
+
+def retry_after(error):
+    """Seconds the server asked to wait before retrying, from the Retry-After headers of ``error``."""
+    response = getattr(error, 'response', None)
+    headers = response.headers if response is not None else {}
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            value = float(headers.get(header))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= value * scale <= MAX_BACKOFF_SECONDS:
+            return value * scale
+    return None
+
+
+def is_quota_exhausted(error):
+    # A 429 for an empty credit balance never succeeds on retry
+    return getattr(error, 'code', None) == 'insufficient_quota'
+
+
+def chat_tokens(count_tokens, prompt, completion_tokens=COMPLETION_TOKEN_ESTIMATE):
+    """Estimated tokens a ChatPrompt counts against the tokens-per-minute limit."""
+    return (count_tokens(prompt.instructions) + count_tokens(prompt.content) + 2 * MESSAGE_TOKEN_OVERHEAD
+            + completion_tokens)
+
+
+def embedding_tokens(texts):
+    encoding = get_encoding(CHUNK_ENCODING)
+    return sum(len(encoding.encode(text, disallowed_special=())) for text in texts)
+
+
+def request_batches(texts):
+    texts = list(texts)
+    return [texts[start:start + EMBEDDING_TEXTS_PER_REQUEST]
+            for start in range(0, len(texts), EMBEDDING_TEXTS_PER_REQUEST)]
@@ -1,79 +1,330 @@
 import os
 import csv
+import json
+import time
 from datetime import datetime
 from pathlib import Path
 
+from concept_coding import numeric_score
+
+RESULT_FORMATS = ["txt", "csv", "jsonl", "parquet"]
+# Rows kept in memory before they are written out
+FLUSH_ROWS = 500
+# With on_flush set, e.g. by a run manifest, rows are also written once this many seconds have passed since
+# the last write, so that a run that is killed has recorded the files it finished
+CHECKPOINT_SECONDS = 2.0
+NO_RESULTS_MESSAGE = "No relevant documents found above the similarity threshold."
+
 
 class ResultsSaver:
+    """Run-scoped writer for one result file.
+
+    The output file is opened once for the whole run, rows are buffered and written in
+    batches of ``flush_rows``. Besides the readable txt and csv layouts, rows can be
+    written as JSONL or Parquet with typed columns (file, concept, chunk, chunk_offset,
+    page, score, text_chunk, model_response) for loading into analysis tools.
 
-    def __init__(self, file, save_path, llm_response, concept):
-        self.file = file
-        self.save_path = save_path
-        self.llm_response = llm_response
+    ``on_flush``, when set, is called with the source files whose rows were just written.
+    The buffer is then also flushed when ``checkpoint_seconds`` have passed since the last
+    write. It is only flushed between files, so all rows of one file are written together.
+
+    With ``collapse_threshold`` set, relevant chunks that are near-duplicates of each other
+    (see near_duplicates) are written as one row with the number of occurrences and the
+    files they were found in. Such rows can only be written once the run is complete, so
+    they are all kept until the saver is closed.
+    """
+
+    def __init__(self, full_file_path, result_format, concept, flush_rows=FLUSH_ROWS, collapse_threshold=None):
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format: {result_format}")
+        self.full_file_path = full_file_path
+        self.result_format = result_format
         self.concept = concept
+        self.flush_rows = flush_rows
+        self._rows = []
+        # Source file of every buffered row, None for corpus-wide results
+        self._sources = []
+        self.on_flush = None
+        self.checkpoint_seconds = CHECKPOINT_SECONDS
+        self._flushed_at = time.monotonic()
+        self._file = None
+        self._csv_writer = None
+        self._parquet_writer = None
+        self._duplicates = None
+        if collapse_threshold:
+            # Imported here: the GUI loads this module at start-up, and near_duplicates needs numpy
+            from near_duplicates import NearDuplicateIndex
+            self._duplicates = NearDuplicateIndex(collapse_threshold)
+            # One row per cluster of near-duplicate chunks, and the position of each cluster's row
+            self._collapsed = []
+            self._collapsed_rows = {}
+            self._collapsed_sources = []
+
+    @classmethod
+    def fully_automated(cls, save_path, time_stamp, result_format, concept):
+        filename = f"{time_stamp}_results.{result_format}"
+        return cls(os.path.join(save_path, filename), result_format, concept)
 
-    def save_results_fully_automated(self, time_stamp):
-        # Create the filename based on the concept name and LLM results
-        # Replace spaces with underscores for the filename
+    @classmethod
+    def relevant_chunks(cls, save_path, concept, time_stamp, result_format, collapse_threshold=None):
+        filename = f"{concept.replace(' ', '_')}_relevant_context_{time_stamp}.{result_format}"
+        return cls(os.path.join(save_path, filename), result_format, concept, collapse_threshold=collapse_threshold)
 
-        date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current date and time
-        filename = f"{time_stamp}_results.txt"
+    def __enter__(self):
+        return self
 
-        # Prepare the entry to be saved
-        entry = f"{date_str} - {get_file_name(self.file)} - {self.llm_response}\n"
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        full_file_path = os.path.join(self.save_path, filename)
+    def save_response(self, file_path, llm_response):
+        self._add({
+            'kind': 'response',
+            'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'file': get_file_name(file_path),
+            'concept': concept_label(self.concept),
+            'chunk': None,
+            'chunk_offset': None,
+            'page': None,
+            'score': None,
+            'text_chunk': None,
+            'model_response': llm_response,
+        }, file_path)
+        self._flush_if_full()
 
-        # Open the file in append mode
-        with open(full_file_path, 'a') as file:
-            # If the file does not exist, write the header (optional)
-            # Write the entry to the file
-            file.write(entry)
+    def save_codes(self, file_path, codes):
+        # One row per concept of a multi-concept answer, see concept_coding.parse_codes
+        date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for code in codes:
+            self._add({
+                'kind': 'code',
+                'date': date,
+                'file': get_file_name(file_path),
+                'concept': code['concept'],
+                'chunk': None,
+                'chunk_offset': None,
+                'page': None,
+                'score': numeric_score(code['score']),
+                'text_chunk': None,
+                'model_response': f"{code['score']}; {code['explanation']}",
+            }, file_path)
+        self._flush_if_full()
 
-        print(f"Results saved to {full_file_path}")
+    def save_relevant_chunks(self, file_path, results_with_scores):
+        # file_path is None for corpus-wide results, whose chunks carry their file in the metadata
+        file_name = get_file_name(file_path) if file_path else None
+        if self._duplicates is not None:
+            self._collapse(file_path, file_name, results_with_scores)
+            return
+        if not results_with_scores:
+            self._add({'kind': 'no_results', 'file': file_name, 'concept': concept_label(self.concept),
+                       'chunk': None, 'chunk_offset': None, 'page': None, 'score': None, 'text_chunk': None,
+                       'model_response': None}, file_path)
+            self._flush_if_full()
+            return
 
-    @staticmethod
-    def save_results_relevant_chunks_in_txt_file(concept, file_path, results_with_scores, save_path, timestamp):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{concept.replace(' ', '_')}_relevant_context_{timestamp}.txt"
+        for position, (result, score) in enumerate(results_with_scores):
+            self._add({
+                # The txt layout starts a new block for every document
+                'kind': 'chunk' if position else 'first_chunk',
+                'file': get_file_name(result.metadata['file']) if 'file' in result.metadata else file_name,
+                'concept': concept_label(self.concept),
+                'chunk': result.metadata.get('chunk'),
+                'chunk_offset': result.metadata.get('start'),
+                'page': result.metadata.get('page'),
+                'score': float(score),
+                'text_chunk': result.page_content,
+                'model_response': None,
+            }, file_path)
+        self._flush_if_full()
 
-        full_file_path = os.path.join(save_path, filename)
+    def _collapse(self, file_path, file_name, results_with_scores):
+        from near_duplicates import minhash
 
-        # Write the results to a new file
-        with open(full_file_path, 'a') as file:
-            file.write(f"Relevant Context for Concept: {concept}\n")
-            file.write("=" * 50 + "\n")
+        self._collapsed_sources.append(file_path)
+        for result, score in results_with_scores:
+            row = {
+                'kind': 'chunk',
+                'file': get_file_name(result.metadata['file']) if 'file' in result.metadata else file_name,
+                'concept': concept_label(self.concept),
+                'chunk': result.metadata.get('chunk'),
+                'chunk_offset': result.metadata.get('start'),
+                'page': result.metadata.get('page'),
+                'score': float(score),
+                'text_chunk': result.page_content,
+                'model_response': None,
+                'occurrences': 1,
+            }
+            row['files'] = [row['file']]
+            signature = minhash(result.page_content)
+            cluster = None if signature is None else self._duplicates.find(signature)
+            if cluster is None:
+                if signature is not None:
+                    self._collapsed_rows[self._duplicates.add(signature)] = len(self._collapsed)
+                self._collapsed.append(row)
+                continue
 
-            if results_with_scores:
-                for result, score in results_with_scores:
-                    content = result.page_content
-                    file.write(f"File: {get_file_name(file_path)}\nText Chunk:\n{content}\nScore: {score}\n")
-                    file.write("-" * 50 + "\n")
+            collapsed = self._collapsed[self._collapsed_rows[cluster]]
+            collapsed['occurrences'] += 1
+            if row['file'] not in collapsed['files']:
+                collapsed['files'].append(row['file'])
+            # The row shows the occurrence with the best score
+            if row['score'] > collapsed['score']:
+                collapsed.update({column: row[column] for column in
+                                  ('file', 'chunk', 'chunk_offset', 'page', 'score', 'text_chunk')})
+
+    def _add(self, row, source):
+        self._rows.append(row)
+        self._sources.append(source)
+
+    def _flush_if_full(self):
+        checkpoint_due = (self.on_flush is not None
+                          and time.monotonic() - self._flushed_at >= self.checkpoint_seconds)
+        if len(self._rows) >= self.flush_rows or checkpoint_due:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self._rows:
+            return
+        if self.result_format == "parquet":
+            self._write_parquet(self._rows)
+        else:
+            self._open_text_file()
+            write_row = getattr(self, f"_write_{self.result_format}_row")
+            for row in self._rows:
+                write_row(row)
+            self._file.flush()
+        sources = list(dict.fromkeys(source for source in self._sources if source))
+        self._rows = []
+        self._sources = []
+        if self.on_flush is not None and sources:
+            self.on_flush(sources)
+
+    def close(self):
+        if self._duplicates is not None and self._collapsed_sources:
+            if self._collapsed:
+                self._collapsed[0]['kind'] = 'first_chunk'
+                self._rows.extend(self._collapsed)
             else:
-                file.write("No relevant documents found above the similarity threshold.\n")
-
-    @staticmethod
-    def save_results_relevant_chunks_in_csv_file(concept, file_path, results_with_scores, save_path, timestamp):
-        # Define the CSV file name and full path
-        filename = f"{concept.replace(' ', '_')}_relevant_context_{timestamp}.csv"
-        full_file_path = os.path.join(save_path, filename)
-
-        # Open the CSV file in append mode to add rows if the file already exists
-        with open(full_file_path, 'a', newline='') as csvfile:
-            # Define the CSV writer
-            csvwriter = csv.writer(csvfile)
-
-            # Write the header only if the file is new
-            if csvfile.tell() == 0:
-                csvwriter.writerow(['file', 'text_chunk', 'score'])
-
-            # Write the relevant chunks and scores to the CSV file
-            if results_with_scores:
-                for result, score in results_with_scores:
-                    content = result.page_content
-                    csvwriter.writerow([get_file_name(file_path), content, score])
+                self._rows.append({'kind': 'no_results', 'file': None, 'concept': concept_label(self.concept),
+                                   'chunk': None, 'chunk_offset': None, 'page': None, 'score': None,
+                                   'text_chunk': None, 'model_response': None})
+            self._sources.extend(self._collapsed_sources)
+            self._collapsed = []
+            self._collapsed_sources = []
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"Results saved to {self.full_file_path}")
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+            print(f"Results saved to {self.full_file_path}")
+
+    def _open_text_file(self):
+        if self._file is not None:
+            return
+        # Append, so that a run that is resumed with the same timestamp keeps its earlier rows
+        self._file = open(self.full_file_path, 'a', newline='' if self.result_format == "csv" else None,
+                          encoding='utf-8')
+        if self.result_format == "csv":
+            self._csv_writer = csv.writer(self._file)
+
+    def _write_txt_row(self, row):
+        if row['kind'] == 'response':
+            self._file.write(f"{row['date']} - {row['file']} - {row['model_response']}\n")
+            return
+        if row['kind'] == 'code':
+            self._file.write(f"{row['date']} - {row['file']} - {row['concept']} - {row['model_response']}\n")
+            return
+
+        if row['kind'] in ('first_chunk', 'no_results'):
+            self._file.write(f"Relevant Context for Concept: {row['concept']}\n")
+            self._file.write("=" * 50 + "\n")
+        if row['kind'] == 'no_results':
+            self._file.write(f"{NO_RESULTS_MESSAGE}\n")
+        else:
+            self._file.write(f"File: {row['file']}\nText Chunk:\n{row['text_chunk']}\nScore: {row['score']}\n")
+            if 'occurrences' in row:
+                self._file.write(f"Occurrences: {row['occurrences']} in {', '.join(row['files'])}\n")
+            self._file.write("-" * 50 + "\n")
+
+    def _write_csv_row(self, row):
+        # Write the header only if the file is new
+        if self._file.tell() == 0:
+            if row['kind'] in ('response', 'code'):
+                self._csv_writer.writerow(['date', 'file', 'concept', 'model_response'])
+            elif self._duplicates is not None:
+                self._csv_writer.writerow(['file', 'text_chunk', 'score', 'occurrences', 'files'])
             else:
-                csvwriter.writerow(['No relevant documents found above the similarity threshold.', '', ''])
+                self._csv_writer.writerow(['file', 'text_chunk', 'score'])
+
+        if row['kind'] in ('response', 'code'):
+            self._csv_writer.writerow([row['date'], row['file'], row['concept'], row['model_response']])
+        elif row['kind'] == 'no_results':
+            self._csv_writer.writerow([NO_RESULTS_MESSAGE, '', ''])
+        elif 'occurrences' in row:
+            self._csv_writer.writerow([row['file'], row['text_chunk'], row['score'], row['occurrences'],
+                                       ', '.join(row['files'])])
+        else:
+            self._csv_writer.writerow([row['file'], row['text_chunk'], row['score']])
+
+    def _write_jsonl_row(self, row):
+        self._file.write(json.dumps(typed_row(row, self._duplicates is not None), ensure_ascii=False) + "\n")
+
+    def _write_parquet(self, rows):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet results need the pyarrow package (pip install pyarrow).")
+
+        columns = [
+            ('file', pa.string()),
+            ('concept', pa.string()),
+            ('chunk', pa.int32()),
+            ('chunk_offset', pa.int64()),
+            ('page', pa.int32()),
+            ('score', pa.float64()),
+            ('text_chunk', pa.string()),
+            ('model_response', pa.string()),
+        ]
+        collapsed = self._duplicates is not None
+        if collapsed:
+            columns += [('occurrences', pa.int32()), ('files', pa.list_(pa.string()))]
+        schema = pa.schema(columns)
+        table = pa.Table.from_pylist([typed_row(row, collapsed) for row in rows], schema=schema)
+        if self._parquet_writer is None:
+            # Parquet files cannot be appended to, so a resumed run writes a new part next to the old file
+            if os.path.exists(self.full_file_path):
+                self.full_file_path = next_part_path(self.full_file_path)
+            self._parquet_writer = pq.ParquetWriter(self.full_file_path, schema)
+        self._parquet_writer.write_table(table)
+
+
+def next_part_path(path):
+    stem, extension = os.path.splitext(path)
+    number = 1
+    while os.path.exists(f"{stem}.part{number}{extension}"):
+        number += 1
+    return f"{stem}.part{number}{extension}"
+
+
+def typed_row(row, collapsed=False):
+    typed = {column: row[column] for column in
+             ('file', 'concept', 'chunk', 'chunk_offset', 'page', 'score', 'text_chunk', 'model_response')}
+    if collapsed:
+        # Rows without chunks, such as the no-results row, occur nowhere
+        typed['occurrences'] = row.get('occurrences', 0)
+        typed['files'] = row.get('files', [])
+    return typed
+
+
+def concept_label(concept):
+    if isinstance(concept, str):
+        return concept
+    return ", ".join(concept)
 
 
 def get_file_name(file_path):
@@ -0,0 +1,333 @@
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from bm25 import BM25Index, fuse_scores
+from concept_coding import resolve_concepts
+from configuration import Configuration
+from corpus_index import CORPUS_AUTO, CORPUS_OFF, CorpusIndex
+from document_index_store import DocumentIndexStore, add_chunks, chunk_batches, chunk_metadata
+from embedding_providers import create_embeddings
+from file_utils import FileUtils
+from near_duplicates import DEFAULT_NEAR_DUPLICATE_THRESHOLD, NearDuplicateEmbeddings
+from rate_limiter import RateLimiter
+from results_saver import ResultsSaver
+from run_control import RunCancelled, RunControl
+from run_manifest import RunManifest
+from run_metrics import RunMetrics, write_run_reports
+
+
+class RetrievalPipeline:
+    """Relevant context retrieval for one or more concepts in a single pass over the files.
+
+    The concept descriptions are embedded once, and every document is chunked, embedded
+    and indexed once. All concepts are then scored against the document's chunk matrix
+    with one matrix product, and each concept gets its own result file.
+
+    When the corpus_index option is on, every document is also added to the corpus-wide
+    index, which ``run_corpus`` queries later without reading any file again.
+
+    With ``bm25_candidates`` set, a BM25 index of the document's chunks picks that many
+    candidates per concept first, and only the candidates are embedded and scored.
+    Their fused score mixes the dense relevance with the BM25 score; the threshold still
+    applies to the dense relevance. ``measure_recall`` also runs the full dense search
+    and reports how many of its results the prefilter kept.
+
+    With ``near_duplicate_threshold`` set, a chunk that is a near-duplicate of a chunk
+    embedded earlier in the run, in any document, reuses that chunk's vector instead of
+    being embedded. With ``collapse_duplicates``, near-duplicate results are saved once
+    with their number of occurrences.
+
+    As in CodingPipeline, failed files are recorded in the run manifest without stopping
+    the run, and ``tool_config.resume`` skips the files an earlier run completed. The
+    embedding model and caches can be replaced as in CodingPipeline.
+    """
+
+    def __init__(self, tool_config, run_control=None, embedding_model=None, embedding_cache=None, index_store=None):
+        self.tool_config = tool_config
+        self.concepts = resolve_concepts(tool_config.concept_input)
+        # Without a concept every chunk would be embedded and no result written
+        if not self.concepts:
+            raise ValueError("None of the selected concepts has a description in prompt_config.ini.")
+        self.run_control = run_control or RunControl(len(tool_config.files_array))
+        self.embedding_limiter = RateLimiter('Embedding', tool_config.embedding_requests_per_minute,
+                                             tool_config.embedding_tokens_per_minute, tool_config.max_in_flight)
+        self.embeddings = create_embeddings(tool_config.embedding_provider, self.embedding_limiter, embedding_model,
+                                            embedding_cache)
+        self.metrics = RunMetrics('retrieval', embedding_model=self.embeddings.model)
+        self.embeddings.on_embed = self.metrics.embedding_requested
+        self.embedding_limiter.on_rate_limited = lambda: self.metrics.count(rate_limited_requests=1)
+        self.index_store = index_store if index_store is not None else DocumentIndexStore()
+        # Embeds the chunks; see run
+        self.chunk_embeddings = self.embeddings
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.descriptions = [Configuration.get_concept_description(concept) for concept in self.concepts]
+        # Per concept: dense results found and how many of them the BM25 prefilter kept
+        self.recall_found = [0] * len(self.concepts)
+        self.recall_kept = [0] * len(self.concepts)
+
+    def run(self):
+        context_config = self.tool_config.context_retrieval_config
+        concept_vectors = self._concept_vectors()
+        # Near-duplicates are found among the chunks of this run
+        self.chunk_embeddings = self.embeddings
+        if context_config.near_duplicate_threshold:
+            self.chunk_embeddings = NearDuplicateEmbeddings(self.embeddings,
+                                                            float(context_config.near_duplicate_threshold))
+            self.chunk_embeddings.on_reuse = lambda count: self.metrics.count(near_duplicate_chunks=count)
+        manifest = RunManifest(self.tool_config.save_path, 'retrieval', self.run_settings(), self.tool_config.resume)
+        self.timestamp = manifest.timestamp
+        files = manifest.start(self.tool_config.files_array)
+        self.run_control.skip_files(manifest.skipped)
+
+        with ExitStack() as stack:
+            # One open result file per concept for the whole run
+            results_savers = [stack.enter_context(ResultsSaver.relevant_chunks(
+                self.tool_config.save_path, concept, self.timestamp, context_config.result_format,
+                self._collapse_threshold()))
+                for concept in self.concepts]
+            for results_saver in results_savers:
+                results_saver.on_flush = manifest.saved
+            corpus_index = None
+            # Prefiltered documents are only partly embedded, so they cannot go into the corpus index
+            if context_config.corpus_index != CORPUS_OFF and not context_config.bm25_candidates:
+                corpus_index = stack.enter_context(CorpusIndex(self.embeddings.model, context_config.corpus_index,
+                                                               context_config.corpus_pq))
+            self._run_files(files, manifest, concept_vectors, results_savers, corpus_index)
+
+        self.metrics.finish()
+        report_path = write_run_reports(self.metrics, self.tool_config)
+        summary = (f"{manifest.summary()}; {self.embeddings.cache.stats()}; {self.embedding_limiter.stats()}; "
+                   f"run report saved to {report_path}")
+        if isinstance(self.chunk_embeddings, NearDuplicateEmbeddings):
+            summary += f"; {self.chunk_embeddings.stats()}"
+        if context_config.bm25_candidates and context_config.measure_recall:
+            summary += "; BM25 prefilter recall: " + ", ".join(
+                f"{concept} {kept / found:.2f} ({kept}/{found})" if found else f"{concept} n/a"
+                for concept, kept, found in zip(self.concepts, self.recall_kept, self.recall_found))
+        print(summary)
+        return summary
+
+    def run_corpus(self):
+        """Saves the top chunks of the whole corpus index for every concept, without touching the files."""
+        context_config = self.tool_config.context_retrieval_config
+        concept_vectors = self._concept_vectors()
+        kind = context_config.corpus_index if context_config.corpus_index != CORPUS_OFF else CORPUS_AUTO
+        self.metrics.mode = 'corpus'
+
+        with CorpusIndex(self.embeddings.model, kind, context_config.corpus_pq) as corpus_index, \
+                ExitStack() as stack:
+            results_savers = [stack.enter_context(ResultsSaver.relevant_chunks(
+                self.tool_config.save_path, concept, self.timestamp, context_config.result_format,
+                self._collapse_threshold()))
+                for concept in self.concepts]
+            started = time.perf_counter()
+            with self.metrics.stage('search'):
+                results_per_concept = corpus_index.search(concept_vectors, int(context_config.max_chunks),
+                                                          float(context_config.threshold))
+            search_ms = (time.perf_counter() - started) * 1000
+            with self.metrics.stage('saving'):
+                for results_saver, results_with_scores in zip(results_savers, results_per_concept):
+                    results_saver.save_relevant_chunks(None, results_with_scores)
+            corpus_size = corpus_index.size
+
+        self.metrics.count(chunks=corpus_size, chunks_kept=sum(len(results) for results in results_per_concept))
+        self.metrics.finish()
+        report_path = write_run_reports(self.metrics, self.tool_config)
+        summary = (f"Searched {corpus_size} corpus chunks for {len(self.concepts)} concepts in {search_ms:.1f} ms; "
+                   f"{self.embeddings.cache.stats()}; run report saved to {report_path}")
+        print(summary)
+        return summary
+
+    def run_settings(self):
+        # Everything that changes the saved chunks; a manifest is only resumed with the same settings
+        context_config = self.tool_config.context_retrieval_config
+        settings = {
+            'concepts': self.concepts,
+            'descriptions': self.descriptions,
+            'embedding_model': self.embeddings.model,
+            'chunking': [context_config.chunk_size, context_config.chunk_overlap, context_config.max_chunks,
+                         context_config.threshold, context_config.bm25_candidates],
+            'result_format': context_config.result_format,
+        }
+        if context_config.near_duplicate_threshold or context_config.collapse_duplicates:
+            settings['near_duplicates'] = [context_config.near_duplicate_threshold,
+                                           context_config.collapse_duplicates]
+        return settings
+
+    def _collapse_threshold(self):
+        context_config = self.tool_config.context_retrieval_config
+        if not context_config.collapse_duplicates:
+            return None
+        return float(context_config.near_duplicate_threshold or DEFAULT_NEAR_DUPLICATE_THRESHOLD)
+
+    def _index_key(self, single_file):
+        context_config = self.tool_config.context_retrieval_config
+        splitter_settings = FileUtils.splitter_settings(context_config.chunk_size, context_config.chunk_overlap)
+        if context_config.near_duplicate_threshold:
+            # Such an index holds reused vectors, so it is kept apart from one with every chunk embedded
+            splitter_settings['near_duplicate_threshold'] = float(context_config.near_duplicate_threshold)
+        return self.index_store.key_for(single_file, splitter_settings, self.embeddings)
+
+    def _concept_vectors(self):
+        return np.asarray(self.embeddings.embed_documents(self.descriptions), dtype=np.float32)
+
+    def _run_files(self, files, manifest, concept_vectors, results_savers, corpus_index=None):
+        for single_file in files:
+            self.run_control.check_cancelled()
+            chunk_count = 0
+            try:
+                with self.metrics.file(single_file):
+                    results_per_concept, chunk_count = self._file_results(single_file, concept_vectors,
+                                                                          corpus_index)
+                    manifest.expect(single_file, len(results_savers))
+                    with self.metrics.stage('saving'):
+                        for results_saver, results_with_scores in zip(results_savers, results_per_concept):
+                            results_saver.save_relevant_chunks(single_file, results_with_scores)
+            except RunCancelled:
+                raise
+            except Exception as error:
+                # One unreadable PDF must not stop the other files
+                manifest.failed(single_file, error)
+            self.run_control.file_done(single_file, chunks=chunk_count)
+
+    def _file_results(self, single_file, concept_vectors, corpus_index):
+        # Returns the results of every concept for one file and the number of chunks scored
+        context_config = self.tool_config.context_retrieval_config
+        if context_config.bm25_candidates:
+            return self._prefiltered_results(single_file, concept_vectors)
+
+        key = self._index_key(single_file)
+        vector_store = self._load_or_build_index(key, single_file)
+        if corpus_index is not None:
+            with self.metrics.stage('corpus_indexing'):
+                corpus_index.add_document(single_file, key, vector_store)
+        with self.metrics.stage('search'):
+            full_results = score_concepts(vector_store, concept_vectors, int(context_config.max_chunks))
+        threshold_value = float(context_config.threshold)
+        results_per_concept = [
+            [(doc, score) for doc, score in results_with_scores if score >= threshold_value]
+            for results_with_scores in full_results]
+        chunk_count = vector_store.index.ntotal
+        self.metrics.count(chunks=chunk_count,
+                           chunks_retrieved=sum(len(results) for results in full_results),
+                           chunks_kept=sum(len(results) for results in results_per_concept))
+        return results_per_concept, chunk_count
+
+    def _load_or_build_index(self, key, single_file):
+        with self.metrics.stage('index_loading'):
+            vector_store = self.index_store.load(key, self.embeddings)
+        if vector_store is not None:
+            return vector_store
+
+        # The document is read, chunked, embedded and indexed a batch of chunks at a time
+        batches = chunk_batches(self._iter_chunks(single_file))
+        while True:
+            with self.metrics.stage('chunking'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            with self.metrics.stage('embedding'):
+                # As float32 right away: a list of Python floats takes eight times the memory
+                vectors = np.asarray(self.chunk_embeddings.embed_documents([text for _, text in batch]),
+                                     dtype=np.float32)
+            with self.metrics.stage('indexing'):
+                vector_store = add_chunks(vector_store, batch, vectors, self.embeddings)
+        with self.metrics.stage('indexing'):
+            self.index_store.save(key, vector_store, single_file)
+        return vector_store
+
+    def _iter_chunks(self, single_file):
+        # Extraction and chunking are one streaming step here
+        context_config = self.tool_config.context_retrieval_config
+        return FileUtils.split_pages(FileUtils.iter_text(single_file, workers=None),
+                                     context_config.chunk_size, context_config.chunk_overlap,
+                                     paged=FileUtils.is_pdf_file(single_file))
+
+    def _prefiltered_results(self, single_file, concept_vectors):
+        context_config = self.tool_config.context_retrieval_config
+        threshold_value = float(context_config.threshold)
+        with self.metrics.stage('chunking'):
+            # BM25 scores every chunk of the document, so its chunks are all kept
+            chunks = list(self._iter_chunks(single_file))
+        texts = [text for _, text in chunks]
+        metadata = chunk_metadata([record for record, _ in chunks])
+        with self.metrics.stage('bm25'):
+            bm25_index = BM25Index(texts)
+            lexical = [bm25_index.top(description, int(context_config.bm25_candidates))
+                       for description in self.descriptions]
+        # Chunks that are candidates for several concepts are embedded once
+        candidate_ids = sorted(set().union(*(candidates.tolist() for candidates, _ in lexical)))
+        vectors = {}
+        if candidate_ids:
+            with self.metrics.stage('embedding'):
+                embedded = self.chunk_embeddings.embed_documents([texts[position] for position in candidate_ids])
+            vectors = dict(zip(candidate_ids, np.asarray(embedded, dtype=np.float32)))
+
+        with self.metrics.stage('search'):
+            results_per_concept = []
+            for row, (candidates, lexical_scores) in enumerate(lexical):
+                if not len(candidates):
+                    results_per_concept.append([])
+                    continue
+                candidate_vectors = np.stack([vectors[position] for position in candidates])
+                distances = ((candidate_vectors - concept_vectors[row]) ** 2).sum(axis=1)
+                dense_scores = np.array([VectorStore._euclidean_relevance_score_fn(float(distance))
+                                         for distance in distances])
+                fused_scores = fuse_scores(dense_scores, lexical_scores[candidates], float(lexical_scores.max()))
+                ranked = [position for position in np.argsort(-fused_scores)
+                          if dense_scores[position] >= threshold_value]
+                results_per_concept.append([
+                    (Document(page_content=texts[candidates[position]], metadata=metadata[candidates[position]]),
+                     float(fused_scores[position]))
+                    for position in ranked[:int(context_config.max_chunks)]])
+        self.metrics.count(chunks=len(chunks), chunks_retrieved=sum(len(candidates) for candidates, _ in lexical),
+                           chunks_kept=sum(len(results) for results in results_per_concept))
+
+        if context_config.measure_recall:
+            self._measure_recall(single_file, concept_vectors, lexical)
+        return results_per_concept, len(candidate_ids)
+
+    def _measure_recall(self, single_file, concept_vectors, lexical):
+        # The dense results above the threshold that the full search would return, compared with the candidates
+        context_config = self.tool_config.context_retrieval_config
+        key = self._index_key(single_file)
+        vector_store = self._load_or_build_index(key, single_file)
+        full_results = score_concepts(vector_store, concept_vectors, int(context_config.max_chunks))
+        for row, results_with_scores in enumerate(full_results):
+            candidates = set(lexical[row][0].tolist())
+            found = [doc.metadata['chunk'] for doc, score in results_with_scores
+                     if score >= float(context_config.threshold)]
+            self.recall_found[row] += len(found)
+            self.recall_kept[row] += sum(1 for chunk in found if chunk in candidates)
+
+
+def score_concepts(vector_store, concept_vectors, k):
+    """Returns the top ``k`` (document, relevance score) pairs of ``vector_store`` for every concept vector."""
+    chunk_count = vector_store.index.ntotal
+    if chunk_count == 0:
+        return [[] for _ in range(len(concept_vectors))]
+
+    chunk_vectors = vector_store.index.reconstruct_n(0, chunk_count)
+    # Squared L2 distances, the same value IndexFlatL2 reports to FAISS.similarity_search_with_score
+    distances = ((concept_vectors ** 2).sum(axis=1)[:, None]
+                 + (chunk_vectors ** 2).sum(axis=1)[None, :]
+                 - 2.0 * concept_vectors @ chunk_vectors.T)
+    np.maximum(distances, 0.0, out=distances)
+
+    k = min(k, chunk_count)
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    relevance_score_fn = vector_store._select_relevance_score_fn()
+
+    results_per_concept = []
+    for row, positions in enumerate(nearest):
+        positions = positions[np.argsort(distances[row, positions])]
+        results_per_concept.append([
+            (vector_store.docstore.search(vector_store.index_to_docstore_id[position]),
+             relevance_score_fn(float(distances[row, position])))
+            for position in positions])
+    return results_per_concept
@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class ProgressEvent:
+
+    def __init__(self, file, files_done, files_total, tokens, chunks, elapsed, files_skipped=0):
+        self.file = file
+        self.files_done = files_done
+        self.files_total = files_total
+        self.tokens = tokens
+        self.chunks = chunks
+        self.elapsed = elapsed
+        # Files completed by an earlier run that this one resumes
+        self.files_skipped = files_skipped
+
+    @property
+    def eta(self):
+        # Seconds left, extrapolated from the average time per file processed by this run
+        processed = self.files_done - self.files_skipped
+        if processed <= 0:
+            return None
+        return self.elapsed / processed * (self.files_total - self.files_done)
+
+    def __str__(self):
+        eta = "unknown" if self.eta is None else f"{self.eta:.0f}s"
+        return (f"{self.files_done}/{self.files_total} files, {self.tokens} tokens, {self.chunks} chunks, "
+                f"elapsed {self.elapsed:.0f}s, ETA {eta}")
+
+
+class RunControl:
+    """Progress reporting and cooperative cancellation shared by the pipelines.
+
+    ``on_progress`` is called with a ProgressEvent from the thread running the pipeline
+    after every finished file. Pipelines call ``check_cancelled`` before starting a file
+    and stop with RunCancelled once ``cancel_event`` is set.
+    """
+
+    def __init__(self, files_total, on_progress=None, cancel_event=None):
+        self.files_total = files_total
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event or threading.Event()
+        self.files_done = 0
+        self.files_skipped = 0
+        self.tokens = 0
+        self.chunks = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise RunCancelled("The run was cancelled.")
+
+    def file_done(self, file, tokens=0, chunks=0):
+        with self._lock:
+            self.files_done += 1
+            self.tokens += tokens
+            self.chunks += chunks
+            event = self._event(file)
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+    def skip_files(self, count):
+        # Files a resumed run does not process again count as done, but not towards the ETA
+        if not count:
+            return
+        with self._lock:
+            self.files_done += count
+            self.files_skipped += count
+            event = self._event(None)
+        if self.on_progress is not None:
+            self.on_progress(event)
+
+    def _event(self, file):
+        return ProgressEvent(file, self.files_done, self.files_total, self.tokens, self.chunks,
+                             time.monotonic() - self._started, self.files_skipped)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+from file_utils import FileUtils
+from run_metrics import write_atomically
+
+STATUS_PENDING = 'pending'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+
+class RunManifest:
+    """Record of the files of a run that are completed, failed or still pending, so the run can be resumed.
+
+    The manifest is a JSON file in the save path, named after the run mode and a hash of
+    the settings that shape the results, such as the prompt, model, concepts and chunking.
+    Entries are keyed by file path and keep the file's content hash: on resume a file is
+    only skipped when it was completed with the same content, and failed files are retried.
+    A file counts as completed once all of its result rows have been flushed to disk, so
+    rows still in a ResultsSaver buffer when a run dies are written again by the resumed run.
+    """
+
+    def __init__(self, save_path, mode, settings, resume=False):
+        self.settings_hash = settings_hash(settings)
+        self.path = os.path.join(save_path, f"run_manifest_{mode}_{self.settings_hash[:16]}.json")
+        self.mode = mode
+        previous = self._read() if resume else None
+        self.resumed = previous is not None
+        # A resumed run appends to the result files of the run it continues
+        self.timestamp = previous['timestamp'] if previous else datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.files = previous['files'] if previous else {}
+        self.skipped = 0
+        # File -> result savers that have not flushed its rows yet
+        self._unsaved = {}
+        self._lock = threading.Lock()
+
+    def start(self, files):
+        """Registers ``files`` and returns those that still have to be processed, in their original order."""
+        pending = []
+        for file in files:
+            try:
+                file_hash = FileUtils.hash_file(file)
+            except OSError:
+                # Reading the file fails again while it is processed, where the error is recorded
+                file_hash = None
+            entry = self.files.get(file)
+            if entry and entry['status'] == STATUS_COMPLETED and file_hash and entry['file_hash'] == file_hash:
+                self.skipped += 1
+                continue
+            self.files[file] = {'file_hash': file_hash, 'status': STATUS_PENDING, 'error': None,
+                                'updated': now()}
+            pending.append(file)
+        self._write()
+        if self.resumed:
+            print(f"Resuming run {self.timestamp}: {self.skipped} file(s) already completed, "
+                  f"{len(pending)} to process.")
+        return pending
+
+    def expect(self, file, savers=1):
+        # Called before the rows of ``file`` are handed to ``savers`` result savers
+        with self._lock:
+            self._unsaved[file] = savers
+        if savers == 0:
+            self._set_status(file, STATUS_COMPLETED)
+
+    def saved(self, files):
+        """ResultsSaver.on_flush callback: ``files`` had rows written by one saver."""
+        completed = []
+        with self._lock:
+            for file in files:
+                if file not in self._unsaved:
+                    continue
+                self._unsaved[file] -= 1
+                if self._unsaved[file] <= 0:
+                    del self._unsaved[file]
+                    completed.append(file)
+        for file in completed:
+            self._set_status(file, STATUS_COMPLETED, write=False)
+        if completed:
+            self._write()
+
+    def failed(self, file, error):
+        with self._lock:
+            self._unsaved.pop(file, None)
+        print(f"{file} failed: {error}", file=sys.stderr)
+        self._set_status(file, STATUS_FAILED, f"{type(error).__name__}: {error}")
+
+    def counts(self):
+        with self._lock:
+            statuses = [entry['status'] for entry in self.files.values()]
+        return {status: statuses.count(status) for status in (STATUS_COMPLETED, STATUS_FAILED, STATUS_PENDING)}
+
+    def summary(self):
+        counts = self.counts()
+        return (f"{counts[STATUS_COMPLETED]} file(s) completed ({self.skipped} from an earlier run), "
+                f"{counts[STATUS_FAILED]} failed, {counts[STATUS_PENDING]} pending; run manifest saved to {self.path}")
+
+    def _set_status(self, file, status, error=None, write=True):
+        with self._lock:
+            self.files[file].update(status=status, error=error, updated=now())
+        if write:
+            self._write()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def _write(self):
+        with self._lock:
+            content = json.dumps({'mode': self.mode, 'settings_hash': self.settings_hash,
+                                  'timestamp': self.timestamp, 'files': self.files}, indent=2)
+            write_atomically(self.path, content)
+
+
+def settings_hash(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def now():
+    return datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
@@ -0,0 +1,219 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from token_chunker import CHUNK_ENCODING, get_encoding
+
+# USD per million (prompt, completion) tokens
+LLM_PRICES_PER_MILLION = {
+    "gpt-4o": (5.00, 15.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4-turbo": (10.00, 30.00),
+}
+# Share of the prompt price billed for prompt tokens served from the provider's prompt cache
+CACHED_PROMPT_PRICE_FACTOR = 0.5
+# USD per million embedded tokens; local embedding providers cost nothing
+EMBEDDING_PRICES_PER_MILLION = {
+    "text-embedding-ada-002": 0.10,
+    "text-embedding-3-small": 0.02,
+    "text-embedding-3-large": 0.13,
+}
+COUNTERS = ('llm_requests', 'prompt_tokens', 'cached_prompt_tokens', 'completion_tokens', 'embedding_tokens',
+            'embedded_chunks', 'chunks', 'chunks_retrieved', 'chunks_kept', 'chunks_packed', 'sections',
+            'cached_responses', 'rate_limited_requests', 'near_duplicate_chunks')
+
+# File the code running in the current task or thread is working on
+_current_file = ContextVar('current_file', default=None)
+
+
+class RunMetrics:
+    """Stage timings, token counts, chunk counts and estimated cost of one pipeline run, per file.
+
+    Code inside ``with metrics.file(path):`` is attributed to that file. Because the file
+    is kept in a context variable, concurrent asyncio tasks and the threads they start
+    each add to their own file. Work outside any file, such as embedding the concept
+    descriptions, is reported under the run totals only.
+    """
+
+    def __init__(self, mode, llm_model=None, embedding_model=None):
+        self.mode = mode
+        self.llm_model = llm_model
+        self.embedding_model = embedding_model
+        self.started = time.time()
+        self.duration = None
+        self._started_perf = time.perf_counter()
+        self._files = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def file(self, file):
+        token = _current_file.set(file)
+        try:
+            yield
+        finally:
+            _current_file.reset(token)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._entry()['stages'][name] += elapsed
+
+    def count(self, **counts):
+        with self._lock:
+            entry = self._entry()
+            for name, value in counts.items():
+                entry[name] += value
+
+    def llm_call(self, prompt_tokens, cached_prompt_tokens, completion_tokens, seconds):
+        # Every request is also listed on its own, to show which ones hit the provider's prompt cache
+        with self._lock:
+            entry = self._entry()
+            entry['llm_requests'] += 1
+            entry['prompt_tokens'] += prompt_tokens
+            entry['cached_prompt_tokens'] += cached_prompt_tokens
+            entry['completion_tokens'] += completion_tokens
+            entry['llm_calls'].append({'prompt_tokens': prompt_tokens, 'cached_prompt_tokens': cached_prompt_tokens,
+                                       'completion_tokens': completion_tokens, 'seconds': round(seconds, 3)})
+
+    def embedding_requested(self, texts):
+        # Called by CachedEmbeddings with the texts that are actually sent to the embedding model
+        encoding = get_encoding(CHUNK_ENCODING)
+        tokens = sum(len(encoding.encode(text, disallowed_special=())) for text in texts)
+        self.count(embedding_tokens=tokens, embedded_chunks=len(texts))
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started_perf
+
+    def report(self):
+        files = []
+        totals = new_entry()
+        with self._lock:
+            for file, entry in self._files.items():
+                for name, seconds in entry['stages'].items():
+                    totals['stages'][name] += seconds
+                for name in COUNTERS:
+                    totals[name] += entry[name]
+                if file is not None:
+                    summary = self._summarise(entry, file=file)
+                    summary['llm_calls'] = list(entry['llm_calls'])
+                    files.append(summary)
+
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._started_perf
+        return {
+            'mode': self.mode,
+            'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            'duration_seconds': round(duration, 3),
+            'llm_model': self.llm_model,
+            'embedding_model': self.embedding_model,
+            'prices_per_million_tokens': {
+                'llm': LLM_PRICES_PER_MILLION.get(self.llm_model),
+                'embedding': EMBEDDING_PRICES_PER_MILLION.get(self.embedding_model, 0.0),
+            },
+            'totals': self._summarise(totals, files=len(files)),
+            'files': files,
+        }
+
+    def write_report(self, path):
+        write_atomically(path, json.dumps(self.report(), indent=2))
+        return path
+
+    def write_prometheus(self, path):
+        """Writes the run totals in the Prometheus text format, for node_exporter's textfile collector."""
+        report = self.report()
+        totals = report['totals']
+        mode = f'mode="{self.mode}"'
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in samples)
+
+        gauge("llm_coder_last_run_timestamp_seconds", "Unix time the last run started.",
+              [(mode, round(self.started, 3))])
+        gauge("llm_coder_run_duration_seconds", "Wall time of the last run.", [(mode, report['duration_seconds'])])
+        gauge("llm_coder_run_files", "Files processed by the last run.", [(mode, totals['files'])])
+        gauge("llm_coder_stage_seconds", "Time spent per stage in the last run, summed over files.",
+              [(f'{mode},stage="{stage}"', seconds) for stage, seconds in totals['stages'].items()])
+        gauge("llm_coder_llm_requests", "LLM requests sent by the last run.", [(mode, totals['llm_requests'])])
+        gauge("llm_coder_rate_limited_requests", "Rate limit responses received by the last run.",
+              [(mode, totals['rate_limited_requests'])])
+        gauge("llm_coder_tokens", "Tokens used by the last run.",
+              [(f'{mode},kind="{kind}"', totals[f"{kind}_tokens"])
+               for kind in ('prompt', 'cached_prompt', 'completion', 'embedding')])
+        gauge("llm_coder_chunks", "Chunks handled by the last run.",
+              [(f'{mode},kind="{kind}"', totals[name]) for kind, name in
+               (('total', 'chunks'), ('retrieved', 'chunks_retrieved'), ('kept', 'chunks_kept'),
+                ('near_duplicate', 'near_duplicate_chunks'))])
+        gauge("llm_coder_estimated_cost_usd", "Estimated API cost of the last run.",
+              [(mode, totals['estimated_cost_usd'])])
+        write_atomically(path, "\n".join(lines) + "\n")
+        return path
+
+    def _entry(self):
+        file = _current_file.get()
+        if file not in self._files:
+            self._files[file] = new_entry()
+        return self._files[file]
+
+    def _summarise(self, entry, **extra):
+        summary = dict(extra)
+        summary['stages'] = {name: round(seconds, 4) for name, seconds in entry['stages'].items()}
+        summary.update({name: entry[name] for name in COUNTERS})
+        summary['kept_ratio'] = (round(entry['chunks_kept'] / entry['chunks_retrieved'], 4)
+                                 if entry['chunks_retrieved'] else None)
+        summary['cached_prompt_ratio'] = (round(entry['cached_prompt_tokens'] / entry['prompt_tokens'], 4)
+                                          if entry['prompt_tokens'] else None)
+        summary['estimated_cost_usd'] = round(self._cost(entry), 6)
+        return summary
+
+    def _cost(self, entry):
+        prompt_price, completion_price = LLM_PRICES_PER_MILLION.get(self.llm_model, (0.0, 0.0))
+        embedding_price = EMBEDDING_PRICES_PER_MILLION.get(self.embedding_model, 0.0)
+        uncached_tokens = entry['prompt_tokens'] - entry['cached_prompt_tokens']
+        return (uncached_tokens * prompt_price
+                + entry['cached_prompt_tokens'] * prompt_price * CACHED_PROMPT_PRICE_FACTOR
+                + entry['completion_tokens'] * completion_price
+                + entry['embedding_tokens'] * embedding_price) / 1_000_000
+
+
+def new_entry():
+    entry = {name: 0 for name in COUNTERS}
+    entry['stages'] = defaultdict(float)
+    entry['llm_calls'] = []
+    return entry
+
+
+def write_atomically(path, content):
+    # Readers such as the Prometheus textfile collector never see a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_run_reports(metrics, tool_config):
+    # The JSON report goes next to the results; the Prometheus textfile only when one is configured.
+    # Reports are named after the start of the run, so a resumed run does not replace the earlier report.
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(metrics.started))
+    report_path = os.path.join(tool_config.save_path, f"{timestamp}_{metrics.mode}_run_report.json")
+    metrics.write_report(report_path)
+    if tool_config.metrics_textfile:
+        metrics.write_prometheus(tool_config.metrics_textfile)
+    return report_path
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The modules live in the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configuration import Configuration  # noqa: E402
+
+PROMPT_CONFIG = """[Prompt]
+system_message = You are a qualitative researcher.
+user_message = Code the following annual report.
+output_format = A score from 1 to 5; a short explanation.
+
+[Other]
+chunk_size = 200
+chunk_overlap = 50
+llm_cache = off
+embedding_provider = hashing
+
+[Concepts]
+automation = process automation and digital systems
+risk = audit and board risk oversight
+"""
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # A working directory with its own prompt_config.ini, where the default caches and indexes are created too
+    (tmp_path / "prompt_config.ini").write_text(PROMPT_CONFIG, encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Configuration, '_config', None)
+    return tmp_path
@@ -0,0 +1,47 @@
+import csv
+import json
+import re
+
+import pytest
+
+from batch_job import BatchRequestPipeline, ingest_results, manifest_path_for, run_local_batch
+from llm_coder_cli import build_tool_config, parse_args
+
+
+def coded_report(body):
+    # Answers with the number of the report in the request, so that every row shows which request it came from
+    number = re.search(r"Report (\d+)", body['messages'][1]['content']).group(1)
+    return json.dumps({'codes': [{'concept': concept, 'score': number, 'explanation': f"Report {number}."}
+                                 for concept in ("automation", "risk")]})
+
+
+def test_batch_results_are_saved_under_the_file_of_their_request(workspace):
+    files = []
+    for number in range(3):
+        path = workspace / f"report_{number}.txt"
+        path.write_text(f"Report {number} on the automation of invoice matching.", encoding='utf-8')
+        files.append(str(path))
+    (workspace / "broken.pdf").write_bytes(b"not a PDF")
+    files.insert(1, str(workspace / "broken.pdf"))
+    requests_path = str(workspace / "requests.jsonl")
+    results_path = str(workspace / "results.jsonl")
+    args = parse_args(['coding', *files, '--save-path', str(workspace), '--concept', 'automation',
+                       '--concept', 'risk', '--coding-result-format', 'csv', '--batch-requests', requests_path])
+
+    BatchRequestPipeline(build_tool_config(args), requests_path).run()
+    run_local_batch(requests_path, results_path, respond=coded_report)
+    with open(manifest_path_for(requests_path), encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    assert [entry['file'] for entry in manifest['failed']] == [files[1]]
+    assert ingest_results(manifest_path_for(requests_path), results_path) == 3
+
+    results_file, = workspace.glob("*_results.csv")
+    with open(results_file, encoding='utf-8', newline='') as rows:
+        saved = [(row['file'], row['concept'], row['model_response']) for row in csv.DictReader(rows)]
+    assert saved == [(f"report_{number}.txt", concept, f"{number}; Report {number}.")
+                     for number in (0, 1, 2) for concept in ("automation", "risk")]
+
+
+def test_batch_requests_are_only_written_for_coding(workspace):
+    with pytest.raises(SystemExit):
+        parse_args(['retrieval', str(workspace), '--concept', 'automation', '--batch-requests', "requests.jsonl"])
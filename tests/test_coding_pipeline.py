@@ -0,0 +1,60 @@
+from benchmark import SimulatedChatModel
+from coding_pipeline import CodingPipeline, construct_prompt
+from llm_coder_cli import build_tool_config, parse_args
+
+
+def write_reports(directory, count):
+    files = []
+    for number in range(count):
+        path = directory / f"report_{number}.txt"
+        path.write_text(f"Report {number}. Invoices are matched by the ERP system; the board reviews audit risk.",
+                        encoding='utf-8')
+        files.append(str(path))
+    return files
+
+
+def coding_pipeline(workspace, *options, files=None):
+    files = files or write_reports(workspace, 2)
+    args = parse_args(['coding', *files, '--save-path', str(workspace), *options])
+    return CodingPipeline(build_tool_config(args), llm=SimulatedChatModel())
+
+
+def result_lines(pipeline):
+    with open(pipeline.results_saver.full_file_path, encoding='utf-8') as results_file:
+        return results_file.read().splitlines()
+
+
+def test_coding_without_concept_uses_the_single_prompt(workspace):
+    pipeline = coding_pipeline(workspace)
+
+    assert pipeline.concepts == []
+    assert pipeline._instructions() == construct_prompt(pipeline.tool_config.messages)
+    pipeline.run()
+
+    assert pipeline.llm.requests == 2
+    lines = result_lines(pipeline)
+    assert [line.split(" - ")[1] for line in lines] == ["report_0.txt", "report_1.txt"]
+
+
+def test_several_concepts_are_coded_in_one_request(workspace):
+    pipeline = coding_pipeline(workspace, '--concept', 'automation', '--concept', 'risk')
+
+    assert pipeline.concepts == ["automation", "risk"]
+
+
+def test_the_context_token_budget_is_configured(workspace, capsys):
+    config_path = workspace / "prompt_config.ini"
+    config_path.write_text(config_path.read_text(encoding='utf-8').replace(
+        "[Other]\n", "[Other]\ncontext_token_budget = 300\n"), encoding='utf-8')
+    assert coding_pipeline(workspace).packer.token_budget == 300
+
+    files = write_reports(workspace, 2)
+    for path in files:
+        with open(path, 'a', encoding='utf-8') as report:
+            report.write(" The controls are tested every quarter." * 10)
+    pipeline = coding_pipeline(workspace, '--token-budget', '60', '--debug', files=files)
+    assert pipeline.run_settings()['context_token_budget'] == 60
+    pipeline.run()
+
+    # Both reports are over 60 tokens, so they are coded from their most relevant chunks
+    assert capsys.readouterr().out.count("of 60 context tokens") == 2
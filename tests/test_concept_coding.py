@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from concept_coding import ALL_CONCEPTS, InvalidCodingOutput, is_multi_concept, numeric_score, parse_codes
+
+CONCEPTS = ["automation", "audit risk"]
+
+
+def answer(*codes):
+    return json.dumps({'codes': list(codes)})
+
+
+def test_codes_are_returned_in_concept_order():
+    content = answer({'concept': " Audit Risk ", 'score': "3", 'explanation': " Some risk. "},
+                     {'concept': "automation", 'score': 5, 'explanation': "Fully automated."})
+
+    assert parse_codes(content, CONCEPTS) == [
+        {'concept': "automation", 'score': 5, 'explanation': "Fully automated."},
+        {'concept': "audit risk", 'score': "3", 'explanation': "Some risk."},
+    ]
+
+
+@pytest.mark.parametrize("content, problem", [
+    ("not json", "not valid JSON"),
+    (None, "not valid JSON"),
+    ("[]", 'no "codes" list'),
+    (json.dumps({'codes': "automation: 5"}), 'no "codes" list'),
+    (answer("automation"), "no concept name"),
+    (answer({'concept': "automation", 'score': 5, 'explanation': "Yes."},
+            {'concept': "staffing", 'score': 1, 'explanation': "No."}), "Unknown concept 'staffing'"),
+    (answer({'concept': "automation", 'score': 5, 'explanation': "Yes."},
+            {'concept': "Automation", 'score': 4, 'explanation': "Again."}), "coded more than once"),
+    (answer({'concept': "automation", 'score': True, 'explanation': "Yes."}), "'automation' has no score"),
+    (answer({'concept': "automation", 'score': " ", 'explanation': "Yes."}), "'automation' has no score"),
+    (answer({'concept': "automation", 'score': None, 'explanation': "Yes."}), "'automation' has no score"),
+    (answer({'concept': "automation", 'score': 5}), "'automation' has no explanation"),
+    (answer({'concept': "automation", 'score': 5, 'explanation': "Yes."}), "Missing concepts: audit risk."),
+])
+def test_invalid_answers_are_rejected(content, problem):
+    with pytest.raises(InvalidCodingOutput, match=problem):
+        parse_codes(content, CONCEPTS)
+
+
+def test_every_problem_is_named():
+    content = answer({'concept': "staffing", 'score': 1, 'explanation': "No."},
+                     {'concept': "automation", 'score': None, 'explanation': "Yes."})
+
+    with pytest.raises(InvalidCodingOutput) as error:
+        parse_codes(content, CONCEPTS)
+
+    assert str(error.value) == ("Unknown concept 'staffing'. Concept 'automation' has no score. "
+                                "Missing concepts: automation, audit risk.")
+
+
+def test_multi_concept_selection():
+    assert is_multi_concept(ALL_CONCEPTS)
+    assert is_multi_concept(["automation"])
+    assert not is_multi_concept("automation")
+
+
+@pytest.mark.parametrize("score, expected", [(4, 4.0), ("2.5", 2.5), ("high", None), (None, None)])
+def test_numeric_score(score, expected):
+    assert numeric_score(score) == expected
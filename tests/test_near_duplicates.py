@@ -0,0 +1,111 @@
+import json
+import os
+import random
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from near_duplicates import NearDuplicateEmbeddings, NearDuplicateIndex, minhash
+from results_saver import ResultsSaver
+
+
+def paragraph(seed, words=200):
+    rng = random.Random(seed)
+    return " ".join(f"word{rng.randrange(5000)}" for _ in range(words))
+
+
+BOILERPLATE = paragraph(1)
+# The same passage with one word changed, as in next year's report
+BOILERPLATE_NEXT_YEAR = BOILERPLATE.rsplit(" ", 1)[0] + " changed"
+OTHER = paragraph(2)
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, fail=False):
+        self.embedded = []
+        self.fail = fail
+
+    def embed_documents(self, texts):
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [0.0, 1.0]
+
+
+def test_minhash_signatures():
+    assert minhash("") is None
+    assert minhash("... ---") is None
+    assert (minhash(BOILERPLATE) == minhash(BOILERPLATE)).all()
+    assert (minhash(BOILERPLATE) == minhash(BOILERPLATE_NEXT_YEAR)).mean() >= 0.9
+    assert (minhash(BOILERPLATE) == minhash(OTHER)).mean() < 0.2
+
+
+def test_index_finds_near_duplicates_only():
+    index = NearDuplicateIndex(0.9)
+    first = index.add(minhash(BOILERPLATE))
+
+    assert index.find(minhash(BOILERPLATE_NEXT_YEAR)) == first
+    assert index.find(minhash(OTHER)) is None
+
+    index.truncate(0)
+    assert index.find(minhash(BOILERPLATE)) is None
+
+
+def test_near_duplicates_reuse_the_vector_of_their_representative():
+    model = CountingEmbeddings()
+    embeddings = NearDuplicateEmbeddings(model, 0.9)
+
+    first = embeddings.embed_documents([BOILERPLATE, OTHER, BOILERPLATE_NEXT_YEAR])
+    second = embeddings.embed_documents([BOILERPLATE_NEXT_YEAR, ""])
+
+    assert model.embedded == [BOILERPLATE, OTHER, ""]
+    assert first[2] == first[0]
+    assert second[0] == first[0]
+    assert (embeddings.texts, embeddings.reused) == (5, 2)
+
+
+def test_a_failed_request_forgets_its_signatures():
+    embeddings = NearDuplicateEmbeddings(CountingEmbeddings(fail=True), 0.9)
+    with pytest.raises(RuntimeError):
+        embeddings.embed_documents([BOILERPLATE])
+
+    embeddings.embeddings = CountingEmbeddings()
+    embeddings.embed_documents([BOILERPLATE_NEXT_YEAR])
+    assert embeddings.embeddings.embedded == [BOILERPLATE_NEXT_YEAR]
+
+
+def chunk(text, file, chunk_number):
+    return Document(page_content=text, metadata={'file': file, 'chunk': chunk_number, 'start': 0, 'page': None})
+
+
+def test_collapsed_results_keep_one_row_per_passage(tmp_path):
+    with ResultsSaver.relevant_chunks(str(tmp_path), "risk", "20240101_000000", "jsonl", 0.9) as saver:
+        saver.save_relevant_chunks("/reports/2022.txt", [(chunk(BOILERPLATE, "/reports/2022.txt", 1), 0.7),
+                                                         (chunk(OTHER, "/reports/2022.txt", 2), 0.6)])
+        saver.save_relevant_chunks("/reports/2023.txt", [(chunk(BOILERPLATE_NEXT_YEAR, "/reports/2023.txt", 4), 0.8)])
+        saver.save_relevant_chunks("/reports/2024.txt", [(chunk(BOILERPLATE, "/reports/2024.txt", 1), 0.75)])
+        # Nothing is written before the run is complete
+        saver.flush()
+        assert not os.path.exists(saver.full_file_path)
+    with open(saver.full_file_path, encoding='utf-8') as results_file:
+        rows = [json.loads(line) for line in results_file]
+
+    assert [(row['text_chunk'], row['file'], row['chunk'], row['score'], row['occurrences'], row['files'])
+            for row in rows] == [
+        (BOILERPLATE_NEXT_YEAR, "2023.txt", 4, 0.8, 3, ["2022.txt", "2023.txt", "2024.txt"]),
+        (OTHER, "2022.txt", 2, 0.6, 1, ["2022.txt"]),
+    ]
+
+
+def test_collapsed_results_without_chunks(tmp_path):
+    with ResultsSaver.relevant_chunks(str(tmp_path), "risk", "20240101_000000", "csv", 0.9) as saver:
+        saver.save_relevant_chunks("/reports/2022.txt", [])
+    with open(saver.full_file_path, encoding='utf-8') as results_file:
+        lines = results_file.read().splitlines()
+
+    assert lines == ["file,text_chunk,score,occurrences,files",
+                     "No relevant documents found above the similarity threshold.,,"]
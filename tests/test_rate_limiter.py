@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from rate_limiter import BACKOFF_SECONDS, RateLimiter, TokenBucket, retry_after
+
+
+def api_error(error_class, status, headers=None, code=None):
+    request = httpx.Request('POST', "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return error_class("error", response=response, body={'code': code} if code else None)
+
+
+def rate_limited(retry_after_ms="0"):
+    return api_error(openai.RateLimitError, 429, {'retry-after-ms': retry_after_ms})
+
+
+def failing(*errors, result="done"):
+    # A request that raises ``errors`` one after the other and then returns ``result``
+    errors = list(errors)
+    calls = []
+
+    def request():
+        calls.append(time.monotonic())
+        if errors:
+            raise errors.pop(0)
+        return result
+    request.calls = calls
+    return request
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+    return delays
+
+
+def test_rate_limited_requests_are_retried_after_the_requested_wait(sleeps):
+    limiter = RateLimiter('llm', max_concurrency=16)
+    request = failing(rate_limited("0"), rate_limited("0"))
+
+    assert limiter.call(request, 10) == "done"
+
+    assert len(request.calls) == 3
+    assert (limiter.rate_limited, limiter.retried, limiter.in_flight) == (2, 2, 0)
+    assert sleeps == [0.0, 0.0]
+    # Halved twice, since each retry was sent after the previous decrease, then grown back by 1 / slots
+    assert limiter.concurrency == pytest.approx(4.25)
+
+
+def test_server_errors_back_off_exponentially_with_jitter(sleeps):
+    limiter = RateLimiter('llm', max_concurrency=4)
+    request = failing(*(api_error(openai.InternalServerError, 500) for _ in range(3)))
+
+    assert limiter.call(request, 10) == "done"
+
+    assert (limiter.rate_limited, limiter.retried, limiter.in_flight) == (0, 3, 0)
+    for attempt, delay in enumerate(sleeps):
+        assert BACKOFF_SECONDS * 2 ** attempt * 0.5 <= delay <= BACKOFF_SECONDS * 2 ** attempt
+    assert limiter.concurrency == 4
+
+
+def test_final_errors_are_raised_and_release_the_slot(sleeps):
+    limiter = RateLimiter('llm', max_retries=2)
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(failing(*(rate_limited() for _ in range(3))), 10)
+    assert (limiter.rate_limited, limiter.retried, limiter.in_flight) == (3, 2, 0)
+
+    quota = api_error(openai.RateLimitError, 429, code='insufficient_quota')
+    for error in (quota, ValueError("bad request")):
+        limiter = RateLimiter('llm')
+        with pytest.raises(type(error)):
+            limiter.call(failing(error), 10)
+        assert (limiter.rate_limited, limiter.retried, limiter.in_flight) == (0, 0, 0)
+
+
+def test_async_retries_are_counted():
+    limiter = RateLimiter('embedding')
+    request = failing(rate_limited("0"))
+
+    async def send():
+        return request()
+
+    assert asyncio.run(limiter.call_async(send, 10)) == "done"
+    assert (limiter.rate_limited, limiter.retried, limiter.in_flight) == (1, 1, 0)
+
+
+def test_cancelled_requests_release_their_slot():
+    limiter = RateLimiter('llm', max_concurrency=1)
+    started = []
+
+    async def hang():
+        started.append(True)
+        await asyncio.sleep(60)
+
+    async def quick():
+        return "done"
+
+    async def main():
+        hanging = asyncio.create_task(limiter.call_async(hang, 10))
+        while not started:
+            await asyncio.sleep(0)
+        waiting = asyncio.create_task(limiter.call_async(quick, 10))
+        await asyncio.sleep(0.05)
+        assert limiter.in_flight == 1 and not waiting.done()
+
+        hanging.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await hanging
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(main()) == "done"
+    assert (limiter.in_flight, limiter.retried) == (0, 0)
+
+
+def test_cancelling_a_waiting_request_takes_no_slot():
+    limiter = RateLimiter('llm', max_concurrency=1)
+    release = None
+
+    async def hold():
+        await release.wait()
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        holding = asyncio.create_task(limiter.call_async(hold, 10))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(limiter.call_async(hold, 10))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        release.set()
+        await holding
+
+    asyncio.run(main())
+    assert limiter.in_flight == 0
+    assert limiter._async_waiters == {}
+
+
+def test_waiting_requests_are_woken_when_a_slot_is_released():
+    limiter = RateLimiter('llm', max_concurrency=2)
+
+    async def request():
+        await asyncio.sleep(0.1)
+
+    async def main():
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.call_async(request, 10) for _ in range(6)))
+        return time.monotonic() - started
+
+    # Three rounds of two requests
+    assert 0.3 <= asyncio.run(main()) < 0.45
+    assert limiter.in_flight == 0
+
+
+def test_a_slot_released_by_a_thread_wakes_a_task():
+    limiter = RateLimiter('llm', max_concurrency=1)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        holding.set()
+        release.wait()
+
+    thread = threading.Thread(target=limiter.call, args=(hold, 10))
+    thread.start()
+    holding.wait()
+
+    async def quick():
+        return time.monotonic()
+
+    threading.Timer(0.1, release.set).start()
+    released = time.monotonic() + 0.1
+    admitted = asyncio.run(limiter.call_async(quick, 10))
+    thread.join()
+
+    assert released <= admitted < released + 0.05
+    assert limiter.in_flight == 0
+
+
+def test_token_bucket_waits_for_its_refill():
+    bucket = TokenBucket(per_minute=600)
+    now = time.monotonic()
+    bucket.take(10, now)
+
+    assert bucket.wait_time(5, now) == pytest.approx(0.5)
+    assert bucket.wait_time(5, now + 0.5) == pytest.approx(0.0)
+    # A request larger than the bucket waits for a full bucket only
+    assert bucket.wait_time(100, now + 0.5) == pytest.approx(0.5)
+
+
+def test_retry_after_headers():
+    assert retry_after(rate_limited("1500")) == 1.5
+    assert retry_after(api_error(openai.RateLimitError, 429, {'retry-after': "2"})) == 2.0
+    assert retry_after(api_error(openai.RateLimitError, 429, {'retry-after': "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+    assert retry_after(ValueError()) is None
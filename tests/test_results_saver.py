@@ -0,0 +1,112 @@
+import csv
+import json
+
+import pytest
+from langchain_core.documents import Document
+
+from results_saver import NO_RESULTS_MESSAGE, ResultsSaver
+
+CHUNKS = [
+    (Document(page_content="Invoices are matched automatically.", metadata={'chunk': 3, 'start': 120, 'page': 2}),
+     0.91),
+    (Document(page_content="The board reviews \"audit\" risk, yearly.", metadata={'chunk': 7, 'start': 480, 'page': 4}),
+     0.5),
+]
+EXPECTED_ROWS = [
+    {'file': "report.pdf", 'concept': "automation", 'chunk': 3, 'chunk_offset': 120, 'page': 2, 'score': 0.91,
+     'text_chunk': "Invoices are matched automatically.", 'model_response': None},
+    {'file': "report.pdf", 'concept': "automation", 'chunk': 7, 'chunk_offset': 480, 'page': 4, 'score': 0.5,
+     'text_chunk': "The board reviews \"audit\" risk, yearly.", 'model_response': None},
+    {'file': "empty.txt", 'concept': "automation", 'chunk': None, 'chunk_offset': None, 'page': None, 'score': None,
+     'text_chunk': None, 'model_response': None},
+]
+
+
+def save_chunks(tmp_path, result_format):
+    with ResultsSaver.relevant_chunks(str(tmp_path), "automation", "20240101_000000", result_format) as saver:
+        saver.save_relevant_chunks("/reports/report.pdf", CHUNKS)
+        saver.save_relevant_chunks("/reports/empty.txt", [])
+    return saver.full_file_path
+
+
+def test_txt_round_trip(tmp_path):
+    with open(save_chunks(tmp_path, "txt"), encoding='utf-8') as results_file:
+        text = results_file.read()
+
+    blocks = text.split("Relevant Context for Concept: automation\n")
+    assert blocks[0] == ""
+    assert len(blocks) == 3
+    assert ("File: report.pdf\nText Chunk:\nInvoices are matched automatically.\nScore: 0.91\n" + "-" * 50 + "\n"
+            + "File: report.pdf\nText Chunk:\nThe board reviews \"audit\" risk, yearly.\nScore: 0.5\n") in blocks[1]
+    assert blocks[2] == "=" * 50 + "\n" + NO_RESULTS_MESSAGE + "\n"
+
+
+def test_csv_round_trip(tmp_path):
+    with open(save_chunks(tmp_path, "csv"), newline='', encoding='utf-8') as results_file:
+        rows = list(csv.reader(results_file))
+
+    assert rows == [
+        ['file', 'text_chunk', 'score'],
+        ['report.pdf', "Invoices are matched automatically.", '0.91'],
+        ['report.pdf', "The board reviews \"audit\" risk, yearly.", '0.5'],
+        [NO_RESULTS_MESSAGE, '', ''],
+    ]
+
+
+def test_jsonl_round_trip(tmp_path):
+    with open(save_chunks(tmp_path, "jsonl"), encoding='utf-8') as results_file:
+        rows = [json.loads(line) for line in results_file]
+
+    assert rows == EXPECTED_ROWS
+
+
+def test_parquet_round_trip(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    table = pq.read_table(save_chunks(tmp_path, "parquet"))
+
+    assert table.column_names == list(EXPECTED_ROWS[0])
+    assert table.to_pylist() == EXPECTED_ROWS
+
+
+@pytest.mark.parametrize("result_format", ["txt", "csv", "jsonl"])
+def test_rows_are_appended_to_an_existing_file(tmp_path, result_format):
+    first = save_chunks(tmp_path, result_format)
+    with open(first, encoding='utf-8') as results_file:
+        before = results_file.read()
+
+    assert save_chunks(tmp_path, result_format) == first
+    with open(first, encoding='utf-8') as results_file:
+        after = results_file.read()
+    # A csv header is only written to a new file
+    assert after == before + (before.split("\n", 1)[1] if result_format == "csv" else before)
+
+
+def test_parquet_of_a_resumed_run_is_written_to_a_new_part(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    first = save_chunks(tmp_path, "parquet")
+    second = save_chunks(tmp_path, "parquet")
+
+    assert second == first[:-len(".parquet")] + ".part1.parquet"
+    assert pq.read_table(second).to_pylist() == EXPECTED_ROWS
+
+
+def test_responses_and_codes(tmp_path):
+    with ResultsSaver.fully_automated(str(tmp_path), "20240101_000000", "jsonl", ["automation", "risk"]) as saver:
+        saver.save_response("/reports/a.txt", "4; Mostly automated.")
+        saver.save_codes("/reports/b.txt", [{'concept': "automation", 'score': 2, 'explanation': "Manual."},
+                                            {'concept': "risk", 'score': 5, 'explanation': "Audited."}])
+    with open(saver.full_file_path, encoding='utf-8') as results_file:
+        rows = [json.loads(line) for line in results_file]
+
+    assert [(row['file'], row['concept'], row['score'], row['model_response']) for row in rows] == [
+        ("a.txt", "automation, risk", None, "4; Mostly automated."),
+        ("b.txt", "automation", 2.0, "2; Manual."),
+        ("b.txt", "risk", 5.0, "5; Audited."),
+    ]
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResultsSaver(str(tmp_path / "results.xml"), "xml", "automation")
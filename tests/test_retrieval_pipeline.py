@@ -0,0 +1,17 @@
+import pytest
+
+from llm_coder_cli import build_tool_config, parse_args
+from retrieval_pipeline import RetrievalPipeline
+
+
+@pytest.mark.parametrize("concept_input", ['', [], ["staffing"]])
+def test_retrieval_needs_a_concept_with_a_description(workspace, concept_input):
+    report = workspace / "report.txt"
+    report.write_text("Invoices are matched by the ERP system.", encoding='utf-8')
+    tool_config = build_tool_config(parse_args(['retrieval', str(report), '--save-path', str(workspace)]))
+    tool_config.concept_input = concept_input
+
+    with pytest.raises(ValueError, match="None of the selected concepts"):
+        RetrievalPipeline(tool_config)
+    # Nothing was extracted, embedded or saved
+    assert sorted(path.name for path in workspace.iterdir()) == ["prompt_config.ini", "report.txt"]
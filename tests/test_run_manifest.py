@@ -0,0 +1,152 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmark import SimulatedChatModel
+from coding_pipeline import CodingPipeline
+from llm_coder_cli import build_tool_config, parse_args
+from results_saver import ResultsSaver
+from run_manifest import STATUS_COMPLETED, STATUS_FAILED, STATUS_PENDING, RunManifest
+
+SETTINGS = {'prompt': "Code the text.", 'concepts': ["automation"], 'model': "gpt-4o", 'chunk_size': 200}
+
+
+def make_files(tmp_path, *names):
+    files = []
+    for name in names:
+        path = tmp_path / name
+        path.write_text(f"Text of {name}.", encoding='utf-8')
+        files.append(str(path))
+    return files
+
+
+def statuses(manifest):
+    return {file: entry['status'] for file, entry in manifest.files.items()}
+
+
+def test_resume_skips_completed_files_and_retries_the_others(tmp_path):
+    completed, failed, pending, changed = make_files(tmp_path, "a.txt", "b.txt", "c.txt", "d.txt")
+    files = [completed, failed, pending, changed]
+    first = RunManifest(str(tmp_path), 'coding', SETTINGS)
+    assert first.start(files) == files
+    first.expect(completed, 0)
+    first.failed(failed, OSError("unreadable"))
+    first.expect(changed, 0)
+    (tmp_path / "d.txt").write_text("Edited text.", encoding='utf-8')
+
+    resumed = RunManifest(str(tmp_path), 'coding', SETTINGS, resume=True)
+
+    assert resumed.resumed
+    assert resumed.timestamp == first.timestamp
+    assert resumed.start(files) == [failed, pending, changed]
+    assert resumed.skipped == 1
+    assert statuses(resumed) == {completed: STATUS_COMPLETED, failed: STATUS_PENDING, pending: STATUS_PENDING,
+                                 changed: STATUS_PENDING}
+
+
+def test_failures_are_recorded_in_the_manifest_file(tmp_path):
+    file, = make_files(tmp_path, "a.txt")
+    manifest = RunManifest(str(tmp_path), 'retrieval', SETTINGS)
+    manifest.start([file])
+
+    manifest.failed(file, ValueError("no text"))
+
+    with open(manifest.path, encoding='utf-8') as manifest_file:
+        entry = json.load(manifest_file)['files'][file]
+    assert entry['status'] == STATUS_FAILED
+    assert entry['error'] == "ValueError: no text"
+    assert manifest.counts() == {STATUS_COMPLETED: 0, STATUS_FAILED: 1, STATUS_PENDING: 0}
+
+
+def test_changed_settings_or_no_resume_start_a_new_run(tmp_path):
+    file, = make_files(tmp_path, "a.txt")
+    manifest = RunManifest(str(tmp_path), 'coding', SETTINGS)
+    manifest.start([file])
+    manifest.expect(file, 0)
+
+    other_settings = RunManifest(str(tmp_path), 'coding', dict(SETTINGS, chunk_size=400), resume=True)
+    not_resumed = RunManifest(str(tmp_path), 'coding', SETTINGS)
+
+    assert other_settings.path != manifest.path
+    assert not other_settings.resumed
+    assert other_settings.start([file]) == [file]
+    assert not not_resumed.resumed
+    assert not_resumed.start([file]) == [file]
+
+
+def test_a_file_is_completed_once_every_saver_flushed_its_rows(tmp_path):
+    file, = make_files(tmp_path, "a.txt")
+    manifest = RunManifest(str(tmp_path), 'retrieval', SETTINGS)
+    manifest.start([file])
+    savers = [ResultsSaver(str(tmp_path / f"{concept}.jsonl"), 'jsonl', concept) for concept in ("risk", "audit")]
+    for saver in savers:
+        saver.on_flush = manifest.saved
+    manifest.expect(file, len(savers))
+
+    for saver in savers:
+        saver.save_relevant_chunks(file, [])
+    savers[0].flush()
+    assert statuses(manifest)[file] == STATUS_PENDING
+    savers[1].flush()
+    assert statuses(manifest)[file] == STATUS_COMPLETED
+
+    resumed = RunManifest(str(tmp_path), 'retrieval', SETTINGS, resume=True)
+    assert resumed.start([file]) == []
+
+
+def test_missing_files_stay_pending(tmp_path):
+    missing = str(tmp_path / "missing.txt")
+    manifest = RunManifest(str(tmp_path), 'coding', SETTINGS)
+
+    assert manifest.start([missing]) == [missing]
+    assert manifest.files[missing]['file_hash'] is None
+
+
+KILLED_RUN = """
+import os, sys
+sys.path.insert(0, {root!r})
+import results_saver
+from benchmark import SimulatedChatModel
+from coding_pipeline import CodingPipeline
+from llm_coder_cli import build_tool_config, parse_args
+
+# Files are checkpointed as soon as they are saved
+results_saver.CHECKPOINT_SECONDS = 0
+
+
+class DyingChatModel(SimulatedChatModel):
+    async def ainvoke(self, messages, **kwargs):
+        if self.requests == {answers}:
+            # Killed without any cleanup, like SIGKILL or a power loss
+            os._exit(9)
+        return await super().ainvoke(messages, **kwargs)
+
+
+args = parse_args(['coding', *{files!r}, '--save-path', '.', '--max-in-flight', '1'])
+CodingPipeline(build_tool_config(args), llm=DyingChatModel()).run()
+"""
+
+
+def test_a_killed_coding_run_resumes_after_its_last_saved_file(workspace):
+    files = []
+    for number in range(6):
+        path = workspace / f"report_{number}.txt"
+        path.write_text(f"Report {number} on the automation of invoice matching.", encoding='utf-8')
+        files.append(str(path))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    killed = subprocess.run([sys.executable, '-c', KILLED_RUN.format(root=root, answers=3, files=files)],
+                            cwd=workspace, capture_output=True, text=True)
+    assert killed.returncode == 9, killed.stderr
+
+    args = parse_args(['coding', *files, '--save-path', '.', '--max-in-flight', '1', '--resume'])
+    pipeline = CodingPipeline(build_tool_config(args), llm=SimulatedChatModel())
+    pipeline.run()
+
+    assert pipeline.manifest.skipped == 3
+    assert pipeline.files == files[3:]
+    assert pipeline.llm.requests == 3
+    assert statuses(pipeline.manifest) == {file: STATUS_COMPLETED for file in files}
+    with open(pipeline.results_saver.full_file_path, encoding='utf-8') as results_file:
+        saved = [line.split(" - ")[1] for line in results_file.read().splitlines()]
+    assert saved == [f"report_{number}.txt" for number in range(6)]
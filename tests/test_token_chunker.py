@@ -0,0 +1,100 @@
+import mmap
+import random
+
+import pytest
+
+import file_utils
+from file_utils import FileUtils
+from token_chunker import TokenChunker
+
+WORDS = ("automatically reconciliation the board of directors audit risk Übernahme 2023 revenue, "
+         "process-automation (ERP) systems; digitalisation").split()
+
+
+def make_pages(count=40, seed=1):
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15))) for _ in range(rng.randint(2, 8))]
+        pages.append("\n".join(lines) + rng.choice(["\n", "\n\n", " ", ""]))
+    return pages
+
+
+def in_memory(text, chunk_tokens, overlap_tokens, page_starts=None):
+    return [(record, record.text(text))
+            for record in TokenChunker(chunk_tokens, overlap_tokens).chunk(text, page_starts)]
+
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(10, 3), (20, 5), (7, 0)])
+def test_streamed_pages_equal_in_memory_chunks(chunk_tokens, overlap_tokens):
+    pages = make_pages()
+    text = "".join(pages)
+    # Several buffers are needed for the text, so chunks are carried over between them
+    assert len(text) > 4 * chunk_tokens * 32 * 4
+
+    streamed = list(TokenChunker(chunk_tokens, overlap_tokens).chunk_pages(pages))
+
+    assert streamed == in_memory(text, chunk_tokens, overlap_tokens, FileUtils.page_starts(pages))
+
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(10, 3), (50, 10), (200, 50)])
+def test_streamed_txt_file_equals_in_memory_chunks(tmp_path, monkeypatch, chunk_tokens, overlap_tokens):
+    # Blocks of one memory page cut words, line breaks and multi-byte characters
+    monkeypatch.setattr(file_utils, 'TEXT_BLOCK_SIZE', mmap.PAGESIZE)
+    path = tmp_path / "transcript.txt"
+    # With this seed a block boundary falls inside a word of several tokens
+    path.write_bytes(("".join(make_pages(seed=2)) * 3).replace("\n", "\r\n").encode('utf-8'))
+    text = FileUtils.read_text(str(path))
+    assert len(list(FileUtils.iter_text(str(path)))) > 1
+
+    streamed = list(FileUtils.split_pages(FileUtils.iter_text(str(path)), chunk_tokens, overlap_tokens, paged=False))
+
+    assert streamed == in_memory(text, chunk_tokens, overlap_tokens)
+    assert all(record.page is None for record, _ in streamed)
+
+
+def test_streamed_text_without_line_breaks_equals_in_memory_chunks():
+    rng = random.Random(2)
+    blocks = [" ".join(rng.choice(WORDS) for _ in range(200)) + " " for _ in range(20)]
+
+    streamed = list(TokenChunker(10, 2).chunk_pages(blocks, paged=False))
+
+    assert streamed == in_memory("".join(blocks), 10, 2)
+
+
+def test_pages_are_one_based():
+    pages = ["First page text.\n" * 30, "Second page.\n" * 30, "Third page.\n" * 30]
+    text = "".join(pages)
+    page_starts = FileUtils.page_starts(pages)
+
+    streamed = list(TokenChunker(20, 0).chunk_pages(pages))
+
+    assert streamed[0][0].page == 1
+    assert streamed[-1][0].page == 3
+    for record, _ in streamed:
+        expected = max(number for number, start in enumerate(page_starts, 1) if start <= record.start)
+        assert record.page == expected
+    assert [record.page for record, _ in streamed] == [record.page for record, _ in in_memory(text, 20, 0, page_starts)]
+
+
+def test_chunks_overlap_and_cover_the_text():
+    text = "".join(make_pages(5))
+
+    records = TokenChunker(20, 5).chunk(text)
+
+    assert records[0].start == 0
+    assert records[-1].end == len(text)
+    for previous, record in zip(records, records[1:]):
+        assert record.start < previous.end
+    assert all(record.page is None for record in records)
+
+
+def test_empty_text_has_no_chunks():
+    assert TokenChunker(10, 2).chunk("") == []
+    assert list(TokenChunker(10, 2).chunk_pages([])) == []
+
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(0, 0), (10, 10), (10, -1)])
+def test_invalid_settings_are_rejected(chunk_tokens, overlap_tokens):
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_tokens, overlap_tokens)
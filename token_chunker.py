@@ -0,0 +1,149 @@
+from bisect import bisect_right
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+import tiktoken
+
+# Encoding of the OpenAI embedding models, so chunks stay inside their token limit
+CHUNK_ENCODING = "cl100k_base"
+DEFAULT_CHUNK_OVERLAP = 50
+# Characters per token is roughly 4 for English; used to size the streaming buffer
+CHARS_PER_TOKEN = 4
+CHUNKS_PER_BUFFER = 32
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name):
+    return tiktoken.get_encoding(encoding_name)
+
+
+class ChunkRecord(NamedTuple):
+    # Character offsets into the extracted document text; page is 1-based and None for .txt files
+    start: int
+    end: int
+    page: Optional[int]
+
+    def text(self, source):
+        return source[self.start:self.end]
+
+
+class TokenChunker:
+    """Cuts text into windows of ``chunk_tokens`` tokens that overlap by ``overlap_tokens``.
+
+    The text is tokenized once and chunks are returned as ChunkRecord offsets into it
+    rather than as copied substrings.
+    """
+
+    def __init__(self, chunk_tokens, overlap_tokens=DEFAULT_CHUNK_OVERLAP, encoding_name=CHUNK_ENCODING):
+        chunk_tokens = int(chunk_tokens)
+        overlap_tokens = int(overlap_tokens)
+        if chunk_tokens <= 0:
+            raise ValueError("The chunk size must be at least one token.")
+        if not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("The chunk overlap must be smaller than the chunk size.")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = get_encoding(encoding_name)
+
+    def chunk(self, text, page_starts=None):
+        """Returns the ChunkRecords of ``text``; ``page_starts`` holds the offset at which each PDF page begins."""
+        spans, _ = self._windows(self._token_offsets(text), len(text), final=True)
+        return [ChunkRecord(start, end, page_for(page_starts, 1, start)) for start, end in spans]
+
+    def chunk_pages(self, pages, paged=True):
+        """Chunks an iterable of page texts (or text blocks when ``paged`` is False) incrementally.
+
+        Yields (ChunkRecord, chunk text) pairs, the same as chunk gives for the joined text.
+        Only a buffer of a few dozen chunks is kept. Each buffer is tokenized up to a point
+        where a token starts in any case, and the tokens after the last complete chunk are
+        carried over to the next buffer.
+        """
+        buffer_limit = CHUNKS_PER_BUFFER * self.chunk_tokens * CHARS_PER_TOKEN
+        buffer = ''
+        base = 0
+        # Offsets into buffer of the tokens of buffer[:tokenized]
+        offsets = []
+        tokenized = 0
+        page_starts = []
+        first_page = 1
+        for page in pages:
+            page_starts.append(base + len(buffer))
+            buffer += page
+            if len(buffer) < buffer_limit:
+                continue
+
+            cut = token_boundary(buffer, tokenized)
+            offsets.extend(tokenized + offset for offset in self._token_offsets(buffer[tokenized:cut]))
+            tokenized = cut
+            spans, carry = self._windows(offsets, tokenized, final=False)
+            for start, end in spans:
+                yield (ChunkRecord(base + start, base + end, page_for(page_starts, first_page, base + start, paged)),
+                       buffer[start:end])
+            shift = offsets[carry] if carry < len(offsets) else tokenized
+            buffer = buffer[shift:]
+            offsets = [offset - shift for offset in offsets[carry:]]
+            tokenized -= shift
+            base += shift
+            # Forget pages that end before the carried text
+            while len(page_starts) > 1 and page_starts[1] <= base:
+                page_starts.pop(0)
+                first_page += 1
+
+        offsets.extend(tokenized + offset for offset in self._token_offsets(buffer[tokenized:]))
+        spans, _ = self._windows(offsets, len(buffer), final=True)
+        for start, end in spans:
+            yield (ChunkRecord(base + start, base + end, page_for(page_starts, first_page, base + start, paged)),
+                   buffer[start:end])
+
+    def _token_offsets(self, text):
+        # Character offsets in text at which its tokens start
+        if not text:
+            return []
+        tokens = self.encoding.encode(text, disallowed_special=())
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        return offsets
+
+    def _windows(self, offsets, end, final):
+        # Returns the (start, end) character spans of the windows over the tokens at offsets, of a text ending at
+        # end, and, unless final, the index of the token at which the next window starts
+        step = self.chunk_tokens - self.overlap_tokens
+        spans = []
+        first = 0
+        while first < len(offsets):
+            last = first + self.chunk_tokens
+            if last >= len(offsets):
+                if not final:
+                    break
+                spans.append((offsets[first], end))
+                first = len(offsets)
+                break
+            spans.append((offsets[first], offsets[last]))
+            first += step
+        return spans, first
+
+
+def token_boundary(text, start):
+    """Returns the last offset after ``start`` at which a token starts whatever text follows.
+
+    That is after a line break followed by a character other than whitespace or, in a text
+    without such line breaks, at a space between a non-space character and a letter. The
+    tokens of the text up to there are then the same as those of the complete text. Without
+    either, the whole text is taken.
+    """
+    position = text.rfind('\n', start, len(text) - 1)
+    while position >= start:
+        if not text[position + 1].isspace():
+            return position + 1
+        position = text.rfind('\n', start, position)
+    position = text.rfind(' ', start + 1, len(text) - 1)
+    while position > start:
+        if text[position + 1].isalpha() and not text[position - 1].isspace():
+            return position
+        position = text.rfind(' ', start + 1, position)
+    return len(text)
+
+
+def page_for(page_starts, first_page, offset, paged=True):
+    if not paged or not page_starts:
+        return None
+    return first_page + bisect_right(page_starts, offset) - 1
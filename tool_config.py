@@ -1,6 +1,10 @@
 from prompt_components import PromptComponents
 from context_retrieval_config import ContextRetrievalConfig
 
+DEFAULT_MAX_IN_FLIGHT = 4
+# Tokens of document text sent to the LLM with the prompt, see context_packer
+DEFAULT_CONTEXT_TOKEN_BUDGET = 10000
+
 
 class ToolConfig:
 
@@ -10,10 +14,49 @@ class ToolConfig:
                  concept_input,
                  files_array,
                  save_path,
-                 context_retrieval_config: ContextRetrievalConfig):
+                 context_retrieval_config: ContextRetrievalConfig,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 llm_cache='use',
+                 embedding_provider='openai',
+                 debug=False,
+                 metrics_textfile=None,
+                 resume=False,
+                 long_documents='retrieve',
+                 map_parallelism=4,
+                 llm_requests_per_minute=0,
+                 llm_tokens_per_minute=0,
+                 embedding_requests_per_minute=0,
+                 embedding_tokens_per_minute=0,
+                 coding_result_format='txt',
+                 context_token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET):
         self.tool_mode = tool_mode
         self.messages = messages
         self.concept_input = concept_input
         self.files_array = files_array
         self.save_path = save_path
         self.context_retrieval_config = context_retrieval_config
+        # Number of documents that may be extracted, embedded or sent to the LLM at the same time
+        self.max_in_flight = max_in_flight
+        # 'use', 'refresh' or 'off', see llm_response_cache
+        self.llm_cache = llm_cache
+        # 'openai', 'hashing' or 'local-model', see embedding_providers
+        self.embedding_provider = embedding_provider
+        # Print every prompt and packing decision
+        self.debug = debug
+        # Prometheus textfile the run totals are written to, if any
+        self.metrics_textfile = metrics_textfile
+        # Skip the files completed by the last run with the same settings, see run_manifest
+        self.resume = resume
+        # 'retrieve' or 'map-reduce': how coding handles documents over the token budget, see map_reduce_coding
+        self.long_documents = long_documents
+        # Section and reduce requests that may be sent at the same time in map-reduce coding
+        self.map_parallelism = map_parallelism
+        # OpenAI rate limits of the account, 0 for none; requests are scheduled within them, see rate_limiter
+        self.llm_requests_per_minute = llm_requests_per_minute
+        self.llm_tokens_per_minute = llm_tokens_per_minute
+        self.embedding_requests_per_minute = embedding_requests_per_minute
+        self.embedding_tokens_per_minute = embedding_tokens_per_minute
+        # Format of the coding results file; the retrieval results follow context_retrieval_config.result_format
+        self.coding_result_format = coding_result_format
+        # Tokens of document text sent with a coding prompt; longer documents are handled as long_documents says
+        self.context_token_budget = context_token_budget